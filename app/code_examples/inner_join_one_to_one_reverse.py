@@ -9,7 +9,7 @@
 import os
 
 from django.db import connection, reset_queries
-from inventory.models import Product
+from inventory.models import Product, available_units
 
 
 def cls():
@@ -33,7 +33,8 @@ def ex15():
     """Access StockManagement from Product using .stock (reverse)"""
     reset_queries()
     product = Product.objects.select_related("stock").filter(is_active=True).first()
-    print(product.name, "→", product.stock.quantity)
+    # available counts a striped product's stripes too (one more query for those)
+    print(product.name, "→", product.stock.available)
     show_queries()
     pretty_all()
 
@@ -42,9 +43,9 @@ def ex15():
 def ex16():
     """Filter Products by conditions in their StockManagement record"""
     reset_queries()
-    qs = Product.objects.select_related("stock").filter(stock__quantity__gte=100)
+    qs = Product.objects.annotate(available=available_units("stock__")).filter(available__gte=100)
     for p in qs:
-        print(p.name, "-", p.stock.quantity)
+        print(p.name, "-", p.available)
     show_queries()
     pretty_all()
 
@@ -53,9 +54,9 @@ def ex16():
 def ex17():
     """Order Products by stock quantity using reverse one-to-one"""
     reset_queries()
-    qs = Product.objects.select_related("stock").order_by("stock__quantity")
+    qs = Product.objects.annotate(available=available_units("stock__")).order_by("available")
     for p in qs:
-        print(p.name, "→", p.stock.quantity)
+        print(p.name, "→", p.available)
     show_queries()
     pretty_all()
 
@@ -9,7 +9,7 @@ import os
 
 from django.db import connection, reset_queries
 from django.db.models import Prefetch
-from inventory.models import Order, Product
+from inventory.models import Order, Product, available_units
 
 
 def cls():
@@ -105,9 +105,11 @@ def ex24():
     """Get products and stock details for an order"""
     reset_queries()
     order = Order.objects.first()
-    for op in order.orderproduct_set.select_related("product__stock"):
+    lines = order.orderproduct_set.select_related("product").annotate(
+        available=available_units("product__stock__"))
+    for op in lines:
         product = op.product
-        print(f"{product.name} x{op.quantity} – Stock: {product.stock.quantity}")
+        print(f"{product.name} x{op.quantity} – Stock: {op.available}")
     show_queries()
     pretty_all()
 
@@ -116,7 +118,8 @@ def ex24():
 def ex25():
     """Find orders that contain products with stock < 40"""
     reset_queries()
-    qs = Order.objects.filter(products__stock__quantity__lt=40).distinct()
+    low_stock = Product.objects.annotate(available=available_units("stock__")).filter(available__lt=40)
+    qs = Order.objects.filter(products__in=low_stock.values("id")).distinct()
     for order in qs:
         print(f"Order {order.id}")
     show_queries()
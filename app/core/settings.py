@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,6 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'inventory',
     'django_extensions',
 ]
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'inventory.query_budget.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -145,4 +148,50 @@ SHELL_PLUS_IMPORTS = [
     "from code_examples.avg_examples import *",
     "from code_examples.count_examples import *",
     "from code_examples.sum_examples import *",
-]
\ No newline at end of file
+]
+
+# Query budgets (inventory/query_budget.py)
+# "log", "warn" or "raise" when a route exceeds its @query_budget or repeats
+# one SQL shape more than QUERY_BUDGET_MAX_REPEATS times (likely N+1).
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "log")
+QUERY_BUDGET_MAX_REPEATS = 5
+# optional budget applied by the middleware to every request
+QUERY_BUDGET_DEFAULT = None
+
+# Response cache (inventory/caching.py). The version counters that
+# invalidate it must live in a cache every process shares: the server
+# workers and the manage.py writers (load_catalog, seed, rebalance_stock)
+# bump them. With a per process LocMemCache a bump from the command line
+# never reaches the server, which keeps serving stale listings until
+# INVENTORY_CACHE_TIMEOUT.
+#
+# Production must use redis (INVENTORY_REDIS_URL) or memcached: their incr
+# is atomic across processes and hosts. Without one the file cache below
+# is used, for development on a single machine only. Its incr is a read
+# and a rewrite, so two processes bumping at once can lose a bump, and
+# every write lists the whole directory to decide what to cull.
+# The test runner (core/test_runner.py) uses a directory of its own.
+if os.getenv("INVENTORY_REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("INVENTORY_REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.getenv("INVENTORY_CACHE_DIR",
+                                  os.path.join(tempfile.gettempdir(), "django_orm_prj_cache")),
+            "OPTIONS": {
+                # culling drops random files, version counters included (they restart from the clock)
+                "MAX_ENTRIES": 20000,
+            },
+        }
+    }
+INVENTORY_CACHE_ALIAS = "default"
+# seconds; entries are invalidated by version bumps well before this
+INVENTORY_CACHE_TIMEOUT = 300
+
+TEST_RUNNER = "core.test_runner.InventoryTestRunner"
@@ -0,0 +1,41 @@
+""" Test runner for python manage.py test
+
+Runs the suite with QUERY_BUDGET_MODE="raise", so a route that goes over
+its @query_budget fails the test that called it instead of logging.
+
+Gives the run a cache directory of its own, so cache.clear() and version
+bumps in the tests never touch the cache of a local runserver. Processes
+the tests start (manage.py writers) find it through INVENTORY_CACHE_DIR.
+"""
+
+import os
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class InventoryTestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_dir = tempfile.mkdtemp(prefix="inventory_test_cache_")
+        self._environ = {name: os.environ.pop(name, None) for name in ("INVENTORY_CACHE_DIR", "INVENTORY_REDIS_URL")}
+        os.environ["INVENTORY_CACHE_DIR"] = self._cache_dir
+        self._settings = override_settings(QUERY_BUDGET_MODE="raise", CACHES={
+            "default": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": self._cache_dir,
+            }
+        })
+        self._settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._settings.disable()
+        for name, value in self._environ.items():
+            os.environ.pop(name, None)
+            if value is not None:
+                os.environ[name] = value
+        shutil.rmtree(self._cache_dir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -1,4 +1,6 @@
+from django import forms
 from django.contrib import admin
+from django.db.models import Sum
 from .models import Product,Category,Order,OrderProduct,PromotionEvent,ProductPromotionEvent,StockManagement
 
 # Register your models here.
@@ -51,12 +53,44 @@ class PromotionEventAdmin(admin.ModelAdmin):
     inlines = [ProductPromotionEventInline]
 
 
+class StockManagementForm(forms.ModelForm):
+    """ quantity is edited as the product's units on hand, stripes included """
+
+    class Meta:
+        model = StockManagement
+        fields = "__all__"
+        labels = {"quantity": "Units on hand"}
+        help_texts = {"quantity": "All units of the product. On a striped product the new total "
+                                  "is spread over its stripes on save."}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.initial["quantity"] = self.instance.available
+
+    def save(self, commit=True):
+        stock = self.instance
+        if stock.pk is not None:
+            # the row keeps what the stripes don't hold, StockManagement.save() spreads it
+            in_stripes = stock.stripes.aggregate(units=Sum("quantity"))["units"] or 0
+            stock.quantity = self.cleaned_data["quantity"] - in_stripes
+        return super().save(commit)
+
+
 @admin.register(StockManagement)
 class StockManagementAdmin(admin.ModelAdmin):
-    list_display = ["product", "quantity", "last_checked_at"]
+    form = StockManagementForm
+    list_display = ["product", "available", "stripe_count", "last_checked_at"]
     autocomplete_fields = ["product"]
     readonly_fields = ["last_checked_at"]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_available()
+
+    @admin.display(description="Available", ordering="available")
+    def available(self, stock):
+        return stock.available
+
 '''
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -68,6 +102,7 @@ class UserAdmin(admin.ModelAdmin):
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ["id", "user", "created_date", "updated_date"]
+    list_select_related = ["user"]
     search_fields = ["user__username", "id"]
     ordering = ["-created_date"]
     inlines = [OrderProductInline]
@@ -76,6 +111,8 @@ class OrderAdmin(admin.ModelAdmin):
 @admin.register(OrderProduct)
 class OrderProductAdmin(admin.ModelAdmin):
     list_display = ["order", "product", "quantity"]
+    # Order.__str__ reads order.user
+    list_select_related = ["order__user", "product"]
     autocomplete_fields = ["order", "product"]
 
 
@@ -0,0 +1,437 @@
+""" HTTP benchmark for the Ninja routers
+
+A run replays a weighted mix of ENDPOINTS against a seeded database
+(python manage.py seed) and reports per endpoint p50 / p95 / p99 latency,
+throughput and queries per request (from QueryBudgetMiddleware's
+X-DB-Queries / X-DB-Time-Ms headers).
+
+Every read endpoint of module5/module6 also has an async twin (same
+request under the router's /async/ prefix, named <endpoint>.async), so
+sweep() can compare how both scale with concurrency.
+
+Two clients:
+  - AsgiClient calls core.asgi.application in process, no sockets, so
+    the numbers are Django + ORM + database only
+  - HttpClient talks HTTP/1.1 keep-alive to a uvicorn server
+
+The request plan (which endpoint, which ids) is drawn from
+Random(seed) before the run, so two runs with the same seed send the
+same requests in the same order.
+"""
+
+import asyncio
+import http.client
+import json
+import math
+import random
+import statistics
+import time
+from fnmatch import fnmatch
+from urllib.parse import urlencode, urlsplit
+
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+
+from .models import Category, Product
+
+
+class Endpoint:
+    """ One benchmarked route. build(rng, fixtures, n) returns
+        (path, query dict, json body or None) for the n-th call."""
+
+    def __init__(self, name, method, weight, build, write=False, is_async=False):
+        self.name = name
+        self.method = method
+        self.weight = weight
+        self.build = build
+        self.write = write
+        self.is_async = is_async
+
+
+def _get(path, **query):
+    return lambda rng, fx, n: (path.format(**_ids(rng, fx)), query, None)
+
+
+def _ids(rng, fx):
+    return {
+        "category_id": rng.choice(fx["category_ids"]),
+        "product_id": rng.choice(fx["product_ids"]),
+    }
+
+
+def _products_by_ids(rng, fx, n):
+    return "/api/mod/6/products/by-ids/", {"ids": rng.sample(fx["product_ids"], 5)}, None
+
+
+def _price_range(path, **query):
+    def build(rng, fx, n):
+        low = rng.randint(1, 1900)
+        return path, {"min_price": low, "max_price": low + 5, **query}, None
+    return build
+
+
+def _search(rng, fx, n):
+    return "/api/mod/6/products/search/", {"q": rng.choice(fx["product_names"])}, None
+
+
+def _name_pattern(rng, fx, n):
+    return "/api/mod/6/products/name_pattern/", {"search_string": rng.choice(fx["product_slugs"])}, None
+
+
+def _negate(rng, fx, n):
+    return "/api/mod/6/products/negate/", {"name_or_slug": rng.choice(fx["product_slugs"])}, None
+
+
+def _unique(fx, n):
+    return f"bench-{fx['run']}-{n}"
+
+
+def _create_category(rng, fx, n):
+    name = _unique(fx, n)
+    return "/api/mod4/category/create/", {}, {"name": name, "slug": name, "is_active": True}
+
+
+def _update_category(rng, fx, n):
+    category_id = rng.choice(fx["category_ids"])
+    return f"/api/mod4/category/update/{category_id}/", {}, {"is_active": rng.random() < 0.85}
+
+
+def _upsert_category(rng, fx, n):
+    return "/api/mod4/category/upsert/", {}, {"name": rng.choice(fx["category_names"]), "is_active": True}
+
+
+def _product_body(rng, fx, n):
+    name = _unique(fx, n)
+    return {
+        "name": name, "slug": name, "description": "benchmark product",
+        "price": rng.randint(100, 100000) / 100, "category_id": rng.choice(fx["category_ids"]),
+    }
+
+
+def _create_product(rng, fx, n):
+    return "/api/mod4/product/create/", {}, _product_body(rng, fx, n)
+
+
+def _create_product_with_stock(rng, fx, n):
+    return "/api/mod4/create/product_with_stock/", {}, {**_product_body(rng, fx, n), "stock_quantity": 10}
+
+
+def _create_order(rng, fx, n):
+    products = rng.sample(fx["product_ids"], rng.randint(1, 5))
+    return "/api/mod4/order/create/", {}, {
+        "user_id": rng.choice(fx["user_ids"]),
+        "products": [{"product_id": p, "quantity": rng.randint(1, 3)} for p in products],
+    }
+
+
+def _create_promotion(rng, fx, n):
+    return "/api/mod4/promotion/create/", {}, {
+        "name": _unique(fx, n), "start_date": "2025-01-01", "end_date": "2025-12-31",
+        "price_reduction": 10,
+        "products": [{"product_id": p} for p in rng.sample(fx["product_ids"], 5)],
+    }
+
+
+ENDPOINTS = [
+    # module5
+    Endpoint("mod5.all", "GET", 1, _get("/api/mod5/category/all")),
+    Endpoint("mod5.first_active", "GET", 3, _get("/api/mod5/category/first-active")),
+    Endpoint("mod5.active_sorted", "GET", 2, _get("/api/mod5/category/active-sorted-name")),
+    Endpoint("mod5.non_archived", "GET", 2, _get("/api/mod5/category/active-excluding-archived")),
+    Endpoint("mod5.inactive_names", "GET", 2, _get("/api/mod5/category/inactive-names")),
+    Endpoint("mod5.names_optimized", "GET", 2, _get("/api/mod5/category/names-optimized")),
+    Endpoint("mod5.names", "GET", 2, _get("/api/mod5/category/names")),
+    # module6
+    Endpoint("mod6.categories_by_level", "GET", 4, _get("/api/mod/6/categories/", min_level=1, max_level=1)),
+    Endpoint("mod6.categories_q", "GET", 4, _get("/api/mod/6/categories/q/", active=True, min_level=0, max_level=0)),
+    Endpoint("mod6.products_active_price", "GET", 8, _price_range("/api/mod/6/products/", active=True)),
+    Endpoint("mod6.products_negate", "GET", 2, _negate),
+    Endpoint("mod6.products_name_pattern", "GET", 3, _name_pattern),
+    Endpoint("mod6.products_search", "GET", 8, _search),
+    Endpoint("mod6.products_by_ids", "GET", 8, _products_by_ids),
+    Endpoint("mod6.products_by_price_range", "GET", 4, _price_range("/api/mod/6/products/by-price-range/")),
+    Endpoint("mod6.products_slice", "GET", 4, _get("/api/mod/6/products/get_by_slice", start=0, end=20)),
+    Endpoint("mod6.categories_paginated", "GET", 4, _get("/api/mod/6/categories/paginated", is_active=True)),
+    Endpoint("mod6.categories_cursor", "GET", 6, _get("/api/mod/6/categories/cursor", is_active=True)),
+    Endpoint("mod6.products_cursor", "GET", 6, _get("/api/mod/6/products/cursor", active=True)),
+    Endpoint("mod6.category_descendants", "GET", 3, _get("/api/mod/6/categories/{category_id}/descendants")),
+    Endpoint("mod6.category_ancestors", "GET", 3, _get("/api/mod/6/categories/{category_id}/ancestors")),
+    Endpoint("mod6.category_products", "GET", 3, _get("/api/mod/6/categories/{category_id}/products", active=True)),
+    Endpoint("mod6.category_stats_list", "GET", 2, _get("/api/mod/6/categories/stats/", is_active=True)),
+    Endpoint("mod6.category_stats", "GET", 4, _get("/api/mod/6/categories/{category_id}/stats")),
+    Endpoint("mod6.categories_active", "GET", 2, _get("/api/mod/6/categories/active")),
+    # module4, writes
+    Endpoint("mod4.create_category", "POST", 1, _create_category, write=True),
+    Endpoint("mod4.update_category", "PUT", 2, _update_category, write=True),
+    Endpoint("mod4.upsert_category", "PUT", 1, _upsert_category, write=True),
+    Endpoint("mod4.create_product", "POST", 2, _create_product, write=True),
+    Endpoint("mod4.create_product_with_stock", "POST", 1, _create_product_with_stock, write=True),
+    Endpoint("mod4.create_order", "POST", 6, _create_order, write=True),
+    Endpoint("mod4.create_promotion", "POST", 1, _create_promotion, write=True),
+]
+
+ASYNC_PREFIXES = ("/api/mod5/", "/api/mod/6/")
+
+
+def async_path(path):
+    """ Path of the async twin of a module5/module6 route """
+    for prefix in ASYNC_PREFIXES:
+        if path.startswith(prefix):
+            return f"{prefix}async/{path[len(prefix):]}"
+    raise ValueError(f"{path} has no async variant.")
+
+
+def _async_twin(endpoint):
+    def build(rng, fx, n):
+        path, query, body = endpoint.build(rng, fx, n)
+        return async_path(path), query, body
+    return Endpoint(f"{endpoint.name}.async", endpoint.method, endpoint.weight, build, is_async=True)
+
+
+ENDPOINTS += [_async_twin(e) for e in ENDPOINTS if not e.write]
+
+MIXES = {
+    "mixed": lambda e: not e.is_async,
+    "read": lambda e: not e.is_async and not e.write,
+    "write": lambda e: e.write,
+    "async": lambda e: e.is_async,
+}
+
+
+def select_endpoints(mix="mixed", match=None):
+    endpoints = [e for e in ENDPOINTS if MIXES[mix](e) and (not match or fnmatch(e.name, match))]
+    if not endpoints:
+        raise ValueError("No endpoint matches the selected mix.")
+    return endpoints
+
+
+def load_fixtures(sample=500):
+    """ Ids and names the request builders pick from """
+    fixtures = {
+        "category_ids": list(Category.objects.order_by("id").values_list("id", flat=True)[:sample]),
+        "category_names": list(Category.objects.order_by("id").values_list("name", flat=True)[:sample]),
+        "product_ids": list(Product.objects.order_by("id").values_list("id", flat=True)[:sample]),
+        "user_ids": list(User.objects.order_by("id").values_list("id", flat=True)[:sample]),
+    }
+    products = Product.objects.order_by("id").values_list("name", "slug")[:sample]
+    fixtures["product_names"] = [name for name, _ in products]
+    fixtures["product_slugs"] = [slug for _, slug in products]
+    if min(len(fixtures["category_ids"]), len(fixtures["product_ids"]), len(fixtures["user_ids"])) < 5:
+        raise ValueError("Not enough data to benchmark, run `python manage.py seed` first.")
+    fixtures["run"] = format(int(time.time()), "x")
+    return fixtures
+
+
+def build_plan(endpoints, fixtures, requests, seed=0):
+    """ [(endpoint, method, path, query, body)] drawn from Random(seed) """
+    rng = random.Random(seed)
+    chosen = rng.choices(endpoints, weights=[e.weight for e in endpoints], k=requests)
+    plan = []
+    for n, endpoint in enumerate(chosen):
+        path, query, body = endpoint.build(rng, fixtures, n)
+        plan.append((endpoint, endpoint.method, path, query, body))
+    return plan
+
+
+class AsgiClient:
+    """ Calls an ASGI application directly """
+
+    def __init__(self, application):
+        self.application = application
+
+    async def request(self, method, path, query, body):
+        payload = b"" if body is None else json.dumps(body).encode()
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": urlencode(query, doseq=True).encode(),
+            "headers": [
+                (b"host", b"localhost"),
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode()),
+            ],
+            "client": ("127.0.0.1", 0),
+            "server": ("localhost", 80),
+        }
+        sent = False
+        response = {"status": None, "headers": {}, "body": []}
+
+        async def receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": payload, "more_body": False}
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = {k.decode().lower(): v.decode() for k, v in message["headers"]}
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+
+        await self.application(scope, receive, send)
+        return response["status"], response["headers"], b"".join(response["body"])
+
+    async def close(self):
+        pass
+
+
+class HttpClient:
+    """ One keep-alive HTTP/1.1 connection per worker, run in threads """
+
+    def __init__(self, url, connections):
+        parts = urlsplit(url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.pool = asyncio.Queue()
+        for _ in range(connections):
+            self.pool.put_nowait(http.client.HTTPConnection(self.host, self.port, timeout=60))
+
+    def _send(self, conn, method, path, query, body):
+        payload = None if body is None else json.dumps(body)
+        url = f"{path}?{urlencode(query, doseq=True)}" if query else path
+        conn.request(method, url, body=payload, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        return response.status, {k.lower(): v for k, v in response.getheaders()}, response.read()
+
+    async def request(self, method, path, query, body):
+        conn = await self.pool.get()
+        try:
+            return await asyncio.to_thread(self._send, conn, method, path, query, body)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+        finally:
+            self.pool.put_nowait(conn)
+
+    async def close(self):
+        while not self.pool.empty():
+            self.pool.get_nowait().close()
+
+
+def _is_error(status, body):
+    # several module4 routes report failures as 200 {"error": ...}
+    return status is None or status >= 400 or body.startswith(b'{"error"')
+
+
+async def run_plan(client, plan, concurrency=1):
+    """ Execute the plan with concurrency workers, returns (samples, seconds) """
+    queue = asyncio.Queue()
+    for call in plan:
+        queue.put_nowait(call)
+    samples = []
+
+    async def worker():
+        while not queue.empty():
+            endpoint, method, path, query, body = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                status, headers, content = await client.request(method, path, query, body)
+            except Exception:
+                status, headers, content = None, {}, b""
+            elapsed = (time.perf_counter() - start) * 1000
+            samples.append({
+                "endpoint": endpoint.name,
+                "ms": elapsed,
+                "error": _is_error(status, content),
+                "queries": int(headers.get("x-db-queries", 0)),
+                "db_ms": float(headers.get("x-db-time-ms", 0)),
+            })
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+def percentile(values, pct):
+    """ Nearest-rank percentile of a non empty list """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def _summary(samples, seconds):
+    latencies = [s["ms"] for s in samples]
+    return {
+        "requests": len(samples),
+        "errors": sum(s["error"] for s in samples),
+        "throughput_rps": round(len(samples) / seconds, 1) if seconds else None,
+        "mean_ms": round(statistics.fmean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(max(latencies), 3),
+        "queries_per_request": round(statistics.fmean(s["queries"] for s in samples), 2),
+        "max_queries": max(s["queries"] for s in samples),
+        "db_ms_per_request": round(statistics.fmean(s["db_ms"] for s in samples), 3),
+    }
+
+
+def summarize(samples, seconds):
+    """ Overall and per endpoint stats. Endpoint throughput is its share
+        of the requests completed over the whole run."""
+    by_endpoint = {}
+    for sample in samples:
+        by_endpoint.setdefault(sample["endpoint"], []).append(sample)
+    return {
+        "overall": _summary(samples, seconds),
+        "endpoints": {name: _summary(rows, seconds) for name, rows in sorted(by_endpoint.items())},
+    }
+
+
+def compare(current, previous, fields=("p50_ms", "p95_ms", "throughput_rps", "queries_per_request")):
+    """ {endpoint: {field: [previous, current, change %]}} for endpoints in both results """
+    diff = {}
+    for name, now in current["endpoints"].items():
+        before = previous.get("endpoints", {}).get(name)
+        if before is None:
+            continue
+        diff[name] = {}
+        for field in fields:
+            old, new = before.get(field), now.get(field)
+            change = round((new - old) / old * 100, 1) if old and new is not None else None
+            diff[name][field] = [old, new, change]
+    return diff
+
+
+def run_benchmark(client, endpoints, fixtures, requests, concurrency=1, warmup=0, seed=0):
+    """ Warm up, run the plan and summarize. Blocking, wraps asyncio.run() """
+    plan = build_plan(endpoints, fixtures, warmup + requests, seed)
+    # connections opened by the caller's thread are not reused by the app
+    close_old_connections()
+
+    async def main():
+        try:
+            if warmup:
+                await run_plan(client, plan[:warmup], concurrency)
+            return await run_plan(client, plan[warmup:], concurrency)
+        finally:
+            await client.close()
+
+    samples, seconds = asyncio.run(main())
+    return {"seconds": round(seconds, 3), **summarize(samples, seconds)}
+
+
+def sweep(make_client, fixtures, requests, levels, warmup=0, seed=0, match=None):
+    """ Run the sync read endpoints and their async twins at each
+        concurrency level. make_client(concurrency) returns a fresh client.
+        Both variants replay the same requests, returns one row per
+        (concurrency, variant) with the overall stats."""
+    sync_endpoints = select_endpoints("read", match)
+    names = {f"{e.name}.async" for e in sync_endpoints}
+    variants = {
+        "sync": sync_endpoints,
+        "async": [e for e in ENDPOINTS if e.name in names],
+    }
+    rows = []
+    for concurrency in levels:
+        for variant, endpoints in variants.items():
+            result = run_benchmark(make_client(concurrency), endpoints, fixtures, requests,
+                                   concurrency, warmup, seed)
+            rows.append({"concurrency": concurrency, "variant": variant,
+                         "seconds": result["seconds"], **result["overall"]})
+    return rows
@@ -0,0 +1,149 @@
+""" Versioned read-through cache and conditional GETs for Ninja list routes
+
+Every cached model has a version counter in the cache. Cache keys
+include the current version, so bumping it (bump_version) makes all the
+entries of that model unreachable at once; they expire on their own.
+Category save/delete signals bump it, and so must every write that
+skips signals (bulk_create, bulk_update, QuerySet.update, raw SQL).
+Bumps only reach other processes (server workers, manage.py commands)
+through a cache they all share, see CACHES in settings.
+
+@cached_response stores the serialized JSON body together with its ETag:
+
+    @router.get("/categories/active", response=List[CategoryOut])
+    @cached_response(Category, List[CategoryOut])
+    @query_budget(1)
+    def get_active_categories(request): ...
+
+A hit costs one or two cache reads and no queries. A request whose
+If-None-Match matches the ETag gets an empty 304.
+
+Routes over rows with an auto_now timestamp can answer conditional GETs
+without a cache: conditional_queryset() validates the filtered set with
+one MAX(updated_at) / COUNT(*) query and returns 304 for a matching
+If-None-Match before the rows are loaded or serialized:
+
+    def get_products(request, response: HttpResponse, active: bool = None):
+        return conditional_queryset(request, response, Product.objects.filter(...))
+"""
+
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Count, Max, QuerySet
+from django.http import HttpResponse, HttpResponseBase
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from pydantic import TypeAdapter
+
+
+def _cache():
+    return caches[getattr(settings, "INVENTORY_CACHE_ALIAS", "default")]
+
+
+def _timeout():
+    return getattr(settings, "INVENTORY_CACHE_TIMEOUT", 300)
+
+
+def _version_key(model):
+    return f"inventory:version:{model._meta.label_lower}"
+
+
+def get_version(model):
+    cache = _cache()
+    key = _version_key(model)
+    # a lost counter restarts from the clock, never from a number that was already used
+    cache.add(key, time.time_ns(), None)
+    return cache.get(key)
+
+
+def _bump(model):
+    cache = _cache()
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), None)
+
+
+def bump_version(model):
+    """ Invalidate every cached response of model. Bumps now, so the
+        writing request doesn't read its own stale entries, and again on
+        commit, so nothing cached from the old rows in between survives."""
+    _bump(model)
+    transaction.on_commit(lambda: _bump(model))
+
+
+def cache_key(name, version, params):
+    digest = hashlib.md5(repr(sorted(params.items())).encode()).hexdigest()
+    return f"inventory:response:{name}:{version}:{digest}"
+
+
+def json_response(body, etag, request):
+    response = (get_conditional_response(request, etag=etag)
+                or HttpResponse(body, content_type="application/json"))
+    response["ETag"] = etag
+    return response
+
+
+def cached_response(model, schema):
+    """ Cache the view's 200 result serialized with schema (the route's
+        response type) under the current version of model. A 200
+        HttpResponse is cached as it is; other results, e.g. (404, {...}),
+        are passed through uncached."""
+    adapter = TypeAdapter(schema)
+
+    def decorator(view_func):
+        name = f"{view_func.__module__}.{view_func.__name__}"
+
+        @functools.wraps(view_func)
+        def wrapper(request, **kwargs):
+            cache = _cache()
+            key = cache_key(name, get_version(model), kwargs)
+            entry = cache.get(key)
+            if entry is None:
+                result = view_func(request, **kwargs)
+                if isinstance(result, HttpResponse) and result.status_code == 200:
+                    # already serialized, e.g. by @values_response
+                    body = result.content
+                elif isinstance(result, (tuple, HttpResponseBase)):
+                    return result
+                else:
+                    if isinstance(result, QuerySet):
+                        result = list(result)
+                    body = adapter.dump_json(adapter.validate_python(result))
+                entry = (body, quote_etag(hashlib.md5(body).hexdigest()))
+                cache.set(key, entry, _timeout())
+            return json_response(*entry, request)
+
+        return wrapper
+
+    return decorator
+
+
+def conditional_queryset(request, response, queryset, field="updated_at"):
+    """ Return queryset, or a 304 when the client's If-None-Match still
+        matches it. The ETag stands for MAX(field) and COUNT(*) of the
+        filtered set: an insert or delete changes the count, a save changes
+        the auto_now field. It is set on response (Ninja's temporal response)
+        or on the 304.
+
+        No Last-Modified: MAX(field) doesn't move when a row is deleted or
+        drops out of the filter, so If-Modified-Since alone would keep
+        answering 304 for a list that lost rows. It is ignored here."""
+    state = queryset.aggregate(last_modified=Max(field), count=Count("pk"))
+    last_modified = state["last_modified"]
+    # the query string is part of the tag, two filters may match the same max and count
+    raw = f"{request.get_full_path()}|{state['count']}|{last_modified and last_modified.isoformat()}"
+    # weak: it stands for the rows, not for the exact bytes of the body
+    etag = f'W/"{hashlib.md5(raw.encode()).hexdigest()}"'
+
+    not_modified = get_conditional_response(request, etag=etag)
+    for target in (response, not_modified):
+        if target is not None:
+            target["ETag"] = etag
+    return not_modified or queryset
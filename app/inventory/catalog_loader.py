@@ -0,0 +1,279 @@
+""" Fast catalog loading for Product and Category with PostgreSQL COPY
+
+Rows are streamed with psycopg's COPY ... FROM STDIN into a temporary
+staging table and merged into the real table on slug with
+INSERT ... ON CONFLICT, so loading the same file twice is idempotent.
+
+name is unique too, and ON CONFLICT can only arbitrate one constraint.
+Before the merge the staging rows are deduplicated on slug (the last
+row of a slug wins) and rows that would break name uniqueness are taken
+out and reported instead of aborting the whole load: a name used by an
+earlier row of the file, or held by an existing row with another slug.
+Products with an unknown category_slug and categories with an unknown
+parent_slug, or one that would close a cycle, are reported the same way.
+"""
+
+import csv
+import json
+import time
+
+from django.db import NotSupportedError, connection, transaction
+
+from .caching import bump_version
+from .models import Category
+from .stats import refresh_category_stats
+from .tree import sync_levels
+
+PRODUCT_COLUMNS = ["name", "slug", "description", "is_digital", "is_active", "price", "category_slug"]
+CATEGORY_COLUMNS = ["name", "slug", "is_active", "level", "parent_slug"]
+
+FORMATS = ("csv", "ndjson")
+
+
+def read_rows(lines, columns, fmt="csv"):
+    """ Yield one list of text values (or None) per input row.
+        lines is any iterable of str lines, csv needs a header row."""
+    if fmt == "csv":
+        for record in csv.DictReader(lines):
+            yield [record.get(column) or None for column in columns]
+    elif fmt == "ndjson":
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            yield [_as_text(record.get(column)) for column in columns]
+    else:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {FORMATS}")
+
+
+def _as_text(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+REJECTED_REPORT_LIMIT = 100
+
+
+def _copy_into_stage(cursor, table, columns, rows):
+    # ON COMMIT DROP doesn't fire while the load runs inside an outer
+    # transaction, so a stage left by an earlier load is dropped first.
+    # The pg_temp. prefix keeps that from ever dropping a real table.
+    cursor.execute(f"DROP TABLE IF EXISTS pg_temp.{table}")
+    cursor.execute(
+        f"CREATE TEMP TABLE {table} (line bigserial, "
+        f"{', '.join(f'{column} text' for column in columns)}) ON COMMIT DROP"
+    )
+    staged = 0
+    with cursor.copy(f"COPY pg_temp.{table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+            staged += 1
+    return staged
+
+
+def _reject_conflicts(cursor, table, target):
+    """ Keep the last staging row of every slug and take out the rows the
+        merge can't write: no slug or name, or a name that an earlier row
+        of the file or an existing row with another slug already uses.
+        Returns the rejected rows as (line, slug, name, error)."""
+    cursor.execute(f"""
+        DELETE FROM pg_temp.{table} s
+        USING pg_temp.{table} later
+        WHERE later.slug = s.slug AND later.line > s.line
+    """)
+    cursor.execute(f"""
+        DELETE FROM pg_temp.{table} s
+        WHERE s.slug IS NULL OR s.name IS NULL
+           OR EXISTS (SELECT 1 FROM pg_temp.{table} t WHERE t.name = s.name AND t.line < s.line)
+           OR EXISTS (SELECT 1 FROM {target} x WHERE x.name = s.name AND x.slug <> s.slug)
+        RETURNING s.line, s.slug, s.name
+    """)
+    return [
+        (line, slug, name, "slug and name are required." if slug is None or name is None
+                           else "name is already used by another slug.")
+        for line, slug, name in cursor.fetchall()
+    ]
+
+
+def _reject_unknown_categories(cursor):
+    """ Take out products whose category_slug names no category, the merge
+        would drop them without a word."""
+    cursor.execute("""
+        DELETE FROM pg_temp.catalog_product_stage s
+        WHERE NOT EXISTS (SELECT 1 FROM inventory_category c WHERE c.slug = s.category_slug)
+        RETURNING s.line, s.slug, s.name, s.category_slug
+    """)
+    return [(line, slug, name, f"category_slug '{category_slug}' is not a known category."
+                               if category_slug else "category_slug is required.")
+            for line, slug, name, category_slug in cursor.fetchall()]
+
+
+def _reject_bad_parents(cursor):
+    """ Take out categories whose parent chain can't end at a root once the
+        file is merged: rows on a parent_slug cycle (through the file, or
+        through existing rows under them), then rows whose parent_slug is
+        neither in the file nor in the table, and the rows below those.
+        Two statements, however deep the file's tree is."""
+    # parents after the merge: the file's parent_slug, the stored parent for the rest
+    cursor.execute("""
+        WITH RECURSIVE parents(slug, parent_slug) AS (
+            SELECT slug, parent_slug FROM pg_temp.catalog_category_stage
+            UNION ALL
+            SELECT c.slug, p.slug
+            FROM inventory_category c JOIN inventory_category p ON p.id = c.parent_id_id
+            WHERE NOT EXISTS (SELECT 1 FROM pg_temp.catalog_category_stage s WHERE s.slug = c.slug)
+        ),
+        walk(start, slug) AS (
+            SELECT slug, parent_slug FROM pg_temp.catalog_category_stage WHERE parent_slug IS NOT NULL
+            UNION
+            SELECT w.start, p.parent_slug FROM walk w JOIN parents p ON p.slug = w.slug
+            WHERE p.parent_slug IS NOT NULL
+        )
+        DELETE FROM pg_temp.catalog_category_stage s
+        WHERE EXISTS (SELECT 1 FROM walk w WHERE w.start = s.slug AND w.slug = s.slug)
+        RETURNING s.line, s.slug, s.name
+    """)
+    cycles = cursor.fetchall()
+    rejected = [(line, slug, name, "parent_slug would make a cycle.") for line, slug, name in cycles]
+
+    # rows that reach a root through the file or an existing category, the rest are cut off
+    cursor.execute("""
+        WITH RECURSIVE rooted(slug) AS (
+            SELECT s.slug FROM pg_temp.catalog_category_stage s
+            WHERE s.parent_slug IS NULL
+               OR (NOT EXISTS (SELECT 1 FROM pg_temp.catalog_category_stage t WHERE t.slug = s.parent_slug)
+                   AND EXISTS (SELECT 1 FROM inventory_category c WHERE c.slug = s.parent_slug))
+            UNION
+            SELECT s.slug FROM pg_temp.catalog_category_stage s JOIN rooted r ON s.parent_slug = r.slug
+        )
+        DELETE FROM pg_temp.catalog_category_stage s
+        WHERE s.slug NOT IN (SELECT slug FROM rooted)
+        RETURNING s.line, s.slug, s.name, s.parent_slug
+    """)
+    cut_off = cursor.fetchall()
+    cut_slugs = {slug for _, slug, _, _ in cut_off} | {slug for _, slug, _ in cycles}
+    return rejected + [
+        (line, slug, name, f"parent_slug '{parent_slug}' is rejected too." if parent_slug in cut_slugs
+                           else f"parent_slug '{parent_slug}' is not a known category.")
+        for line, slug, name, parent_slug in cut_off
+    ]
+
+
+def _check_vendor():
+    if connection.vendor != "postgresql":
+        raise NotSupportedError("COPY catalog loading requires PostgreSQL.")
+
+
+def load_products(lines, fmt="csv"):
+    """ COPY products into a staging table and upsert them on slug.
+        category_slug must point at an existing category."""
+    _check_vendor()
+    started = time.perf_counter()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        staged = _copy_into_stage(cursor, "catalog_product_stage", PRODUCT_COLUMNS,
+                                  read_rows(lines, PRODUCT_COLUMNS, fmt))
+        rejected = _reject_conflicts(cursor, "catalog_product_stage", "inventory_product")
+        rejected += _reject_unknown_categories(cursor)
+        cursor.execute("""
+            WITH merged AS (
+                INSERT INTO inventory_product
+                    (name, slug, description, is_digital, is_active, price,
+                     created_at, updated_at, category_id_id)
+                SELECT
+                    s.name, s.slug, s.description,
+                    COALESCE(s.is_digital::boolean, false),
+                    COALESCE(s.is_active::boolean, true),
+                    s.price::numeric,
+                    now(), now(), c.id
+                FROM pg_temp.catalog_product_stage s
+                JOIN inventory_category c ON c.slug = s.category_slug
+                ORDER BY s.slug
+                ON CONFLICT (slug) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    description = EXCLUDED.description,
+                    is_digital = EXCLUDED.is_digital,
+                    is_active = EXCLUDED.is_active,
+                    price = EXCLUDED.price,
+                    category_id_id = EXCLUDED.category_id_id,
+                    updated_at = EXCLUDED.updated_at
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+            FROM merged
+        """)
+        created, updated = cursor.fetchone()
+        # COPY bypasses the Product signals
+        refresh_category_stats()
+
+    return _report(staged, created, updated, rejected, started)
+
+
+def load_categories(lines, fmt="csv"):
+    """ COPY categories into a staging table, upsert them on slug and then
+        link parents by parent_slug, which may be a row of the same file.
+        level is recomputed from the tree afterwards."""
+    _check_vendor()
+    started = time.perf_counter()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        staged = _copy_into_stage(cursor, "catalog_category_stage", CATEGORY_COLUMNS,
+                                  read_rows(lines, CATEGORY_COLUMNS, fmt))
+        rejected = _reject_conflicts(cursor, "catalog_category_stage", "inventory_category")
+        rejected += _reject_bad_parents(cursor)
+        cursor.execute("""
+            WITH merged AS (
+                INSERT INTO inventory_category (name, slug, is_active, level)
+                SELECT
+                    s.name, s.slug,
+                    COALESCE(s.is_active::boolean, true),
+                    COALESCE(s.level::smallint, 0)
+                FROM pg_temp.catalog_category_stage s
+                ORDER BY s.slug
+                ON CONFLICT (slug) DO UPDATE SET
+                    name = EXCLUDED.name,
+                    is_active = EXCLUDED.is_active,
+                    level = EXCLUDED.level
+                RETURNING (xmax = 0) AS inserted
+            )
+            SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+            FROM merged
+        """)
+        created, updated = cursor.fetchone()
+
+        # parents are linked after the merge so they can come from the same file
+        cursor.execute("""
+            UPDATE inventory_category c
+            SET parent_id_id = p.id
+            FROM pg_temp.catalog_category_stage s
+            LEFT JOIN inventory_category p ON p.slug = s.parent_slug
+            WHERE c.slug = s.slug
+              AND c.parent_id_id IS DISTINCT FROM p.id
+        """)
+        sync_levels()
+        bump_version(Category)
+
+    return _report(staged, created, updated, rejected, started)
+
+
+def _report(staged, created, updated, rejected, started):
+    elapsed = time.perf_counter() - started
+    rejected.sort()
+    return {
+        "rows": staged,
+        "created": created,
+        "updated": updated,
+        # rows replaced by a later row of the same slug, and rejected rows
+        "skipped": staged - created - updated,
+        "rejected": len(rejected),
+        "rejected_rows": [
+            {"row": line, "slug": slug, "name": name, "error": error}
+            for line, slug, name, error in rejected[:REJECTED_REPORT_LIMIT]
+        ],
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(staged / elapsed) if elapsed else staged,
+    }
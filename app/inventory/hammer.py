@@ -0,0 +1,173 @@
+""" Concurrency harness for reserve_stock()
+
+hammer() creates a few products with limited stock, then places random
+multi-line orders for them from many threads in many processes at once,
+every checkout in its own transaction like create_order. Afterwards it
+checks the invariants that oversell or lost updates would break:
+
+  - no stock went below zero
+  - for every product, initial - final stock == quantity of its order lines
+  - accepted checkouts == orders written
+
+Products are few and stock is low on purpose so most checkouts contend
+for the same rows and the later ones run out. With stripes > 1 every
+product's stock is split over that many StockStripe rows first. Run it against PostgreSQL
+(python manage.py hammer_stock); the rows it creates are removed at the
+end.
+"""
+
+import multiprocessing
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import DatabaseError, connections, transaction
+from django.db.models import Sum
+
+from .models import Category, Order, OrderProduct, Product, StockManagement, StockStripe
+from .stock import InsufficientStock, reserve_stock, set_stripes
+
+HAMMER_PREFIX = "hammer-"
+
+
+def setup(products, stock, stripes=1):
+    """ Products with stock each (split over stripes) and a user to order
+        them. Returns (user_id, product_ids)."""
+    teardown()
+    category = Category.objects.create(name=f"{HAMMER_PREFIX}category", slug=f"{HAMMER_PREFIX}category")
+    created = Product.objects.bulk_create([
+        Product(name=f"{HAMMER_PREFIX}{i}", slug=f"{HAMMER_PREFIX}{i}", price=1, category_id=category)
+        for i in range(products)
+    ])
+    StockManagement.objects.bulk_create([StockManagement(product=p, quantity=stock) for p in created])
+    if stripes > 1:
+        for product in created:
+            set_stripes(product.id, stripes)
+    user = User.objects.create(username=f"{HAMMER_PREFIX}user")
+    return user.id, [p.id for p in created]
+
+
+def teardown():
+    Order.objects.filter(user__username=f"{HAMMER_PREFIX}user").delete()
+    User.objects.filter(username=f"{HAMMER_PREFIX}user").delete()
+    # category_id is RESTRICT, products (and their stock) go first
+    Product.objects.filter(slug__startswith=HAMMER_PREFIX).delete()
+    Category.objects.filter(slug=f"{HAMMER_PREFIX}category").delete()
+
+
+def checkout(user_id, lines, hold=0):
+    """ create_order without HTTP: reserve, then write the order and its lines.
+        hold seconds are spent inside the transaction, standing in for the
+        network round trips of a remote database."""
+    with transaction.atomic():
+        reserve_stock(lines)
+        if hold:
+            time.sleep(hold)
+        order = Order.objects.create(user_id=user_id)
+        OrderProduct.objects.bulk_create([
+            OrderProduct(order=order, product_id=product_id, quantity=quantity)
+            for product_id, quantity in lines.items()
+        ])
+
+
+def _orders(seed, count, product_ids, max_lines, max_quantity):
+    rng = random.Random(seed)
+    for _ in range(count):
+        products = rng.sample(product_ids, rng.randint(1, min(max_lines, len(product_ids))))
+        yield {product_id: rng.randint(1, max_quantity) for product_id in products}
+
+
+def _thread(user_id, orders, hold, tally, lock):
+    accepted = rejected = failed = 0
+    try:
+        for lines in orders:
+            try:
+                checkout(user_id, lines, hold)
+                accepted += 1
+            except InsufficientStock:
+                rejected += 1
+            except DatabaseError:
+                # deadlocks and serialization failures would show up here
+                failed += 1
+    finally:
+        connections.close_all()
+    with lock:
+        tally["accepted"] += accepted
+        tally["rejected"] += rejected
+        tally["failed"] += failed
+
+
+def run_threads(user_id, product_ids, threads, orders, max_lines=3, max_quantity=3, seed=0, hold=0):
+    """ orders checkouts on each of threads threads, returns the outcome counts """
+    tally = {"accepted": 0, "rejected": 0, "failed": 0}
+    lock = threading.Lock()
+    workers = [
+        threading.Thread(target=_thread, args=(
+            user_id, list(_orders(seed * 1000 + n, orders, product_ids, max_lines, max_quantity)), hold,
+            tally, lock))
+        for n in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return tally
+
+
+def _process(args):
+    return run_threads(*args)
+
+
+def verify(product_ids, stock):
+    """ Invariant violations as strings, empty when none """
+    problems = []
+    remaining = dict(StockManagement.objects.with_available().filter(product_id__in=product_ids)
+                     .values_list("product_id", "available"))
+    ordered = dict(OrderProduct.objects.filter(product_id__in=product_ids)
+                   .values("product_id").annotate(total=Sum("quantity"))
+                   .values_list("product_id", "total"))
+    for product_id in product_ids:
+        left, sold = remaining[product_id], ordered.get(product_id, 0)
+        if left < 0:
+            problems.append(f"product {product_id}: stock is {left}")
+        if StockStripe.objects.filter(stock__product_id=product_id, quantity__lt=0).exists():
+            problems.append(f"product {product_id}: a stripe went below zero")
+        if stock - left != sold:
+            problems.append(f"product {product_id}: stock went {stock} -> {left} but {sold} were ordered")
+    return problems
+
+
+def hammer(products=5, stock=200, processes=4, threads=8, orders=50, max_lines=3, max_quantity=3, seed=0,
+           stripes=1, hold=0):
+    """ Run processes x threads x orders checkouts and verify the result """
+    user_id, product_ids = setup(products, stock, stripes)
+    try:
+        # children must not share the parent's database connections
+        connections.close_all()
+        started = time.perf_counter()
+        if processes > 1:
+            jobs = [(user_id, product_ids, threads, orders, max_lines, max_quantity, seed * 100 + p, hold)
+                    for p in range(processes)]
+            with multiprocessing.get_context("fork").Pool(processes) as pool:
+                results = pool.map(_process, jobs)
+        else:
+            results = [run_threads(user_id, product_ids, threads, orders, max_lines, max_quantity, seed, hold)]
+        seconds = time.perf_counter() - started
+
+        tally = {key: sum(result[key] for result in results) for key in results[0]}
+        problems = verify(product_ids, stock)
+        written = Order.objects.filter(user_id=user_id).count()
+        if written != tally["accepted"]:
+            problems.append(f"{tally['accepted']} checkouts accepted but {written} orders written")
+        return {
+            **tally,
+            "checkouts": sum(tally.values()),
+            "seconds": round(seconds, 2),
+            "checkouts_per_second": round(sum(tally.values()) / seconds, 1) if seconds else None,
+            "stock_left": sum(StockManagement.objects.with_available().filter(product_id__in=product_ids)
+                                                 .values_list("available", flat=True)),
+            "problems": problems,
+        }
+    finally:
+        teardown()
@@ -0,0 +1,188 @@
+""" Benchmark the Ninja API routers against the current database
+
+Usage:
+    python manage.py seed --scale 1
+    python manage.py bench_api --requests 2000 --concurrency 8 --output bench/HEAD.json
+    python manage.py bench_api --target uvicorn --workers 2 --compare bench/main.json
+    python manage.py bench_api --url http://localhost:8000 --mix read
+    python manage.py bench_api --target uvicorn --sweep 1,8,32 --output bench/async.json
+
+--sweep runs the sync read endpoints and their async twins at each
+concurrency level and prints how throughput and latency scale.
+
+Write calls (--mix mixed/write) create categories, products, orders and
+promotions named bench-<run>-<n> in the benchmarked database.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from inventory.bench import (
+    MIXES, AsgiClient, HttpClient, compare, load_fixtures, run_benchmark, select_endpoints, sweep,
+)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Replay a weighted mix of API calls and report latency percentiles, throughput and queries"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--target", choices=["asgi", "uvicorn"], default="asgi",
+                            help="asgi: in process, uvicorn: start a local uvicorn server")
+        parser.add_argument("--url", help="Benchmark an already running server instead")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+        parser.add_argument("--requests", type=int, default=1000)
+        parser.add_argument("--warmup", type=int, default=50)
+        parser.add_argument("--concurrency", type=int, default=4)
+        parser.add_argument("--mix", choices=list(MIXES), default="mixed")
+        parser.add_argument("--match", help='Only endpoints matching this glob, e.g. "mod6.*"')
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write the results as JSON")
+        parser.add_argument("--compare", help="Results JSON of an earlier run")
+        parser.add_argument("--sweep", help="Comma separated concurrency levels, sync vs async reads")
+
+    def handle(self, *args, **options):
+        try:
+            endpoints = select_endpoints(options["mix"], options["match"])
+            fixtures = load_fixtures()
+        except ValueError as exc:
+            raise CommandError(str(exc))
+
+        if options["sweep"]:
+            return self._sweep(fixtures, options)
+
+        previous = None
+        if options["compare"]:
+            try:
+                with open(options["compare"], encoding="utf-8") as f:
+                    previous = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read {options['compare']}: {exc}")
+
+        server, target, make_client = self._target(options)
+        try:
+            result = run_benchmark(
+                make_client(options["concurrency"]), endpoints, fixtures, options["requests"],
+                options["concurrency"], options["warmup"], options["seed"],
+            )
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+
+        report = {"meta": self._meta(target, server, options), **result}
+        if previous:
+            report["compare"] = {"commit": previous.get("meta", {}).get("commit"),
+                                 "endpoints": compare(result, previous)}
+
+        self._print(report)
+        self._write(report, options)
+
+    def _sweep(self, fixtures, options):
+        try:
+            levels = [int(level) for level in options["sweep"].split(",")]
+        except ValueError:
+            raise CommandError("--sweep takes comma separated integers, e.g. 1,8,32")
+
+        server, target, make_client = self._target(options)
+        try:
+            rows = sweep(make_client, fixtures, options["requests"], levels,
+                         options["warmup"], options["seed"], options["match"])
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+
+        self.stdout.write(f"{'concurrency':>11} {'variant':>8} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err':>4}")
+        for row in rows:
+            self.stdout.write(
+                f"{row['concurrency']:>11} {row['variant']:>8} {row['throughput_rps']:>8.1f} "
+                f"{row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} {row['p99_ms']:>8.2f} {row['errors']:>4}"
+            )
+        self._write({"meta": self._meta(target, server, options), "sweep": rows}, options)
+
+    def _target(self, options):
+        """ (uvicorn process or None, target label, make_client(concurrency)) """
+        if options["url"]:
+            return None, options["url"], lambda concurrency: HttpClient(options["url"], concurrency)
+        if options["target"] == "uvicorn":
+            server = self._start_uvicorn(options["port"], options["workers"])
+            target = f"http://127.0.0.1:{options['port']}"
+            return server, target, lambda concurrency: HttpClient(target, concurrency)
+        from core.asgi import application
+        return None, "asgi", lambda concurrency: AsgiClient(application)
+
+    def _meta(self, target, server, options):
+        return {
+            "commit": _git_commit(),
+            "created_at": timezone.now().isoformat(),
+            "vendor": connection.vendor,
+            "target": target,
+            "workers": options["workers"] if server else None,
+            "requests": options["requests"],
+            "warmup": options["warmup"],
+            "concurrency": options["sweep"] or options["concurrency"],
+            "mix": "read+async" if options["sweep"] else options["mix"],
+            "seed": options["seed"],
+        }
+
+    def _write(self, report, options):
+        if options["output"]:
+            os.makedirs(os.path.dirname(options["output"]) or ".", exist_ok=True)
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+
+    def _start_uvicorn(self, port, workers):
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": os.environ.get("DJANGO_SETTINGS_MODULE", "core.settings")}
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "core.asgi:application", "--host", "127.0.0.1",
+             "--port", str(port), "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("uvicorn exited during startup.")
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("uvicorn did not start within 30s.")
+
+    def _print(self, report):
+        header = f"{'endpoint':36} {'reqs':>6} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'q/req':>6}"
+        self.stdout.write(header)
+        rows = list(report["endpoints"].items()) + [("overall", report["overall"])]
+        for name, stats in rows:
+            self.stdout.write(
+                f"{name:36} {stats['requests']:>6} {stats['errors']:>4} {stats['p50_ms']:>8.2f} "
+                f"{stats['p95_ms']:>8.2f} {stats['p99_ms']:>8.2f} {stats['throughput_rps']:>8.1f} "
+                f"{stats['queries_per_request']:>6.2f}"
+            )
+        for name, fields in report.get("compare", {}).get("endpoints", {}).items():
+            p95 = fields["p95_ms"]
+            if p95[2] is not None and abs(p95[2]) >= 10:
+                style = self.style.ERROR if p95[2] > 0 else self.style.SUCCESS
+                self.stdout.write(style(f"{name}: p95 {p95[0]} -> {p95[1]} ms ({p95[2]:+}%)"))
@@ -0,0 +1,47 @@
+""" Load a Product or Category catalog file with PostgreSQL COPY
+
+Usage:
+    python manage.py load_catalog categories.csv --kind category
+    python manage.py load_catalog products.ndjson --kind product
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, NotSupportedError
+
+from inventory.catalog_loader import FORMATS, load_categories, load_products
+
+
+class Command(BaseCommand):
+    help = "Stream a CSV or NDJSON catalog into inventory_product/inventory_category using COPY"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV (with header row) or NDJSON file")
+        parser.add_argument("--kind", choices=["product", "category"], required=True)
+        parser.add_argument("--format", choices=FORMATS, default=None,
+                            help="Defaults to the file extension")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        fmt = options["format"] or ("ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv")
+        loader = load_products if options["kind"] == "product" else load_categories
+
+        try:
+            with open(path, newline="", encoding="utf-8") as lines:
+                result = loader(lines, fmt)
+        except (OSError, NotSupportedError, ValueError) as exc:
+            raise CommandError(str(exc))
+        except DatabaseError as exc:
+            # a value that doesn't cast (price "abc", a too long name), nothing was loaded
+            raise CommandError(f"Load rolled back: {str(exc).strip()}")
+
+        for row in result["rejected_rows"]:
+            self.stderr.write(f"row {row['row']} ({row['slug']}): {row['error']}")
+        if result["rejected"] > len(result["rejected_rows"]):
+            self.stderr.write(f"... {result['rejected'] - len(result['rejected_rows'])} more rejected rows")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['rows']} rows in {result['seconds']}s "
+            f"({result['rows_per_second']} rows/s): "
+            f"{result['created']} created, {result['updated']} updated, {result['skipped']} skipped "
+            f"({result['rejected']} rejected)"
+        ))
@@ -0,0 +1,131 @@
+""" Profile every code_examples ex* function against a seeded dataset
+
+Usage:
+    python manage.py profile_examples --scale 0.1
+    python manage.py profile_examples --match "inner_join_forward.*" --baseline profile/baseline.json
+    python manage.py profile_examples --baseline profile/baseline.json --update-baseline
+
+The dataset is seeded inside a transaction that is rolled back at the
+end, so the database is left as it was (use --no-seed to profile the
+data already there). Writes report.json and report.html to --output-dir.
+"""
+
+import json
+import os
+from fnmatch import fnmatch
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from inventory.profiling import compare, discover_examples, profile_examples, variant_summary
+from inventory.seeding import seed_dataset
+
+
+class Command(BaseCommand):
+    help = "Run the code_examples query shapes and report query counts, timings and plans"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=float, default=0.1,
+                            help="Dataset size, 1.0 is 20k products (see inventory.seeding)")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--no-seed", action="store_true", help="Profile the existing data")
+        parser.add_argument("--match", help='Only examples matching this glob, e.g. "count_examples.*"')
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per example, the median is reported")
+        parser.add_argument("--no-plans", action="store_true", help="Skip EXPLAIN")
+        parser.add_argument("--output-dir", default="profile_report")
+        parser.add_argument("--baseline", help="Report JSON to compare against")
+        parser.add_argument("--update-baseline", action="store_true",
+                            help="Write this run's report to --baseline")
+        parser.add_argument("--tolerance", type=float, default=0.25,
+                            help="Relative slowdown counted as a regression")
+        parser.add_argument("--fail-on-regression", action="store_true")
+
+    def handle(self, *args, **options):
+        examples = discover_examples(match=options["match"])
+        if not examples:
+            raise CommandError("No examples matched.")
+
+        baseline = None
+        if options["baseline"] and not options["update_baseline"]:
+            try:
+                with open(options["baseline"], encoding="utf-8") as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as exc:
+                raise CommandError(f"Cannot read baseline: {exc}")
+
+        with transaction.atomic():
+            dataset = None
+            if not options["no_seed"]:
+                try:
+                    dataset = seed_dataset(options["scale"], options["seed"])
+                except ValueError as exc:
+                    raise CommandError(f"{exc} Pass --no-seed to profile it as is.")
+                self.stdout.write(f"Seeded {dataset}")
+
+            results = profile_examples(
+                examples, repeat=options["repeat"], with_plans=not options["no_plans"],
+                progress=self._progress,
+            )
+            transaction.set_rollback(True)
+
+        report = {
+            "meta": {
+                "vendor": connection.vendor,
+                "scale": None if options["no_seed"] else options["scale"],
+                "seed": None if options["no_seed"] else options["seed"],
+                "dataset": dataset or {},
+                "repeat": options["repeat"],
+                "created_at": timezone.now().isoformat(),
+            },
+            "examples": results,
+            "variants": variant_summary(results),
+            "diff": self._compare(results, baseline, options),
+        }
+        self._write(report, options)
+
+        regressions = [d for d in report["diff"] if d["status"] == "regression"]
+        for row in report["diff"]:
+            style = self.style.ERROR if row["status"] == "regression" else self.style.NOTICE
+            self.stdout.write(style(f"{row['status']:12} {row['key']} {row['changes']}"))
+        if regressions and options["fail_on_regression"]:
+            raise CommandError(f"{len(regressions)} example(s) regressed against the baseline.")
+
+    def _compare(self, results, baseline, options):
+        if baseline is None:
+            return []
+        examples = baseline["examples"]
+        if options["match"]:
+            # examples left out by --match are not "removed"
+            examples = {key: value for key, value in examples.items() if fnmatch(key, options["match"])}
+        return compare(results, examples, options["tolerance"])
+
+    def _progress(self, key, result):
+        if result["error"] and "queries" not in result:
+            self.stdout.write(self.style.WARNING(f"{key:45} {result['error']}"))
+        else:
+            rows = "-" if result["rows"] is None else result["rows"]
+            self.stdout.write(
+                f"{key:45} {result['queries']:4} queries {result['time_ms']:10.2f} ms {rows:>8} rows"
+            )
+
+    def _write(self, report, options):
+        output_dir = options["output_dir"]
+        os.makedirs(output_dir, exist_ok=True)
+        json_path = os.path.join(output_dir, "report.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, default=str)
+
+        html_path = os.path.join(output_dir, "report.html")
+        with open(html_path, "w", encoding="utf-8") as f:
+            f.write(render_to_string("inventory/profile_report.html", {
+                **report, "examples": sorted(report["examples"].items()),
+            }))
+
+        if options["update_baseline"] and options["baseline"]:
+            os.makedirs(os.path.dirname(options["baseline"]) or ".", exist_ok=True)
+            with open(options["baseline"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, default=str)
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+        self.stdout.write(self.style.SUCCESS(f"Report written to {json_path} and {html_path}"))
@@ -0,0 +1,52 @@
+""" Even out striped stock, once or in a loop
+
+Usage:
+    python manage.py rebalance_stock
+    python manage.py rebalance_stock --every 5
+    python manage.py rebalance_stock --stripes 8 --products 42,43
+
+Checkouts drain random stripes, so over a sale some run dry while others
+still have units and lines start falling back to the slow path that
+locks every stripe of the product. A rebalance spreads the units evenly
+again (one short transaction per product) and moves restocked units
+from StockManagement.quantity into the stripes. --stripes changes the
+stripe count of --products first (1 merges them back into one row).
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory.stock import rebalance_stripes, set_stripes
+
+
+class Command(BaseCommand):
+    help = "Rebalance striped product stock, optionally every N seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--every", type=float, help="Keep running, rebalance every this many seconds")
+        parser.add_argument("--products", help="Comma separated product ids, default all striped products")
+        parser.add_argument("--stripes", type=int, help="Set the stripe count of --products first")
+
+    def handle(self, *args, **options):
+        product_ids = None
+        if options["products"]:
+            try:
+                product_ids = [int(product_id) for product_id in options["products"].split(",")]
+            except ValueError:
+                raise CommandError(f"Invalid --products: {options['products']}")
+
+        if options["stripes"] is not None:
+            if product_ids is None:
+                raise CommandError("--stripes needs --products")
+            for product_id in product_ids:
+                total = set_stripes(product_id, options["stripes"])
+                self.stdout.write(f"product {product_id}: {total} units over {max(options['stripes'], 1)} stripes")
+
+        while True:
+            started = time.perf_counter()
+            count = rebalance_stripes(product_ids)
+            self.stdout.write(f"Rebalanced {count} products in {time.perf_counter() - started:.2f}s")
+            if not options["every"]:
+                break
+            time.sleep(options["every"])
@@ -0,0 +1,17 @@
+""" Rebuild the CategoryStats table from the products
+
+Usage:
+    python manage.py refresh_category_stats
+"""
+
+from django.core.management.base import BaseCommand
+
+from inventory.stats import refresh_category_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute product statistics for every category"
+
+    def handle(self, *args, **options):
+        count = refresh_category_stats()
+        self.stdout.write(self.style.SUCCESS(f"Refreshed stats for {count} categories"))
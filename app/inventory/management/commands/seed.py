@@ -0,0 +1,49 @@
+""" Seed a reproducible synthetic dataset
+
+Usage:
+    python manage.py seed --scale 1
+    python manage.py seed --scale 50 --seed 42 --clear
+    python manage.py seed --products 2000000 --orders 500000
+
+The same --scale/--seed (and size overrides) always produce the same
+rows, so benchmark numbers from different runs can be compared.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from inventory.seeding import BASE_SIZES, clear_dataset, dataset_sizes, seed_dataset
+
+
+class Command(BaseCommand):
+    help = "Generate categories, products, stock, promotions, users and orders with COPY / bulk inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=float, default=1.0,
+                            help="Multiplier for the base sizes: "
+                                 + ", ".join(f"{size} {key}" for key, size in BASE_SIZES.items()))
+        parser.add_argument("--seed", type=int, default=0)
+        for key in BASE_SIZES:
+            parser.add_argument(f"--{key}", type=int, help=f"Exact number of {key}, overrides --scale")
+        parser.add_argument("--clear", action="store_true",
+                            help="Delete all inventory rows and previously seeded users first")
+
+    def handle(self, *args, **options):
+        overrides = {key: options[key] for key in BASE_SIZES}
+        sizes = dataset_sizes(options["scale"], **overrides)
+        self.stdout.write(f"Seeding {sizes} with seed {options['seed']}")
+
+        try:
+            if options["clear"]:
+                clear_dataset()
+            counts = seed_dataset(options["scale"], options["seed"], **overrides)
+        except (ValueError, DatabaseError) as exc:
+            raise CommandError(str(exc))
+
+        seconds = counts.pop("seconds")
+        rows = sum(counts.values())
+        for table, count in counts.items():
+            self.stdout.write(f"{table:20} {count:>12}")
+        self.stdout.write(self.style.SUCCESS(
+            f"{rows} rows in {seconds}s ({int(rows / seconds) if seconds else rows} rows/s)"
+        ))
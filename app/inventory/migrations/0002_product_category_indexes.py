@@ -0,0 +1,62 @@
+# Generated by Django 5.2 on 2026-10-17 22:37
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='products',
+            field=models.ManyToManyField(through='inventory.OrderProduct', to='inventory.product'),
+        ),
+        migrations.AddField(
+            model_name='promotionevent',
+            name='products',
+            field=models.ManyToManyField(through='inventory.ProductPromotionEvent', to='inventory.product'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='category_id',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='products', to='inventory.category'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['is_active', 'level', 'name'], name='category_active_level_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['level', 'name'], name='category_level_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['name'], name='category_active_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(django.db.models.functions.text.Upper('name'), name='category_upper_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['price'], name='product_active_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_active', 'is_digital', 'price'], name='product_flags_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='product_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-created_at', '-id'], name='product_created_at_id_idx'),
+        ),
+    ]
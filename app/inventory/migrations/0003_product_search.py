@@ -0,0 +1,73 @@
+# Full-text and trigram search support for Product (PostgreSQL only)
+
+from django.db import migrations
+
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('english', coalesce({row}.name, '')), 'A') ||
+    setweight(to_tsvector('english', replace(coalesce({row}.slug, ''), '-', ' ')), 'B') ||
+    setweight(to_tsvector('english', coalesce({row}.description, '')), 'C')
+"""
+
+
+def create_search(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("ALTER TABLE inventory_product ADD COLUMN search_vector tsvector")
+    schema_editor.execute(f"""
+        CREATE FUNCTION inventory_product_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := {SEARCH_VECTOR_SQL.format(row="NEW")};
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    schema_editor.execute("""
+        CREATE TRIGGER inventory_product_search_vector_trigger
+        BEFORE INSERT OR UPDATE OF name, slug, description ON inventory_product
+        FOR EACH ROW EXECUTE FUNCTION inventory_product_search_vector_update()
+    """)
+    schema_editor.execute(
+        f"UPDATE inventory_product SET search_vector = {SEARCH_VECTOR_SQL.format(row='inventory_product')}"
+    )
+    schema_editor.execute(
+        "CREATE INDEX product_search_vector_idx ON inventory_product USING gin (search_vector)"
+    )
+
+    # pg_trgm ships with contrib, managed databases may not offer it
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        has_trigram = cursor.fetchone() is not None
+    if has_trigram:
+        schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        # UPPER(...) matches what icontains/istartswith/iendswith compile to
+        schema_editor.execute(
+            "CREATE INDEX product_name_trgm_idx ON inventory_product "
+            "USING gin (UPPER(name::text) gin_trgm_ops)"
+        )
+        schema_editor.execute(
+            "CREATE INDEX product_slug_trgm_idx ON inventory_product "
+            "USING gin (UPPER(slug::text) gin_trgm_ops)"
+        )
+
+
+def drop_search(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS product_slug_trgm_idx")
+    schema_editor.execute("DROP INDEX IF EXISTS product_name_trgm_idx")
+    schema_editor.execute("DROP TRIGGER IF EXISTS inventory_product_search_vector_trigger ON inventory_product")
+    schema_editor.execute("DROP FUNCTION IF EXISTS inventory_product_search_vector_update()")
+    schema_editor.execute("ALTER TABLE inventory_product DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0002_product_category_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search, drop_search),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2 on 2026-10-17 22:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_stats(apps, schema_editor):
+    Category = apps.get_model("inventory", "Category")
+    CategoryStats = apps.get_model("inventory", "CategoryStats")
+    rows = Category.objects.annotate(
+        product_count=Count("products"),
+        active_count=Count("products", filter=Q(products__is_active=True)),
+        total_value=Sum("products__price"),
+    ).values_list("id", "product_count", "active_count", "total_value")
+    CategoryStats.objects.bulk_create([
+        CategoryStats(category_id=category_id, product_count=product_count,
+                      active_count=active_count, total_value=total_value or 0)
+        for category_id, product_count, active_count, total_value in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0003_product_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='inventory.category')),
+                ('product_count', models.IntegerField(default=0)),
+                ('active_count', models.IntegerField(default=0)),
+                ('total_value', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(backfill_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2 on 2026-10-17 23:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0004_category_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stockmanagement',
+            name='stripe_count',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+        migrations.CreateModel(
+            name='StockStripe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripe', models.PositiveSmallIntegerField()),
+                ('quantity', models.IntegerField(default=0)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stripes', to='inventory.stockmanagement')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('stock', 'stripe'), name='unique_stripe_per_stock')],
+            },
+        ),
+    ]
@@ -0,0 +1,44 @@
+# GiST index on the promotion window (PostgreSQL only)
+
+from django.db import migrations
+from django.db.models import F
+
+
+def check_promotion_windows(apps, schema_editor):
+    """ Stop on promotions that end before they start. tstzrange() rejects
+        them, so the index can't be built until their dates are fixed."""
+    PromotionEvent = apps.get_model("inventory", "PromotionEvent")
+    inverted = list(PromotionEvent.objects.filter(end_date__lt=F("start_date"))
+                                          .order_by("id").values_list("id", flat=True)[:20])
+    if inverted:
+        raise RuntimeError(f"Promotions {inverted} end before they start, fix their dates and migrate again.")
+
+
+def create_window_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    # the expression inventory.promotions.active_promotions() filters on
+    schema_editor.execute(
+        "CREATE INDEX promotion_window_gist ON inventory_promotionevent "
+        "USING gist (tstzrange(start_date, end_date, '[]'))"
+    )
+
+
+def drop_window_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("DROP INDEX IF EXISTS promotion_window_gist")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0005_stock_stripes'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_promotion_windows, migrations.RunPython.noop),
+        migrations.RunPython(create_window_index, drop_window_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2 on 2026-10-18 00:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_promotion_window_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_date', '-id'], name='order_user_created_id_idx'),
+        ),
+    ]
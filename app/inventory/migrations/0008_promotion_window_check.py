@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 00:40
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def check_promotion_windows(apps, schema_editor):
+    """ Stop on promotions that end before they start, possible where 0006
+        built no index (sqlite). Their dates have to be fixed by hand."""
+    PromotionEvent = apps.get_model("inventory", "PromotionEvent")
+    inverted = list(PromotionEvent.objects.filter(end_date__lt=F("start_date"))
+                                          .order_by("id").values_list("id", flat=True)[:20])
+    if inverted:
+        raise RuntimeError(f"Promotions {inverted} end before they start, fix their dates and migrate again.")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_order_history_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_promotion_windows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='promotionevent',
+            constraint=models.CheckConstraint(condition=models.Q(('start_date__lte', models.F('end_date'))), name='promotion_start_before_end', violation_error_message='The promotion cannot end before it starts.'),
+        ),
+    ]
@@ -1,12 +1,42 @@
 """ Models for our inventory project """
 
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import F, Q, Sum
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce, Upper
 from django.contrib.auth.models import User
 
-class CategoryManager(models.Manager):
+from .tree import ancestor_ids_sql, descendant_ids_sql, sync_levels
+
+class CategoryQuerySet(models.QuerySet):
     def active(self):
         return self.filter(is_active=True)
 
+    def _seed_sql(self):
+        return self.order_by().values("id").query.sql_with_params()
+
+    def descendants(self, include_self=False):
+        """ All categories below the ones in this queryset, in one recursive query"""
+        seed_sql, params = self._seed_sql()
+        return Category.objects.filter(
+            id__in=RawSQL(descendant_ids_sql(seed_sql, include_self), params))
+
+    def ancestors(self, include_self=False):
+        """ All categories above the ones in this queryset, in one recursive query"""
+        seed_sql, params = self._seed_sql()
+        return Category.objects.filter(
+            id__in=RawSQL(ancestor_ids_sql(seed_sql, include_self), params))
+
+    def subtree_products(self):
+        """ Products of these categories and of every category below them"""
+        seed_sql, params = self._seed_sql()
+        return Product.objects.filter(
+            category_id__in=RawSQL(descendant_ids_sql(seed_sql, include_self=True), params))
+
+class CategoryManager(models.Manager.from_queryset(CategoryQuerySet)):
+    pass
+
 class Category(models.Model):
     """ Product Category model"""
 
@@ -19,11 +49,44 @@ class Category(models.Model):
 
     class Meta:
         ordering = ["name"]
+        indexes = [
+            # module6 level filters, with and without is_active, ordered by name
+            models.Index(fields=["is_active", "level", "name"], name="category_active_level_name_idx"),
+            models.Index(fields=["level", "name"], name="category_level_name_idx"),
+            # active listings ordered by name (manager .active(), paginated views)
+            models.Index(fields=["name"], condition=Q(is_active=True), name="category_active_name_idx"),
+            # name__iexact compiles to UPPER(name) = UPPER(%s)
+            models.Index(Upper("name"), name="category_upper_name_idx"),
+        ]
     
     objects=CategoryManager()
 
     def __str__(self):
         return f"{self.id}-{self.name}"
+
+    def save(self, *args, **kwargs):
+        """ level is derived from the parent. Moving a category re-levels its
+            whole subtree with one UPDATE."""
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "parent_id" not in update_fields:
+            return super().save(*args, **kwargs)
+
+        previous = None
+        if not self._state.adding and self.pk is not None:
+            previous = Category.objects.filter(pk=self.pk).values_list("parent_id_id", "level").first()
+
+        if self.parent_id_id is not None and previous is not None and previous[0] != self.parent_id_id:
+            if Category.objects.filter(pk=self.pk).descendants(include_self=True) \
+                               .filter(pk=self.parent_id_id).exists():
+                raise ValidationError("A category cannot be moved below itself or its descendants.")
+
+        self.level = self.parent_id.level + 1 if self.parent_id_id is not None else 0
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "level"}
+        super().save(*args, **kwargs)
+
+        if previous is not None and previous[1] != self.level:
+            sync_levels(self.pk)
     
 class Product(models.Model):
     """ Product  model"""
@@ -43,13 +106,48 @@ class Product(models.Model):
                     related_name="products"
                     )
 
+    # On PostgreSQL the table also has a trigger maintained "search_vector"
+    # tsvector column (migration 0003). It is not declared here so listings
+    # don't load it, see inventory/search.py.
+
 
     class Meta:
         ordering=["name"]
+        indexes = [
+            # price range filters on active products
+            models.Index(fields=["price"], condition=Q(is_active=True), name="product_active_price_idx"),
+            models.Index(fields=["is_active", "is_digital", "price"], name="product_flags_price_idx"),
+            models.Index(fields=["price"], name="product_price_idx"),
+            # newest first listings and the (created_at, id) cursor
+            models.Index(fields=["-created_at", "-id"], name="product_created_at_id_idx"),
+        ]
 
     def __str__(self):
         return self.name
 
+class CategoryStats(models.Model):
+    """ Product statistics per category, kept up to date by inventory.stats"""
+
+    category = models.OneToOneField(
+                    Category,
+                    on_delete=models.CASCADE,
+                    primary_key=True,
+                    related_name="stats"
+                    )
+    product_count = models.IntegerField(default=0)
+    active_count = models.IntegerField(default=0)
+    total_value = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_price(self):
+        if not self.product_count:
+            return None
+        return round(self.total_value / self.product_count, 2)
+
+    def __str__(self):
+        return f"Stats {self.category_id} - {self.product_count} products"
+
 # User Model
 '''class User(models.Model):
     username = models.CharField(max_length=50, unique=True)
@@ -73,6 +171,10 @@ class Order(models.Model):
     
     class Meta:
         ordering=["-created_date"]
+        indexes = [
+            # a user's order history, newest first, and its (created_date, id) cursor
+            models.Index(fields=["user", "-created_date", "-id"], name="order_user_created_id_idx"),
+        ]
 
     def __str__(self):
         return f"Order {self.id} created by {self.user.username}"
@@ -90,8 +192,19 @@ class OrderProduct(models.Model):
         ]
 
     def __str__(self):
-        return f"{self.product}- Order {self.order.id}"
+        return f"{self.product}- Order {self.order_id}"
     
+def available_units(prefix=""):
+    """ Expression for a stock's units on hand, quantity plus its stripes.
+        prefix reaches StockManagement from another model, e.g. "stock__"
+        to annotate, filter or order Products by their stock."""
+    return models.F(f"{prefix}quantity") + Coalesce(Sum(f"{prefix}stripes__quantity"), 0)
+
+class StockManagementQuerySet(models.QuerySet):
+    def with_available(self):
+        """ Annotate available: quantity plus the units in the stripes, one query"""
+        return self.annotate(available=available_units())
+
 class StockManagement(models.Model):
     """ Product stock management model"""
     product = models.OneToOneField(  
@@ -99,11 +212,65 @@ class StockManagement(models.Model):
                         on_delete=models.CASCADE,
                         unique=True,
                         related_name='stock')
+    # units not in stripes: all of them unless the product is striped
     quantity = models.IntegerField()
+    # > 1: the stock is split over that many StockStripe rows (see inventory.stock)
+    stripe_count = models.PositiveSmallIntegerField(default=1)
     last_checked_at = models.DateTimeField(auto_now=True)
 
+    objects = StockManagementQuerySet.as_manager()
+
+    _available = None
+
+    @property
+    def available(self):
+        """ Units on hand, stripes included. Set by with_available(),
+            otherwise one query for a striped product."""
+        if self._available is None:
+            if self.stripe_count <= 1:
+                return self.quantity
+            self._available = self.quantity + (self.stripes.aggregate(units=Sum("quantity"))["units"] or 0)
+        return self._available
+
+    @available.setter
+    def available(self, value):
+        self._available = value
+
+    def save(self, *args, **kwargs):
+        """ Units written to quantity of a striped product (a restock) and a
+            changed stripe_count are spread over the stripes in the same
+            transaction, so reserve_stock sees them right away. Saves with
+            update_fields (inventory.stock's own) are left alone."""
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if kwargs.get("update_fields") is None and self._needs_restripe(adding):
+                from .stock import set_stripes
+                set_stripes(self.product_id, self.stripe_count)
+                self.refresh_from_db(fields=["quantity", "stripe_count", "last_checked_at"])
+            self._available = None
+
+    def _needs_restripe(self, adding):
+        if self.stripe_count > 1:
+            return bool(self.quantity) or self.stripes.count() != self.stripe_count
+        return not adding and self.stripes.exists()
+
     def __str__(self):
-        return f"Stock {self.product.name} - {self.quantity}"
+        return f"Stock {self.product.name} - {self.available}"
+
+class StockStripe(models.Model):
+    """ One slice of a hot product's stock, checkouts take from any one of them"""
+    stock = models.ForeignKey(StockManagement, on_delete=models.CASCADE, related_name='stripes')
+    stripe = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["stock", "stripe"], name="unique_stripe_per_stock")
+        ]
+
+    def __str__(self):
+        return f"Stripe {self.stripe} of {self.stock_id} - {self.quantity}"
     
 class PriceReductionChoices(models.IntegerChoices):
     FIVE= 5,"5%"
@@ -124,6 +291,12 @@ class PromotionEvent(models.Model):
     #through field used to tell django not to create new table and use this table.          
     class Meta:
         ordering =["-start_date"]
+        constraints = [
+            # the GiST index on tstzrange(start_date, end_date) can't hold an inverted window
+            models.CheckConstraint(condition=Q(start_date__lte=F("end_date")),
+                                   name="promotion_start_before_end",
+                                   violation_error_message="The promotion cannot end before it starts."),
+        ]
 
     def __str__(self):
         return self.name
@@ -1,11 +1,22 @@
 from typing import List, Optional
 from django.utils.text import slugify
-from ninja import Router, Schema
-
-from inventory.models import Category,Product,StockManagement,Order,OrderProduct,PromotionEvent,ProductPromotionEvent
+from ninja import Query, Router, Schema
+from ninja.errors import HttpError
+
+from inventory.caching import bump_version
+from inventory.catalog_loader import load_categories, load_products
+from inventory.models import Category,Product,StockManagement,Order,OrderProduct,PromotionEvent
+from inventory.promotions import attach_products, detach_products, link_products
+from inventory.query_budget import query_budget
+from inventory.stats import defer_stats_updates
+from inventory.stock import InsufficientStock, reserve_each, reserve_stock
+from inventory.tree import sync_levels
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, NotSupportedError, transaction
 
 import datetime
+import json
 from django.utils import dateparse
 
 router = Router()
@@ -22,7 +33,7 @@ class CategoryIn(Schema):
     summary="Create new Category",
     description = "Creates a new category with optional parent name and slug.Slug is autogenrated",
 )
-
+@query_budget(3)
 def create_category(request, data:CategoryIn):
     slug = data.slug or slugify(data.name)
     parent_id = data.parent_id
@@ -39,20 +50,100 @@ def create_category(request, data:CategoryIn):
     "/category/bulk_create/",
     tags =["module4"],
     summary = "Create new Categories in bulk",
-    description ="Bulk creation of new Categories with bulk_create method"
+    description ="Bulk creation of new Categories with bulk_create method. Parents may be existing "
+                 "categories or categories created earlier in the same payload"
 )
+@query_budget(None, max_repeats=50)
 def bulk_create_category(request, data:List[CategoryIn]):
-    cats=[
-        Category(
-            name=item.name,
-            slug=item.slug,
-            is_active=item.is_active,
-            parent_id=Category.objects.filter(name=item.parent_id).first()
-       )
-        for item in data
-    ]
-    Category.objects.bulk_create(cats)
-    return
+    generations, parents, errors = _category_generations(data)
+
+    created_count = 0
+    with transaction.atomic():
+        # a parent is always in an earlier generation than its children,
+        # so its id is known when the children are built
+        for generation in generations:
+            cats=[_category_from_item(item, parents) for item in generation]
+            Category.objects.bulk_create(cats)
+            for cat in cats:
+                parents[cat.name] = (cat.id, cat.level)
+            created_count += len(cats)
+        # bulk_create sends no post_save, drop the cached category listings
+        bump_version(Category)
+
+    return {
+        "status": "created",
+        "created_count": created_count,
+        "errors": errors,
+    }
+
+def _category_from_item(item, parents):
+    """ Build an unsaved Category for a payload item, parent taken from the resolved parents"""
+    parent = parents.get(item.parent_id) if item.parent_id else None
+    return Category(
+        name=item.name,
+        slug=item.slug or slugify(item.name),
+        is_active=item.is_active,
+        parent_id_id=parent[0] if parent else None,
+        level=parent[1] + 1 if parent else 0,
+    )
+
+def _category_generations(items):
+    """ Order payload categories so parents are written before their children.
+        Parents outside the payload are resolved by name in one query.
+        Returns the generations, a {name: (id, level)} map of known parents and
+        per item errors for categories that cannot be created."""
+    by_name = {}
+    errors = []
+    for item in items:
+        if item.name in by_name:
+            errors.append({"name": item.name, "error": "Duplicate category name in payload."})
+        else:
+            by_name[item.name] = item
+
+    external_names = {
+        item.parent_id for item in by_name.values()
+        if item.parent_id and item.parent_id not in by_name
+    }
+    parents = {
+        name: (cat_id, level)
+        for name, cat_id, level in Category.objects.filter(name__in=external_names)
+                                                   .values_list("name", "id", "level")
+    }
+
+    # depth of every payload item below a known parent, None when it can't be placed
+    depth = {}
+    for name in by_name:
+        path = []
+        current = name
+        while current in by_name and current not in depth and current not in path:
+            path.append(current)
+            current = by_name[current].parent_id or None
+
+        if current in depth:
+            base = depth[current]
+        elif current is None or current in parents:
+            base = -1
+        else:  # unknown parent or a cycle inside the payload
+            base = None
+
+        for path_name in reversed(path):
+            base = None if base is None else base + 1
+            depth[path_name] = base
+
+    generations = []
+    for name, item in by_name.items():
+        if depth[name] is None:
+            if item.parent_id in by_name:
+                message = f"Parent category '{item.parent_id}' could not be created."
+            else:
+                message = f"Parent category '{item.parent_id}' not found."
+            errors.append({"name": name, "error": message})
+            continue
+        while len(generations) <= depth[name]:
+            generations.append([])
+        generations[depth[name]].append(item)
+
+    return generations, parents, errors
 
 class CategoryUpdateIn(Schema):
     name:Optional[str] =None
@@ -66,6 +157,7 @@ class CategoryUpdateIn(Schema):
     summary = "Update data for a category",
     description = "Update data for a given category"
 )
+@query_budget(6)
 def update_category(request, category_id:int, data:CategoryUpdateIn):
     try:
         cat = Category.objects.get(id = category_id)
@@ -87,7 +179,10 @@ def update_category(request, category_id:int, data:CategoryUpdateIn):
         updated_fields.append("parent_id")
 
     
-    cat.save(update_fields=updated_fields)
+    try:
+        cat.save(update_fields=updated_fields)
+    except ValidationError as exc:
+        return {"error": exc.messages[0]}
     return {"status":"updated"}
 
 class CategoryUpsertIn(Schema):
@@ -101,6 +196,7 @@ class CategoryUpsertIn(Schema):
     summary = "Update/Create data for a category",
     description = "Update/create data for a given category by name using update_or_create"
 )
+@query_budget(6)
 def upsert_category(request, data:CategoryUpsertIn):
     slug = data.slug or slugify(data.name)
 
@@ -115,6 +211,131 @@ def upsert_category(request, data:CategoryUpsertIn):
             "id":cat.id,
             "name": cat.name}
 
+@router.put(
+    "category/bulk-upsert/",
+    tags=["module4"],
+    summary = "Update/Create categories in bulk by name",
+    description = "Upsert categories by name with bulk_create(update_conflicts=True), "
+                  "which becomes a single INSERT ... ON CONFLICT per batch. Items whose slug "
+                  "belongs to another category, or that would move a category below itself, "
+                  "are skipped and reported in errors"
+)
+@query_budget(None, max_repeats=50)
+def bulk_upsert_categories(request, data:List[CategoryUpsertIn],
+                           batch_size:int = Query(1000, ge=1, le=5000)):
+    data, slug_errors = _reject_slug_conflicts(data)
+    data, moved_ids, cycle_errors = _reject_cycles(data)
+    generations, parents, errors = _category_generations(data)
+    errors = slug_errors + cycle_errors + errors
+
+    try:
+        batches = _upsert_generations(generations, parents, batch_size, moved_ids)
+    except IntegrityError as exc:
+        # a conflicting row committed after the slug check, nothing was written
+        return {"error": str(exc).splitlines()[0]}
+
+    return {
+        "status": "upserted",
+        "created_count": sum(batch["created"] for batch in batches),
+        "updated_count": sum(batch["updated"] for batch in batches),
+        "batches": batches,
+        "errors": errors,
+    }
+
+def _reject_slug_conflicts(items):
+    """ Drop payload items whose slug is taken, by an earlier item or by an existing
+        category with another name (one query). Returns the kept items and the errors."""
+    slugs = {item.slug or slugify(item.name) for item in items}
+    owners = dict(Category.objects.filter(slug__in=slugs).values_list("slug", "name"))
+
+    kept = []
+    errors = []
+    for item in items:
+        slug = item.slug or slugify(item.name)
+        owner = owners.setdefault(slug, item.name)
+        if owner != item.name:
+            errors.append({"name": item.name, "error": f"Slug '{slug}' is already used by category '{owner}'."})
+        else:
+            kept.append(item)
+    return kept, errors
+
+def _reject_cycles(items):
+    """ Drop payload items that would move an existing category below itself or its
+        descendants, the check Category.save() does but ON CONFLICT skips. One query
+        for the current parents and one descendants() query for the moved rows.
+        Returns the kept items, the ids of existing rows whose parent changes and the errors."""
+    by_name = {}
+    for item in items:
+        by_name.setdefault(item.name, item)
+
+    current = Category.objects.filter(name__in=by_name).values_list("name", "id", "parent_id__name")
+    moved = {name: cat_id for name, cat_id, parent_name in current
+             if (by_name[name].parent_id or None) != parent_name}
+    below = {cat_id: {name} for name, cat_id in moved.items()
+             if by_name[name].parent_id}
+    if not below:
+        return items, list(moved.values()), []
+
+    # each moved row's subtree as it is stored now
+    children = {}
+    for cat_id, name, parent_id in (Category.objects.filter(id__in=below).descendants()
+                                                    .values_list("id", "name", "parent_id_id")):
+        children.setdefault(parent_id, []).append((cat_id, name))
+    for root_id, names in below.items():
+        stack = [root_id]
+        while stack:
+            for cat_id, name in children.get(stack.pop(), []):
+                names.add(name)
+                stack.append(cat_id)
+
+    rejected = set()
+    errors = []
+    for name, cat_id in moved.items():
+        if cat_id not in below:
+            continue
+        # follow the new parent chain through the payload until it leaves it
+        parent, seen = by_name[name].parent_id, set()
+        while parent and parent not in seen:
+            if parent in below[cat_id]:
+                rejected.add(name)
+                errors.append({"name": name, "error": "A category cannot be moved below itself or its descendants."})
+                break
+            seen.add(parent)
+            parent = by_name[parent].parent_id if parent in by_name else None
+
+    kept = [item for item in items if item.name not in rejected]
+    return kept, [cat_id for name, cat_id in moved.items() if name not in rejected], errors
+
+def _upsert_generations(generations, parents, batch_size, moved_ids):
+    batches = []
+    with transaction.atomic():
+        for generation in generations:
+            for start in range(0, len(generation), batch_size):
+                cats = [_category_from_item(item, parents) for item in generation[start:start + batch_size]]
+                names = [cat.name for cat in cats]
+                existing = Category.objects.filter(name__in=names).count()
+
+                Category.objects.bulk_create(
+                    cats,
+                    update_conflicts=True,
+                    unique_fields=["name"],
+                    update_fields=["slug", "is_active", "parent_id", "level"],
+                )
+                for cat in cats:
+                    parents[cat.name] = (cat.id, cat.level)
+
+                batches.append({
+                    "batch": len(batches) + 1,
+                    "created": len(cats) - existing,
+                    "updated": existing,
+                })
+
+        # the moved rows got their level from the new parent, re-level what is below them
+        if moved_ids:
+            sync_levels(*moved_ids)
+        bump_version(Category)
+    return batches
+
 # --- Schema for bulk_update() usage ---
 class CategoryBulkUpdateIn(Schema):
     id: int
@@ -127,6 +348,7 @@ class CategoryBulkUpdateIn(Schema):
     tags=["module4"],
     summary="Bulk update status and level using .bulk_update()",
 )
+@query_budget(2)
 def bulk_update_categories(request, data: List[CategoryBulkUpdateIn]):
     ids = [item.id for item in data]
     category_map = {item.id: item for item in data}
@@ -141,6 +363,8 @@ def bulk_update_categories(request, data: List[CategoryBulkUpdateIn]):
                 cat.is_active = item.is_active
 
     Category.objects.bulk_update(categories, ["level", "is_active"])
+    # bulk_update() and update() skip the save signals
+    bump_version(Category)
 
     return {
         "status": "bulk_updated",
@@ -158,6 +382,7 @@ class CategoryActivateFilterIn(Schema):
     tags=["module4"],
     summary="Activate categories using .update() on filtered queryset",
 )
+@query_budget(1)
 def activate_categories(request, data: CategoryActivateFilterIn):
     filters = {"is_active": data.is_active}
 
@@ -165,6 +390,7 @@ def activate_categories(request, data: CategoryActivateFilterIn):
         filters["level"] = data.level
 
     updated_count = Category.objects.filter(**filters).update(is_active=False)
+    bump_version(Category)
 
     return {
         "status": "updated",
@@ -187,6 +413,7 @@ class ProductCreateIn(Schema):
     tags=["module4"],
     summary="Create a New Product",
 )
+@query_budget(5)
 def create_product(request, data:ProductCreateIn):
     try:
         cat = Category.objects.get(id= data.category_id)
@@ -232,6 +459,7 @@ class ProductCreateWithStockIn(Schema):
     summary="Create a New Product with its stock in StockManagement table",
     
 )
+@query_budget(6)
 def create_product_with_stock(request,data:ProductCreateWithStockIn):
     try:
         cat = Category.objects.get(id= data.category_id)
@@ -252,6 +480,27 @@ def create_product_with_stock(request,data:ProductCreateWithStockIn):
            "product":prod.name,
            "stock": stock.quantity}
 
+# ---- Catalog load with PostgreSQL COPY ----
+
+@router.post(
+    "/catalog/load/",
+    tags=["module4"],
+    summary="Load a product or category catalog with COPY (PostgreSQL only)",
+    description="Streams a CSV (with header) or NDJSON body into a staging table and "
+                "merges it on slug, so re-importing the same file is idempotent. Rows that can't "
+                "be merged are listed in rejected_rows.",
+)
+@query_budget(10)
+def load_catalog(request, kind: str = Query(..., pattern="^(product|category)$"),
+                 fmt: str = Query("csv", pattern="^(csv|ndjson)$")):
+    loader = load_products if kind == "product" else load_categories
+    lines = (raw.decode("utf-8") for raw in request)
+    try:
+        result = loader(lines, fmt)
+    except (NotSupportedError, DatabaseError, ValueError) as exc:
+        return {"error": str(exc)}
+    return {"status": "loaded", "kind": kind, **result}
+
 # Order + Products: Using through model
 class OrderedProductIn(Schema):
     product_id: int
@@ -265,46 +514,165 @@ class OrderWithProductsIn(Schema):
 @router.post(
     "/order/create/",
     tags=["module4"],
-    summary="Create order using .add() and through_defaults",
+    summary="Create order with all its lines using one bulk_create()",
+    description="Stock of every line is reserved in the same transaction, the order is "
+                "rejected if any product with tracked stock is short.",
 )
+# 5, up to 4 more when the order has products with striped stock
+@query_budget(9)
 def create_order(request, data: OrderWithProductsIn):
     try:
         user = User.objects.get(id=data.user_id)
     except User.DoesNotExist:
         return {"error": "User not found."}
 
-    order = Order.objects.create(user=user)
+    lines, duplicate_ids = _dedupe_order_lines(data.products)
+
+    # one query resolves every product id of the order
+    found_ids = set(
+        Product.objects.filter(id__in=lines.keys()).values_list("id", flat=True)
+    )
+    missing_ids = [product_id for product_id in lines if product_id not in found_ids]
+
+    ordered = {product_id: quantity for product_id, quantity in lines.items() if product_id in found_ids}
+    try:
+        with transaction.atomic():
+            # one statement takes the stock of every line, a short line rolls back the whole order
+            reserve_stock(ordered)
+            order = Order.objects.create(user=user)
+            order_products = [
+                OrderProduct(order=order, product_id=product_id, quantity=quantity)
+                for product_id, quantity in ordered.items()
+            ]
+            # single INSERT for all lines, conflicts on unique_product_per_order are skipped
+            OrderProduct.objects.bulk_create(order_products, ignore_conflicts=True)
+    except InsufficientStock as exc:
+        return {"error": "Insufficient stock.", "shortages": exc.shortages}
+    except ValueError as exc:
+        return {"error": str(exc)}
+
+    """
+    previous per line version (3 queries for every product in the order)
 
     for item in data.products:
         try:
             product = Product.objects.get(id=item.product_id)
-
-            # Check if relation already exists to avoid unique constraint failure
             exists = OrderProduct.objects.filter(order=order, product=product).exists()
             if not exists:
                 order.products.add(
                     product, through_defaults={"quantity": item.quantity}
                 )
-            # optionally: else update the quantity or skip silently
         except Product.DoesNotExist:
             continue
-
     """
-    without products manytomanyfield defined
 
-    for item in data.products:
-        try:
-            product = Product.objects.get(id=item.product_id)
-            OrderProduct.objects.create(order=order,product=product,quantity=item.quantity)
-        except Product.DoesNotExist:
+    return {
+        "status": "created",
+        "order_id": order.id,
+        "linked_products": len(order_products),
+        "missing_product_ids": missing_ids,
+        "duplicate_product_ids": duplicate_ids,
+    }
+
+def _dedupe_order_lines(products):
+    """ Collapse order lines to {product_id: quantity}, first line for a product wins.
+        Returns the lines and the product ids that were repeated."""
+    lines = {}
+    duplicate_ids = []
+    for item in products:
+        if item.product_id in lines:
+            if item.product_id not in duplicate_ids:
+                duplicate_ids.append(item.product_id)
             continue
-    """
+        lines[item.product_id] = item.quantity
+    return lines, duplicate_ids
+
+# Bulk order import: NDJSON body, one OrderWithProductsIn per line
+
+@router.post(
+    "/order/bulk-import/",
+    tags=["module4"],
+    summary="Import orders from a streamed NDJSON body in chunks",
+    description="Each line of the body is one order in the OrderWithProductsIn shape. "
+                "Lines are read incrementally and every chunk is written with two bulk_create() calls. "
+                "Stock is reserved per order in file order, an order that is short is skipped and "
+                "reported with its shortages.",
+)
+@query_budget(None, max_repeats=1000)
+def bulk_import_orders(request, chunk_size: int = Query(500, ge=1, le=5000)):
+    chunks = []
+    chunk = []
+    errors = []
+    # iterating the request reads the body line by line instead of loading request.body
+    for line_no, raw in enumerate(request, start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            chunk.append((line_no, OrderWithProductsIn.model_validate(json.loads(raw))))
+        except ValueError as exc:
+            errors.append({"line": line_no, "error": str(exc).splitlines()[0]})
 
+        if len(chunk) >= chunk_size:
+            chunks.append(_import_order_chunk(len(chunks) + 1, chunk, errors))
+            chunk, errors = [], []
+
+    if chunk or errors:
+        chunks.append(_import_order_chunk(len(chunks) + 1, chunk, errors))
 
     return {
-        "status": "created",
-        "order_id": order.id,
-        "linked_products": len(data.products),
+        "status": "imported",
+        "orders_created": sum(item["orders_created"] for item in chunks),
+        "lines_created": sum(item["lines_created"] for item in chunks),
+        "chunks": chunks,
+    }
+
+def _import_order_chunk(chunk_no, chunk, errors):
+    """ Write one chunk of parsed orders: a query for users, a query for products,
+        the stock reservation and one bulk_create each for Order and OrderProduct.
+        An order whose stock is short is left out and reported on its line."""
+    user_ids = {order_data.user_id for _, order_data in chunk}
+    product_ids = {item.product_id for _, order_data in chunk for item in order_data.products}
+
+    found_users = set(User.objects.filter(id__in=user_ids).values_list("id", flat=True))
+    found_products = set(Product.objects.filter(id__in=product_ids).values_list("id", flat=True))
+
+    parsed = []
+    for line_no, order_data in chunk:
+        if order_data.user_id not in found_users:
+            errors.append({"line": line_no, "error": "User not found."})
+            continue
+        lines, _ = _dedupe_order_lines(order_data.products)
+        lines = {product_id: quantity for product_id, quantity in lines.items() if product_id in found_products}
+        if any(quantity < 1 for quantity in lines.values()):
+            errors.append({"line": line_no, "error": "Quantities must be at least 1."})
+            continue
+        parsed.append((line_no, order_data.user_id, lines))
+
+    with transaction.atomic():
+        shortages = reserve_each([lines for _, _, lines in parsed])
+        accepted = []
+        for (line_no, user_id, lines), short in zip(parsed, shortages):
+            if short:
+                errors.append({"line": line_no, "error": "Insufficient stock.", "shortages": short})
+            else:
+                accepted.append((user_id, lines))
+
+        orders = Order.objects.bulk_create([Order(user_id=user_id) for user_id, _ in accepted])
+        order_products = [
+            OrderProduct(order=order, product_id=product_id, quantity=quantity)
+            for order, (_, lines) in zip(orders, accepted)
+            for product_id, quantity in lines.items()
+        ]
+        OrderProduct.objects.bulk_create(order_products, ignore_conflicts=True)
+
+    errors.sort(key=lambda error: error["line"])
+    return {
+        "chunk": chunk_no,
+        "orders_created": len(orders),
+        "lines_created": len(order_products),
+        "missing_product_ids": sorted(product_ids - found_products),
+        "errors": errors,
     }
 
 # product promotion apis
@@ -323,33 +691,149 @@ class PromotionWithProductsIn(Schema):
     "/promotion/create/",
     tags=["module4"],
     summary="Create promotion event. Give date in format yyyy-mm-dd. price reduction from [5,10,20]",
+    description="Product ids are checked with one query and linked with one bulk_create(), "
+                "unknown ids are reported in missing_product_ids. Malformed dates or an end "
+                "before the start are rejected with 400.",
 )
+@query_budget(None, max_repeats=50)
 def create_promotion(request, data: PromotionWithProductsIn):
+    try:
+        start_date = dateparse.parse_date(data.start_date)
+        end_date = dateparse.parse_date(data.end_date)
+    except ValueError:  # well formed but not a calendar date, e.g. 2025-02-30
+        start_date = end_date = None
+    if start_date is None or end_date is None:
+        raise HttpError(400, "Dates must be given as yyyy-mm-dd.")
+    if end_date < start_date:
+        raise HttpError(400, "The promotion cannot end before it starts.")
+
+    with transaction.atomic():
+        promotion = PromotionEvent.objects.create(name= data.name,
+                                                start_date= start_date,
+                                                end_date = end_date,
+                                                price_reduction = data.price_reduction)
+        linked, missing = link_products(promotion.id, [item.product_id for item in data.products])
 
-    promotion = PromotionEvent.objects.create(name= data.name, 
-                                            start_date= dateparse.parse_date(data.start_date),
-                                            end_date = dateparse.parse_date(data.end_date),
-                                            price_reduction = data.price_reduction)
+    return {
+        "status": "created",
+        "promotion_id": promotion.id,
+        "linked_products": linked,
+        "missing_product_ids": missing,
+    }
 
-    for item in data.products:
-        try:
-            product = Product.objects.get(id=item.product_id)
+class PromotionProductIdsIn(Schema):
+    product_ids: List[int]
 
-            # Check if relation already exists to avoid unique constraint failure
-            exists = ProductPromotionEvent.objects.filter(promotion_event=promotion, 
-                                        product=product).exists()
-            if not exists:
-                promotion.products.add(
-                    product
-                )
-            # optionally: else update the quantity or skip silently
-        except Product.DoesNotExist:
-            continue
+class PromotionProductFilterIn(Schema):
+    category_id: Optional[int] = None # the category and everything below it
+    is_active: Optional[bool] = None
+    is_digital: Optional[bool] = None
+    min_price: Optional[float] = None
+    max_price: Optional[float] = None
+    name_contains: Optional[str] = None
+
+def _promotion_products(data: PromotionProductFilterIn):
+    products = Product.objects.all()
+    if data.category_id is not None:
+        products = Category.objects.filter(id=data.category_id).subtree_products()
+
+    filters = {}
+    if data.is_active is not None:
+        filters["is_active"] = data.is_active
+    if data.is_digital is not None:
+        filters["is_digital"] = data.is_digital
+    if data.min_price is not None:
+        filters["price__gte"] = data.min_price
+    if data.max_price is not None:
+        filters["price__lte"] = data.max_price
+    if data.name_contains:
+        filters["name__icontains"] = data.name_contains
+    return products.filter(**filters)
 
+@router.post(
+    "/promotion/{promotion_id}/products/",
+    tags=["module4"],
+    summary="Add products to a promotion by id",
+    description="Ids are checked with one query and linked with one bulk_create(ignore_conflicts=True).",
+)
+@query_budget(None, max_repeats=50)
+def add_promotion_products(request, promotion_id: int, data: PromotionProductIdsIn):
+    if not PromotionEvent.objects.filter(id=promotion_id).exists():
+        return {"error": "Promotion not found."}
+
+    linked, missing = link_products(promotion_id, data.product_ids)
     return {
-        "status": "created",
-        "promotion_id": promotion.id,
-        "linked_products": len(data.products),
+        "status": "linked",
+        "promotion_id": promotion_id,
+        "linked_products": linked,
+        "missing_product_ids": missing,
+    }
+
+@router.delete(
+    "/promotion/{promotion_id}/products/",
+    tags=["module4"],
+    summary="Remove products from a promotion by id, in one DELETE",
+)
+@query_budget(1)
+def remove_promotion_products(request, promotion_id: int, data: PromotionProductIdsIn):
+    removed = detach_products(promotion_id, Product.objects.filter(id__in=data.product_ids))
+    return {
+        "status": "unlinked",
+        "promotion_id": promotion_id,
+        "unlinked_products": removed,
+    }
+
+@router.post(
+    "/promotion/{promotion_id}/products/category/{category_id}/",
+    tags=["module4"],
+    summary="Add every product of a category and its subcategories to a promotion",
+    description="Runs server-side as a single INSERT ... SELECT over the category subtree.",
+)
+@query_budget(2)
+def add_category_promotion_products(request, promotion_id: int, category_id: int,
+                                    active: Optional[bool] = None):
+    if not PromotionEvent.objects.filter(id=promotion_id).exists():
+        return {"error": "Promotion not found."}
+
+    added = attach_products(promotion_id, _promotion_products(
+        PromotionProductFilterIn(category_id=category_id, is_active=active)))
+    return {
+        "status": "linked",
+        "promotion_id": promotion_id,
+        "added_products": added,
+    }
+
+@router.post(
+    "/promotion/{promotion_id}/products/filter/",
+    tags=["module4"],
+    summary="Add every product matching a filter to a promotion",
+    description="Runs server-side as a single INSERT ... SELECT, category_id takes in the whole "
+                "category subtree. An empty filter adds every product.",
+)
+@query_budget(2)
+def add_filtered_promotion_products(request, promotion_id: int, data: PromotionProductFilterIn):
+    if not PromotionEvent.objects.filter(id=promotion_id).exists():
+        return {"error": "Promotion not found."}
+
+    added = attach_products(promotion_id, _promotion_products(data))
+    return {
+        "status": "linked",
+        "promotion_id": promotion_id,
+        "added_products": added,
+    }
+
+@router.delete(
+    "/promotion/{promotion_id}/products/filter/",
+    tags=["module4"],
+    summary="Remove every product matching a filter from a promotion, in one DELETE",
+)
+@query_budget(1)
+def remove_filtered_promotion_products(request, promotion_id: int, data: PromotionProductFilterIn):
+    removed = detach_products(promotion_id, _promotion_products(data))
+    return {
+        "status": "unlinked",
+        "promotion_id": promotion_id,
+        "unlinked_products": removed,
     }
 
 
@@ -363,13 +847,16 @@ class ProductBulkDeleteIn(Schema):
     tags=["module4"],
     summary="Bulk delete categories by IDs",
 )
+@query_budget(8)
 def bulk_delete_categories(request, data: ProductBulkDeleteIn):
     queryset = Product.objects.filter(id__in=data.ids) 
     # for bulk delete make a queryset then call delete() on queryset
     if not queryset.exists():
         return {"error": "No matching categories found to delete."}
 
-    deleted_count, deleted_detail = queryset.delete()
+    # one stats recompute per touched category instead of one per product
+    with defer_stats_updates():
+        deleted_count, deleted_detail = queryset.delete()
 
     return {
         "status": "bulk_deleted",
@@ -383,6 +870,7 @@ def bulk_delete_categories(request, data: ProductBulkDeleteIn):
     tags=["module4"],
     summary="Delete a category by ID",
 )
+@query_budget(6)
 def delete_category(request, category_id: int):
     try:
         category = Category.objects.get(id=category_id)
@@ -2,7 +2,10 @@ from typing import List
 
 from ninja import Router, Schema
 
+from .caching import cached_response
 from .models import Category
+from .query_budget import query_budget
+from .serialization import values_response
 
 router = Router()
 
@@ -26,6 +29,7 @@ class ErrorResponse(Schema):
     summary="Retrieve the first active category by name ASC",
     response={200: CategoryNameSlugOut, 404: ErrorResponse},
 )
+@query_budget(1)
 def get_first_active_category_by_name(request):
     category = (
         Category.objects.only("name", "slug")
@@ -58,6 +62,7 @@ class ErrorResponse(Schema):
     summary="Retrieve active categories sorted by name ASC",
     response={200: List[CategoryNameSlugOut], 404: ErrorResponse},
 )
+@query_budget(2)
 def get_active_categories_sorted_by_name(request):
     queryset = (
         Category.objects.only("name", "slug").filter(is_active=True).order_by("-name")
@@ -91,6 +96,7 @@ class ErrorResponse(Schema):
     summary="Retrieve active categories excluding 'Archived'",
     response={200: List[CategoryNameSlugOut], 404: ErrorResponse},
 )
+@query_budget(2)
 def get_active_non_archived_categories(request):
     queryset = (
         Category.objects.only("name", "slug")
@@ -124,6 +130,7 @@ class ErrorResponse(Schema):
     summary="Retrieve inactive category names and slugs using only()",
     response={200: List[CategoryNameSlugOut], 404: ErrorResponse},#multiple response
 )
+@query_budget(2)
 def get_inactive_category_names(request):
     queryset = Category.objects.only("name", "slug").filter(name="Electronics")
 
@@ -152,6 +159,7 @@ class CategoryNameSlugOut(Schema):
     summary="Retrieve category names and slugs using only()",
     response=List[CategoryNameSlugOut],
 )
+@query_budget(1)
 def get_category_names_optimized(request):
     queryset = Category.objects.only("name", "slug")
 
@@ -177,6 +185,8 @@ class CategoryNameSlugOut(Schema):
     summary="Retrieve category names and slugs only",
     response=List[CategoryNameSlugOut],
 )
+@cached_response(Category, List[CategoryNameSlugOut])
+@query_budget(1)
 def get_category_names(request):
     queryset = Category.objects.values("name", "slug")
 
@@ -209,5 +219,124 @@ class CategoryOut(Schema):
     summary="Retrieve all categories",
     response=List[CategoryOut],
 )
+@cached_response(Category, List[CategoryOut])
+@query_budget(1)
+@values_response(CategoryOut)
 def get_all_categories(request):
     return Category.objects.all()
+
+
+########################################
+# Async variants of 1-7, same queries through the async ORM
+########################################
+
+
+@router.get(
+    "/async/category/all",
+    tags=["module5"],
+    summary="Retrieve all categories (async)",
+    response=List[CategoryOut],
+)
+@query_budget(1)
+async def aget_all_categories(request):
+    # values() rows like @values_response, parent_id is the id column
+    return [row async for row in Category.objects.values(*CategoryOut.model_fields)]
+
+
+@router.get(
+    "/async/category/first-active",
+    tags=["module5"],
+    summary="Retrieve the first active category by name ASC (async)",
+    response={200: CategoryNameSlugOut, 404: ErrorResponse},
+)
+@query_budget(1)
+async def aget_first_active_category_by_name(request):
+    category = await (
+        Category.objects.only("name", "slug")
+        .filter(is_active=True)
+        .order_by("name")
+        .afirst()
+    )
+
+    if category is None:
+        return 404, {"detail": "No active categories found."}
+
+    return {"name": category.name, "slug": category.slug}
+
+
+@router.get(
+    "/async/category/active-sorted-name",
+    tags=["module5"],
+    summary="Retrieve active categories sorted by name ASC (async)",
+    response={200: List[CategoryNameSlugOut], 404: ErrorResponse},
+)
+@query_budget(2)
+async def aget_active_categories_sorted_by_name(request):
+    queryset = (
+        Category.objects.only("name", "slug").filter(is_active=True).order_by("-name")
+    )
+
+    if not await queryset.aexists():
+        return 404, {"detail": "No active categories found to sort."}
+
+    return [{"name": category.name, "slug": category.slug} async for category in queryset]
+
+
+@router.get(
+    "/async/category/active-excluding-archived",
+    tags=["module5"],
+    summary="Retrieve active categories excluding 'Archived' (async)",
+    response={200: List[CategoryNameSlugOut], 404: ErrorResponse},
+)
+@query_budget(2)
+async def aget_active_non_archived_categories(request):
+    queryset = (
+        Category.objects.only("name", "slug")
+        .filter(is_active=True)
+        .exclude(name="Clothes")
+    )
+
+    if not await queryset.aexists():
+        return 404, {"detail": "No active categories found excluding 'Archived'."}
+
+    return [{"name": category.name, "slug": category.slug} async for category in queryset]
+
+
+@router.get(
+    "/async/category/inactive-names",
+    tags=["module5"],
+    summary="Retrieve inactive category names and slugs using only() (async)",
+    response={200: List[CategoryNameSlugOut], 404: ErrorResponse},
+)
+@query_budget(2)
+async def aget_inactive_category_names(request):
+    queryset = Category.objects.only("name", "slug").filter(name="Electronics")
+
+    if not await queryset.aexists():
+        return 404, {"detail": "No inactive categories found with that name."}
+
+    return [{"name": category.name, "slug": category.slug} async for category in queryset]
+
+
+@router.get(
+    "/async/category/names-optimized",
+    tags=["module5"],
+    summary="Retrieve category names and slugs using only() (async)",
+    response=List[CategoryNameSlugOut],
+)
+@query_budget(1)
+async def aget_category_names_optimized(request):
+    queryset = Category.objects.only("name", "slug")
+    return [{"name": category.name, "slug": category.slug} async for category in queryset]
+
+
+@router.get(
+    "/async/category/names",
+    tags=["module5"],
+    summary="Retrieve category names and slugs only (async)",
+    response=List[CategoryNameSlugOut],
+)
+@query_budget(1)
+async def aget_category_names(request):
+    queryset = Category.objects.values("name", "slug")
+    return [{"name": item["name"].upper(), "slug": item["slug"]} async for item in queryset]
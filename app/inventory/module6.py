@@ -1,8 +1,20 @@
-from typing import List, Optional
+from datetime import datetime
+from decimal import Decimal
+from typing import List, Literal, Optional
 from ninja import Router,Schema, Query
-from .models import Product , Category
+from .caching import cached_response, conditional_queryset
+from .export import DEFAULT_CHUNK_SIZE, export_response
+from .models import Product , Category, Order, OrderProduct
+from .pagination import akeyset_page, approximate_count, keyset_page
+from .promotions import effective_prices, price_rows
+from .query_budget import query_budget
+from .serialization import values_response
+from .search import search_products
 
-from django.db.models import Q
+from asgiref.sync import sync_to_async
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Prefetch, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse
 
 router = Router()
 
@@ -22,7 +34,9 @@ class CategorySchemaOut(Schema):
 
     @staticmethod
     def resolve_parent_id(obj):
-        return obj.parent_id.id if obj.parent_id else None
+        # routes without @values_response: the raw column, obj.parent_id.id
+        # would load every parent row (N+1)
+        return obj.parent_id_id
 
 @router.get(
     "/categories/",
@@ -30,22 +44,23 @@ class CategorySchemaOut(Schema):
     summary="Retrieve categories with given input user conditions.",
     response=List[CategorySchemaOut],
 )
+@query_budget(1)
+@values_response(CategorySchemaOut)
 def get_categories(request,name:str=None,min_level:int=None,max_level:int=None,has_parent:bool=None):
-    qs = Category.objects.all()
+    return Category.objects.filter(_category_filters(name, min_level, max_level, has_parent))
 
+
+def _category_filters(name, min_level, max_level, has_parent):
+    filters = Q()
     if name is not None:
-        qs =qs.filter(name__iexact=name)
+        filters &= Q(name__iexact=name)
     if min_level is not None:
-        qs = qs.filter(level__gte=min_level)
+        filters &= Q(level__gte=min_level)
     if max_level is not None:
-        qs = qs.filter(level__lte=max_level)
+        filters &= Q(level__lte=max_level)
     if has_parent is not None:
-        if has_parent:
-            qs = qs.filter(parent_id__isnull = False)
-        else:
-            qs = qs.filter(parent_id__isnull = True)
-
-    return qs
+        filters &= Q(parent_id__isnull=not has_parent)
+    return filters
 
 
 
@@ -55,13 +70,17 @@ def get_categories(request,name:str=None,min_level:int=None,max_level:int=None,h
     summary="Retrieve categories with given input user conditions using Q and level between parameter True indicates using OR clause on level",
     response=List[CategorySchemaOut],
 )
+@query_budget(1)
+@values_response(CategorySchemaOut)
 def get_categories_using_Q(request,
                             active:bool =None,
                             level_between:bool = False,
                             min_level:int = None,
                             max_level:int = None):
-    qs = Category.objects.all()
+    return Category.objects.filter(_category_q_filters(active, level_between, min_level, max_level))
 
+
+def _category_q_filters(active, level_between, min_level, max_level):
     filters = Q()
     if active is not None:
         filters &= Q(is_active=True)
@@ -77,11 +96,7 @@ def get_categories_using_Q(request,
         filters |= level_filter
     else:
         filters &= level_filter
-
-    print(filters)
-    qs = qs.filter(filters)
-
-    return qs
+    return filters
 
 class ProductOutSchema(Schema):
     id :int
@@ -97,19 +112,23 @@ class ProductOutSchema(Schema):
     summary = "Filter products based on input conditions using q",
     response = List[ProductOutSchema],
 )
+@query_budget(2)
+@values_response(ProductOutSchema)
 def get_products(request,
+                response: HttpResponse,
                 active:bool =None,
                 digital:bool = None,
                 min_price:float =None,
                 max_price:float = None,
                 price_match:bool = True,
                 name_or_slug:str = None):
-    filter = Q()
-    if active is not None:
-        filter &= Q(is_active=active)
-    if digital is not None:
-        filter &= Q(is_digital=digital)
+    qs = Product.objects.filter(
+        _product_filters(active, digital, min_price, max_price, price_match, name_or_slug)
+    )
+    return conditional_queryset(request, response, qs)
 
+
+def _price_filter(min_price, max_price, price_match):
     price_filter =Q()
     if price_match: #in range on min, max price
         if min_price is not None:
@@ -121,13 +140,20 @@ def get_products(request,
             price_filter |= Q(price__lt = min_price)
         if max_price is not None:
             price_filter |= Q(price__gt = max_price)
+    return price_filter
+
 
-    filter &= price_filter
+def _product_filters(active, digital, min_price, max_price, price_match, name_or_slug):
+    filter = Q()
+    if active is not None:
+        filter &= Q(is_active=active)
+    if digital is not None:
+        filter &= Q(is_digital=digital)
+
+    filter &= _price_filter(min_price, max_price, price_match)
     if name_or_slug is not None:
         filter &= (Q(name=name_or_slug) | Q(slug =name_or_slug))
-    
-    qs = Product.objects.filter(filter)
-    return qs
+    return filter
 
 @router.get(
     "/products/negate/",
@@ -135,30 +161,28 @@ def get_products(request,
     summary = "Filter products based on input conditions using negate for exclude_keyword",
     response = List[ProductOutSchema],
 )
+@query_budget(2)
+@values_response(ProductOutSchema)
 def get_products_negate(request,
+                response: HttpResponse,
                 active:bool =None,
                 min_price:float =None,
                 max_price:float = None,
                 price_match:bool = True,
                 exclude_keyword :bool = False, 
                 name_or_slug:str = None):
+    qs = Product.objects.filter(
+        _product_negate_filters(active, min_price, max_price, price_match, exclude_keyword, name_or_slug)
+    )
+    return conditional_queryset(request, response, qs)
+
+
+def _product_negate_filters(active, min_price, max_price, price_match, exclude_keyword, name_or_slug):
     filter = Q()
     if active is not None:
         filter &= Q(is_active=active)
-    
-    price_filter =Q()
-    if price_match: #in range on min, max price
-        if min_price is not None:
-            price_filter &= Q(price__gte =min_price)
-        if max_price is not None:
-            price_filter &= Q(price__lte = max_price)
-    else: #outside range of min,max price
-        if min_price is not None:
-            price_filter |= Q(price__lt = min_price)
-        if max_price is not None:
-            price_filter |= Q(price__gt = max_price)
 
-    filter &= price_filter
+    filter &= _price_filter(min_price, max_price, price_match)
 
     '''
     if exclude_keyword:
@@ -174,9 +198,7 @@ def get_products_negate(request,
         keyword_filter &= Q(name__icontains=name_or_slug) | Q(slug__icontains =name_or_slug)
 
     filter &= ~keyword_filter if exclude_keyword else keyword_filter
-
-    qs = Product.objects.filter(filter)
-    return qs
+    return filter
 
 class ProductOutPatternSearch(Schema):
     id: int
@@ -192,9 +214,17 @@ class ProductOutPatternSearch(Schema):
     summary="Filter products by name/slug with selectable pattern matching",
     response=List[ProductOutPatternSearch],
 )
+@query_budget(2)
+@values_response(ProductOutPatternSearch)
 def get_product_name_pattern(request,
+                        response: HttpResponse,
                         search_string:str,
                          search_type:str='all'):
+    qs = Product.objects.filter(_name_pattern_filter(search_string, search_type))
+    return conditional_queryset(request, response, qs)
+
+
+def _name_pattern_filter(search_string, search_type):
     filter=Q()
 
     if search_type =='starts':
@@ -203,9 +233,37 @@ def get_product_name_pattern(request,
         filter &= Q(name__iendswith=search_string) | Q(slug__iendswith=search_string)
     else:
         filter &= Q(name__icontains=search_string) | Q(slug__icontains=search_string)
+    return filter
 
-    qs = Product.objects.filter(filter)
-    return qs
+
+class ProductSearchOut(Schema):
+    id: int
+    name: str
+    slug: str
+    is_digital: bool
+    is_active: bool
+    price: float
+    score: float
+
+@router.get(
+    "/products/search/",
+    tags=["module6"],
+    summary="Ranked product search over name, slug and description",
+    description="Full-text search on a trigger maintained tsvector plus pg_trgm similarity "
+                "on PostgreSQL, icontains with a simple score elsewhere. Best matches first.",
+    response=List[ProductSearchOut],
+)
+@query_budget(2)
+@values_response(ProductSearchOut)
+def search_products_ranked(request,
+                           q: str = Query(..., min_length=2),
+                           active: Optional[bool] = None,
+                           limit: int = Query(20, ge=1, le=100)):
+    qs = Product.objects.all()
+    if active is not None:
+        qs = qs.filter(is_active=active)
+
+    return search_products(q, qs)[:limit]
 
 
 class ProductOutByIdList(Schema):
@@ -222,7 +280,10 @@ class ProductOutByIdList(Schema):
     summary="Get all the products of given ids",
     response = list[ProductOutByIdList],
 )
+@query_budget(2)
+@values_response(ProductOutByIdList)
 def get_product_by_id_list(request,
+                        response: HttpResponse,
                         ids:List[int] = Query(...)
                     ):
     filter =Q()
@@ -232,7 +293,7 @@ def get_product_by_id_list(request,
         return []
 
     qs = Product.objects.filter(filter)
-    return qs
+    return conditional_queryset(request, response, qs)
 
 class ProductOutByPriceRange(Schema):
     id: int
@@ -248,7 +309,9 @@ class ProductOutByPriceRange(Schema):
     summary="Get all the products of given price range",
     response = list[ProductOutByPriceRange],
 )
-def get_products_by_price_range(request,min_price:float,max_price:float,active:Optional[bool]=None):
+@query_budget(2)
+@values_response(ProductOutByPriceRange)
+def get_products_by_price_range(request,response: HttpResponse,min_price:float,max_price:float,active:Optional[bool]=None):
     filters = Q()
     if active is not None:
         filters &= Q(is_active=active)
@@ -256,7 +319,7 @@ def get_products_by_price_range(request,min_price:float,max_price:float,active:O
     filters &= Q(price__range=(min_price,max_price))
 
     qs = Product.objects.filter(filters)
-    return qs
+    return conditional_queryset(request, response, qs)
 
 class ProductOutBySlice(Schema):
     id: int
@@ -271,12 +334,15 @@ class ProductOutBySlice(Schema):
     summary="Get all the products of given slice range",
     response = list[ProductOutBySlice],
 )
+@query_budget(2)
+@values_response(ProductOutBySlice)
 def get_product_by_slice_range(request,
+                                response: HttpResponse,
                                 start:int = Query(0,ge=0,description="Start index(inclusive)"),
                                 end:int = Query(10,gt=0,description="End index")):
 
         qs = Product.objects.all().order_by("-created_at")[start:end]
-        return qs
+        return conditional_queryset(request, response, qs)
 
 
 class PaginatedResponse(Schema):
@@ -292,6 +358,8 @@ class PaginatedResponse(Schema):
     summary="Paginate filtered categories by page number",
     response=PaginatedResponse,
 )
+@cached_response(Category, PaginatedResponse)
+@query_budget(2)
 def paginate_categories_by_page(
     request,
     page: int = Query(1, ge=1),
@@ -318,6 +386,182 @@ def paginate_categories_by_page(
     }
 
 
+class ErrorResponse(Schema):
+    detail: str
+
+
+class CategoryCursorPage(Schema):
+    next_cursor: Optional[str]
+    approximate_total: Optional[int] = None
+    items: List[CategorySchemaOut]
+
+
+@router.get(
+    "/categories/cursor",
+    tags=["module6"],
+    summary="Paginate categories with an opaque cursor ordered by (name, id)",
+    description="Pass next_cursor from the previous response to get the following page. "
+                "approximate_total comes from pg_class.reltuples instead of COUNT(*).",
+    response={200: CategoryCursorPage, 400: ErrorResponse},
+)
+@query_budget(2)
+def paginate_categories_by_cursor(
+    request,
+    cursor: Optional[str] = Query(None),
+    page_size: int = Query(10, ge=1, le=100),
+    is_active: Optional[bool] = Query(None),
+    with_total: bool = Query(False),
+):
+    filters = Q()
+    if is_active is not None:
+        filters &= Q(is_active=is_active)
+
+    try:
+        items, next_cursor = keyset_page(Category.objects.filter(filters),
+                                         ("name", "id"), cursor, page_size)
+    except ValueError as exc:
+        return 400, {"detail": str(exc)}
+
+    return {
+        "next_cursor": next_cursor,
+        "approximate_total": approximate_count(Category) if with_total else None,
+        "items": items,
+    }
+
+
+class ProductCursorPage(Schema):
+    next_cursor: Optional[str]
+    approximate_total: Optional[int] = None
+    items: List[ProductOutSchema]
+
+
+@router.get(
+    "/products/cursor",
+    tags=["module6"],
+    summary="Paginate products newest first with an opaque cursor ordered by (created_at, id)",
+    response={200: ProductCursorPage, 400: ErrorResponse},
+)
+@query_budget(2)
+def paginate_products_by_cursor(
+    request,
+    cursor: Optional[str] = Query(None),
+    page_size: int = Query(10, ge=1, le=100),
+    active: Optional[bool] = Query(None),
+    with_total: bool = Query(False),
+):
+    filters = Q()
+    if active is not None:
+        filters &= Q(is_active=active)
+
+    try:
+        items, next_cursor = keyset_page(Product.objects.filter(filters),
+                                         ("-created_at", "-id"), cursor, page_size)
+    except ValueError as exc:
+        return 400, {"detail": str(exc)}
+
+    return {
+        "next_cursor": next_cursor,
+        "approximate_total": approximate_count(Product) if with_total else None,
+        "items": items,
+    }
+
+
+@router.get(
+    "/categories/{category_id}/descendants",
+    tags=["module6"],
+    summary="All categories below a category, resolved with one recursive query",
+    response=List[CategorySchemaOut],
+)
+@query_budget(1)
+@values_response(CategorySchemaOut)
+def get_category_descendants(request, category_id: int, include_self: bool = False):
+    return (Category.objects.filter(id=category_id)
+                            .descendants(include_self=include_self)
+                            .order_by("level", "name"))
+
+
+@router.get(
+    "/categories/{category_id}/ancestors",
+    tags=["module6"],
+    summary="Path from the root down to a category, resolved with one recursive query",
+    response=List[CategorySchemaOut],
+)
+@query_budget(1)
+@values_response(CategorySchemaOut)
+def get_category_ancestors(request, category_id: int, include_self: bool = False):
+    return (Category.objects.filter(id=category_id)
+                            .ancestors(include_self=include_self)
+                            .order_by("level"))
+
+
+@router.get(
+    "/categories/{category_id}/products",
+    tags=["module6"],
+    summary="Products of a category and of every category below it",
+    response=List[ProductOutSchema],
+)
+@query_budget(2)
+@values_response(ProductOutSchema)
+def get_category_subtree_products(request, response: HttpResponse, category_id: int,
+                                  active: Optional[bool] = None):
+    qs = Category.objects.filter(id=category_id).subtree_products()
+    if active is not None:
+        qs = qs.filter(is_active=active)
+    return conditional_queryset(request, response, qs)
+
+
+class CategoryStatsOut(Schema):
+    category_id: int
+    name: str
+    product_count: int
+    active_count: int
+    total_value: float
+    average_price: Optional[float] = None
+
+
+def _category_stats_out(category):
+    """ Stats row of a category loaded with select_related("stats"), zeros if it has none yet"""
+    stats = getattr(category, "stats", None)
+    return {
+        "category_id": category.id,
+        "name": category.name,
+        "product_count": stats.product_count if stats else 0,
+        "active_count": stats.active_count if stats else 0,
+        "total_value": stats.total_value if stats else 0,
+        "average_price": stats.average_price if stats else None,
+    }
+
+
+@router.get(
+    "/categories/stats/",
+    tags=["module6"],
+    summary="Product count, active count, total value and average price per category",
+    description="Served from the materialized CategoryStats table, one row per category, "
+                "no aggregation over products.",
+    response=List[CategoryStatsOut],
+)
+@query_budget(1)
+def get_category_stats(request, is_active: Optional[bool] = None):
+    qs = Category.objects.select_related("stats").order_by("name")
+    if is_active is not None:
+        qs = qs.filter(is_active=is_active)
+    return [_category_stats_out(category) for category in qs]
+
+
+@router.get(
+    "/categories/{category_id}/stats",
+    tags=["module6"],
+    summary="Product statistics of one category",
+    response={200: CategoryStatsOut, 404: ErrorResponse},
+)
+@query_budget(1)
+def get_single_category_stats(request, category_id: int):
+    category = Category.objects.select_related("stats").filter(id=category_id).first()
+    if category is None:
+        return 404, {"detail": "Category not found."}
+    return _category_stats_out(category)
+
+
 class CategoryOut(Schema):
     id: int
     name: str
@@ -332,9 +576,540 @@ class CategoryOut(Schema):
     summary="Return all active categories using custom manager",
     response=List[CategoryOut],
 )
+@cached_response(Category, List[CategoryOut])
+@query_budget(1)
+@values_response(CategoryOut)
 def get_active_categories(request):
     return Category.objects.active().order_by("name")
-    
 
 
+class EffectivePriceOut(Schema):
+    product_id: int
+    price: float
+    price_reduction: int
+    effective_price: float
+
+
+@router.get(
+    "/products/effective-prices",
+    tags=["module6"],
+    summary="Price after the best running promotion for a batch of products",
+    description="One query for all ids, the running promotions come from the GiST index "
+                "on the promotion window. at defaults to now.",
+    response=List[EffectivePriceOut],
+)
+@query_budget(1)
+def get_effective_prices(request, ids: List[int] = Query(...), at: Optional[datetime] = None):
+    prices = effective_prices(ids, at)
+    return [{"product_id": product_id, **prices[product_id]} for product_id in ids if product_id in prices]
+
+
+class PricedProductOut(Schema):
+    id: int
+    name: str
+    slug: str
+    is_active: bool
+    price: float
+    price_reduction: int
+    effective_price: float
+
+
+class PricedProductPage(Schema):
+    next_cursor: Optional[str]
+    items: List[PricedProductOut]
+
+
+@router.get(
+    "/products/priced",
+    tags=["module6"],
+    summary="Newest products with their promotion price, keyset paginated",
+    description="Prices come from the in-process promotion index, no join per product; "
+                "it is reloaded (2 queries) after a promotion changes.",
+    response={200: PricedProductPage, 400: ErrorResponse},
+)
+@query_budget(3)
+def paginate_priced_products(
+    request,
+    cursor: Optional[str] = Query(None),
+    page_size: int = Query(20, ge=1, le=100),
+    active: Optional[bool] = Query(None),
+):
+    qs = Product.objects.only("id", "name", "slug", "is_active", "price", "created_at")
+    if active is not None:
+        qs = qs.filter(is_active=active)
+
+    try:
+        items, next_cursor = keyset_page(qs, ("-created_at", "-id"), cursor, page_size)
+    except ValueError as exc:
+        return 400, {"detail": str(exc)}
+
+    rows = [{"id": p.id, "name": p.name, "slug": p.slug, "is_active": p.is_active, "price": p.price}
+            for p in items]
+    return {"next_cursor": next_cursor, "items": price_rows(rows)}
+
+
+class OrderLineOut(Schema):
+    product_id: int
+    product_name: str
+    category_name: str
+    quantity: int
+    unit_price: float
+    line_total: float
+
+
+class OrderHistoryOut(Schema):
+    id: int
+    user_id: int
+    username: str
+    created_date: datetime
+    item_count: int
+    total: float
+    lines: List[OrderLineOut]
+
+
+class OrderHistoryPage(Schema):
+    next_cursor: Optional[str]
+    items: List[OrderHistoryOut]
+
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _order_sum(expression):
+    """ Subquery summing expression over the lines of the outer order. A
+        subquery rather than a GROUP BY join, so only the orders of the page
+        get summed and the LIMIT can stop the index scan early."""
+    return Coalesce(
+        Subquery(OrderProduct.objects.filter(order=OuterRef("pk"))
+                 .values("order")
+                 .annotate(sum=Sum(expression, output_field=MONEY))
+                 .values("sum")),
+        Value(Decimal("0")), output_field=MONEY)
+
+
+def _order_history_qs(user_id):
+    """ A user's orders with item_count and total computed in SQL, their lines
+        (with line_total, product and category) in one prefetch query"""
+    lines = (OrderProduct.objects
+             .select_related("product__category_id")
+             .annotate(line_total=ExpressionWrapper(F("quantity") * F("product__price"), output_field=MONEY))
+             .order_by("id"))
+    return (Order.objects.filter(user_id=user_id)
+            .select_related("user")
+            .annotate(item_count=_order_sum(F("quantity")),
+                      total=_order_sum(F("quantity") * F("product__price")))
+            .prefetch_related(Prefetch("orderproduct_set", queryset=lines, to_attr="lines")))
+
+
+@router.get(
+    "/orders/",
+    tags=["module6"],
+    summary="A user's order history newest first, with lines and totals, keyset paginated on (created_date, id)",
+    description="Two queries per page however many orders and lines: the orders with their "
+                "totals, then every line of the page with its product and category.",
+    response={200: OrderHistoryPage, 400: ErrorResponse},
+)
+@query_budget(2)
+def get_order_history(
+    request,
+    user_id: int,
+    cursor: Optional[str] = Query(None),
+    page_size: int = Query(10, ge=1, le=100),
+):
+    try:
+        orders, next_cursor = keyset_page(_order_history_qs(user_id), ("-created_date", "-id"),
+                                          cursor, page_size)
+    except ValueError as exc:
+        return 400, {"detail": str(exc)}
+
+    items = [
+        {
+            "id": order.id,
+            "user_id": order.user_id,
+            "username": order.user.username,
+            "created_date": order.created_date,
+            "item_count": order.item_count,
+            "total": order.total,
+            "lines": [
+                {
+                    "product_id": line.product_id,
+                    "product_name": line.product.name,
+                    "category_name": line.product.category_id.name,
+                    "quantity": line.quantity,
+                    "unit_price": line.product.price,
+                    "line_total": line.line_total,
+                }
+                for line in order.lines
+            ],
+        }
+        for order in orders
+    ]
+    return {"next_cursor": next_cursor, "items": items}
+
+
+PRODUCT_EXPORT_FIELDS = ("id", "name", "slug", "is_digital", "is_active", "price", "category_id", "updated_at")
+CATEGORY_EXPORT_FIELDS = ("id", "name", "slug", "is_active", "level", "parent_id")
+
+ExportFormat = Literal["json", "ndjson"]
+
+
+def _export_products_qs(active, digital, min_price, max_price):
+    return Product.objects.filter(
+        _product_filters(active, digital, min_price, max_price, True, None)
+    ).order_by("id")
+
+
+# The export routes have no @query_budget: their one query runs while the
+# response streams, after the view has returned.
+# They are async views so ASGI (what docker-compose runs) calls them
+# without a thread hop; export_response() streams under WSGI as well.
+@router.get(
+    "/products/export",
+    tags=["module6"],
+    summary="Stream filtered products as a JSON array or NDJSON",
+    description="Rows are read through a server-side cursor chunk_size at a time and "
+                "written out as they come, memory does not grow with the result size.",
+)
+async def export_products(request,
+                          format: ExportFormat = "json",
+                          chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=100, le=20000),
+                          active: Optional[bool] = None,
+                          digital: Optional[bool] = None,
+                          min_price: Optional[float] = None,
+                          max_price: Optional[float] = None):
+    qs = _export_products_qs(active, digital, min_price, max_price)
+    return export_response(request, qs, PRODUCT_EXPORT_FIELDS, format, chunk_size, "products")
+
+
+@router.get(
+    "/categories/export",
+    tags=["module6"],
+    summary="Stream all categories as a JSON array or NDJSON",
+)
+async def export_categories(request,
+                            format: ExportFormat = "json",
+                            chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=100, le=20000)):
+    qs = Category.objects.order_by("id")
+    return export_response(request, qs, CATEGORY_EXPORT_FIELDS, format, chunk_size, "categories")
+
+
+########################################
+# Async variants: same filters and queries through the async ORM.
+# Ninja needs plain data back from an async handler, so querysets are
+# materialized with async for before returning.
+########################################
+
+
+@router.get(
+    "/async/categories/",
+    tags=['module6'],
+    summary="Retrieve categories with given input user conditions (async)",
+    response=List[CategorySchemaOut],
+)
+@query_budget(1)
+async def aget_categories(request,name:str=None,min_level:int=None,max_level:int=None,has_parent:bool=None):
+    qs = Category.objects.filter(_category_filters(name, min_level, max_level, has_parent))
+    return [category async for category in qs]
+
+
+@router.get(
+    "/async/categories/q/",
+    tags=['module6'],
+    summary="Retrieve categories using Q, level_between True ORs the level range (async)",
+    response=List[CategorySchemaOut],
+)
+@query_budget(1)
+async def aget_categories_using_Q(request,
+                                  active:bool =None,
+                                  level_between:bool = False,
+                                  min_level:int = None,
+                                  max_level:int = None):
+    qs = Category.objects.filter(_category_q_filters(active, level_between, min_level, max_level))
+    return [category async for category in qs]
+
+
+@router.get(
+    "/async/products/",
+    tags=["module6"],
+    summary = "Filter products based on input conditions using q (async)",
+    response = List[ProductOutSchema],
+)
+@query_budget(1)
+async def aget_products(request,
+                        active:bool =None,
+                        digital:bool = None,
+                        min_price:float =None,
+                        max_price:float = None,
+                        price_match:bool = True,
+                        name_or_slug:str = None):
+    qs = Product.objects.filter(
+        _product_filters(active, digital, min_price, max_price, price_match, name_or_slug)
+    )
+    return [product async for product in qs]
+
+
+@router.get(
+    "/async/products/negate/",
+    tags=["module6"],
+    summary = "Filter products using negate for exclude_keyword (async)",
+    response = List[ProductOutSchema],
+)
+@query_budget(1)
+async def aget_products_negate(request,
+                               active:bool =None,
+                               min_price:float =None,
+                               max_price:float = None,
+                               price_match:bool = True,
+                               exclude_keyword :bool = False,
+                               name_or_slug:str = None):
+    qs = Product.objects.filter(
+        _product_negate_filters(active, min_price, max_price, price_match, exclude_keyword, name_or_slug)
+    )
+    return [product async for product in qs]
+
+
+@router.get(
+    "/async/products/name_pattern/",
+    tags=["module6"],
+    summary="Filter products by name/slug with selectable pattern matching (async)",
+    response=List[ProductOutPatternSearch],
+)
+@query_budget(1)
+async def aget_product_name_pattern(request, search_string:str, search_type:str='all'):
+    qs = Product.objects.filter(_name_pattern_filter(search_string, search_type))
+    return [product async for product in qs]
+
+
+@router.get(
+    "/async/products/search/",
+    tags=["module6"],
+    summary="Ranked product search over name, slug and description (async)",
+    response=List[ProductSearchOut],
+)
+@query_budget(2)
+async def asearch_products_ranked(request,
+                                  q: str = Query(..., min_length=2),
+                                  active: Optional[bool] = None,
+                                  limit: int = Query(20, ge=1, le=100)):
+    qs = Product.objects.all()
+    if active is not None:
+        qs = qs.filter(is_active=active)
+
+    # building the query may look up pg_trgm once, which is a sync query
+    qs = await sync_to_async(search_products)(q, qs)
+    return [product async for product in qs[:limit]]
+
+
+@router.get(
+    "/async/products/by-ids/",
+    tags=["module6"],
+    summary="Get all the products of given ids (async)",
+    response = list[ProductOutByIdList],
+)
+@query_budget(1)
+async def aget_product_by_id_list(request, ids:List[int] = Query(...)):
+    if not ids:
+        return []
+    return [product async for product in Product.objects.filter(id__in=ids)]
+
+
+@router.get(
+    "/async/products/by-price-range/",
+    tags=["module6"],
+    summary="Get all the products of given price range (async)",
+    response = list[ProductOutByPriceRange],
+)
+@query_budget(1)
+async def aget_products_by_price_range(request,min_price:float,max_price:float,active:Optional[bool]=None):
+    filters = Q()
+    if active is not None:
+        filters &= Q(is_active=active)
+
+    filters &= Q(price__range=(min_price,max_price))
+    return [product async for product in Product.objects.filter(filters)]
+
+
+@router.get(
+    "/async/products/get_by_slice",
+    tags=["module6"],
+    summary="Get all the products of given slice range (async)",
+    response = list[ProductOutBySlice],
+)
+@query_budget(1)
+async def aget_product_by_slice_range(request,
+                                      start:int = Query(0,ge=0,description="Start index(inclusive)"),
+                                      end:int = Query(10,gt=0,description="End index")):
+    qs = Product.objects.all().order_by("-created_at")[start:end]
+    return [product async for product in qs]
+
+
+@router.get(
+    "/async/categories/paginated",
+    tags=["module6"],
+    summary="Paginate filtered categories by page number (async)",
+    response=PaginatedResponse,
+)
+@query_budget(2)
+async def apaginate_categories_by_page(
+    request,
+    page: int = Query(1, ge=1),
+    page_size: int = Query(10, ge=1, le=100),
+    is_active: Optional[bool] = Query(None),
+):
+    filters = Q()
+    if is_active is not None:
+        filters &= Q(is_active=is_active)
+
+    qs = Category.objects.filter(filters).order_by("name")
+    start = (page - 1) * page_size
+    return {
+        "total": await qs.acount(),
+        "page": page,
+        "page_size": page_size,
+        "items": [category async for category in qs[start:start + page_size]],
+    }
+
+
+@router.get(
+    "/async/categories/cursor",
+    tags=["module6"],
+    summary="Paginate categories with an opaque cursor ordered by (name, id) (async)",
+    response={200: CategoryCursorPage, 400: ErrorResponse},
+)
+@query_budget(2)
+async def apaginate_categories_by_cursor(
+    request,
+    cursor: Optional[str] = Query(None),
+    page_size: int = Query(10, ge=1, le=100),
+    is_active: Optional[bool] = Query(None),
+    with_total: bool = Query(False),
+):
+    filters = Q()
+    if is_active is not None:
+        filters &= Q(is_active=is_active)
+
+    try:
+        items, next_cursor = await akeyset_page(Category.objects.filter(filters),
+                                                ("name", "id"), cursor, page_size)
+    except ValueError as exc:
+        return 400, {"detail": str(exc)}
+
+    return {
+        "next_cursor": next_cursor,
+        "approximate_total": await sync_to_async(approximate_count)(Category) if with_total else None,
+        "items": items,
+    }
+
+
+@router.get(
+    "/async/products/cursor",
+    tags=["module6"],
+    summary="Paginate products newest first with an opaque cursor (async)",
+    response={200: ProductCursorPage, 400: ErrorResponse},
+)
+@query_budget(2)
+async def apaginate_products_by_cursor(
+    request,
+    cursor: Optional[str] = Query(None),
+    page_size: int = Query(10, ge=1, le=100),
+    active: Optional[bool] = Query(None),
+    with_total: bool = Query(False),
+):
+    filters = Q()
+    if active is not None:
+        filters &= Q(is_active=active)
+
+    try:
+        items, next_cursor = await akeyset_page(Product.objects.filter(filters),
+                                                ("-created_at", "-id"), cursor, page_size)
+    except ValueError as exc:
+        return 400, {"detail": str(exc)}
+
+    return {
+        "next_cursor": next_cursor,
+        "approximate_total": await sync_to_async(approximate_count)(Product) if with_total else None,
+        "items": items,
+    }
+
+
+@router.get(
+    "/async/categories/{category_id}/descendants",
+    tags=["module6"],
+    summary="All categories below a category (async)",
+    response=List[CategorySchemaOut],
+)
+@query_budget(1)
+async def aget_category_descendants(request, category_id: int, include_self: bool = False):
+    qs = (Category.objects.filter(id=category_id)
+                          .descendants(include_self=include_self)
+                          .order_by("level", "name"))
+    return [category async for category in qs]
+
+
+@router.get(
+    "/async/categories/{category_id}/ancestors",
+    tags=["module6"],
+    summary="Path from the root down to a category (async)",
+    response=List[CategorySchemaOut],
+)
+@query_budget(1)
+async def aget_category_ancestors(request, category_id: int, include_self: bool = False):
+    qs = (Category.objects.filter(id=category_id)
+                          .ancestors(include_self=include_self)
+                          .order_by("level"))
+    return [category async for category in qs]
+
+
+@router.get(
+    "/async/categories/{category_id}/products",
+    tags=["module6"],
+    summary="Products of a category and of every category below it (async)",
+    response=List[ProductOutSchema],
+)
+@query_budget(1)
+async def aget_category_subtree_products(request, category_id: int, active: Optional[bool] = None):
+    qs = Category.objects.filter(id=category_id).subtree_products()
+    if active is not None:
+        qs = qs.filter(is_active=active)
+    return [product async for product in qs]
+
+
+@router.get(
+    "/async/categories/stats/",
+    tags=["module6"],
+    summary="Product count, active count, total value and average price per category (async)",
+    response=List[CategoryStatsOut],
+)
+@query_budget(1)
+async def aget_category_stats(request, is_active: Optional[bool] = None):
+    qs = Category.objects.select_related("stats").order_by("name")
+    if is_active is not None:
+        qs = qs.filter(is_active=is_active)
+    return [_category_stats_out(category) async for category in qs]
+
+
+@router.get(
+    "/async/categories/{category_id}/stats",
+    tags=["module6"],
+    summary="Product statistics of one category (async)",
+    response={200: CategoryStatsOut, 404: ErrorResponse},
+)
+@query_budget(1)
+async def aget_single_category_stats(request, category_id: int):
+    category = await Category.objects.select_related("stats").filter(id=category_id).afirst()
+    if category is None:
+        return 404, {"detail": "Category not found."}
+    return _category_stats_out(category)
+
+
+@router.get(
+    "/async/categories/active",
+    tags=["module6"],
+    summary="Return all active categories using custom manager (async)",
+    response=List[CategoryOut],
+)
+@query_budget(1)
+async def aget_active_categories(request):
+    return [category async for category in Category.objects.active().order_by("name")]
+
 
@@ -0,0 +1,103 @@
+""" Keyset (cursor) pagination helpers
+
+Instead of OFFSET the next page starts right after the last row of the
+previous one, e.g. WHERE (name, id) > ('Phones', 42) ORDER BY name, id.
+The database can seek straight to that position in an index, so page
+2000 costs the same as page 1. The cursor handed to clients is the
+ordering values of the last row, json + base64 encoded.
+"""
+
+import base64
+import json
+
+from django.db import connection
+from django.db.models import Q
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor, model, ordering):
+    """ Turn a cursor back into typed values for the ordering fields.
+        Raises ValueError for anything that is not a cursor we produced."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        raise ValueError("Invalid cursor.")
+
+    try:
+        return [
+            model._meta.get_field(field.lstrip("-")).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+
+def _after(ordering, values):
+    """ Q for rows that sort strictly after values, e.g. for ("name", "id"):
+        name > v0 OR (name = v0 AND id > v1)"""
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip("-")
+        lookup = "lt" if field.startswith("-") else "gt"
+        condition |= equal & Q(**{f"{name}__{lookup}": value})
+        equal &= Q(**{name: value})
+
+    # redundant bound on the leading column lets the planner use it as an index range
+    first = ordering[0]
+    lookup = "lte" if first.startswith("-") else "gte"
+    return Q(**{f"{first.lstrip('-')}__{lookup}": values[0]}) & condition
+
+
+def _page_queryset(qs, ordering, cursor, page_size):
+    qs = qs.order_by(*ordering)
+    if cursor:
+        qs = qs.filter(_after(ordering, decode_cursor(cursor, qs.model, ordering)))
+    # one extra row tells us whether there is a next page, no COUNT needed
+    return qs[:page_size + 1]
+
+
+def _split_page(items, ordering, page_size):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field.lstrip("-")) for field in ordering])
+    return items, next_cursor
+
+
+def keyset_page(qs, ordering, cursor=None, page_size=10):
+    """ Return (items, next_cursor) for the page that follows cursor.
+        ordering must end with a unique field (normally id) so every row
+        has a distinct position."""
+    items = list(_page_queryset(qs, ordering, cursor, page_size))
+    return _split_page(items, ordering, page_size)
+
+
+async def akeyset_page(qs, ordering, cursor=None, page_size=10):
+    """ keyset_page() for async views """
+    items = [obj async for obj in _page_queryset(qs, ordering, cursor, page_size)]
+    return _split_page(items, ordering, page_size)
+
+
+def approximate_count(model):
+    """ Row estimate from pg_class.reltuples, kept by VACUUM/ANALYZE.
+        Free compared to COUNT(*); None when unknown or not on PostgreSQL."""
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    # reltuples is -1 for a table that was never analyzed
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
@@ -0,0 +1,213 @@
+""" Profile the code_examples query shapes
+
+Every ex* function in the code_examples package is run a few times and
+for each one we keep the query count, the time (median of the runs), the
+DB time, rows returned and an EXPLAIN plan per distinct SQL shape
+(EXPLAIN (ANALYZE, BUFFERS) on PostgreSQL, EXPLAIN QUERY PLAN on sqlite).
+compare() diffs a report against a stored baseline and variant_summary()
+puts the exN / exN_values / exN_only versions of an example side by side.
+"""
+
+import importlib
+import inspect
+import io
+import pkgutil
+import re
+import statistics
+import time
+from contextlib import redirect_stdout
+from fnmatch import fnmatch
+
+from django.db import DatabaseError, connection, transaction
+
+from .query_budget import collect_queries, normalize_sql
+
+EXAMPLES_PACKAGE = "code_examples"
+EXAMPLE_NAME = re.compile(r"^(ex\d+)(?:_(\w+))?$")
+
+# time differences below this are noise at any dataset size
+MIN_TIME_DELTA_MS = 1.0
+
+
+def discover_examples(package=EXAMPLES_PACKAGE, match=None):
+    """ [(key, function)] for every exN function, key is "module.function" """
+    examples = []
+    for info in pkgutil.iter_modules(importlib.import_module(package).__path__):
+        module = importlib.import_module(f"{package}.{info.name}")
+        for name, func in inspect.getmembers(module, inspect.isfunction):
+            key = f"{info.name}.{name}"
+            if func.__module__ != module.__name__ or not EXAMPLE_NAME.match(name):
+                continue
+            if match and not fnmatch(key, match):
+                continue
+            examples.append((key, func))
+    return sorted(examples, key=lambda item: (item[1].__module__, item[1].__code__.co_firstlineno))
+
+
+def explain(sql, params):
+    """ Query plan text for a SELECT, None when it can't be explained """
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    if connection.vendor == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) "
+    elif connection.vendor == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        return None
+
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return "\n".join(str(row[-1]) for row in cursor.fetchall())
+    except DatabaseError as exc:
+        return f"EXPLAIN failed: {exc}"
+
+
+def _run_once(func):
+    """ Run one example in a transaction that is always rolled back """
+    with transaction.atomic():
+        with redirect_stdout(io.StringIO()), collect_queries(record=True) as collector:
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+        transaction.set_rollback(True)
+    return elapsed, collector
+
+
+def _rows(queries):
+    # sqlite doesn't report rows for SELECTs, None rather than a misleading 0
+    counts = [q["rows"] for q in queries if q["rows"] is not None]
+    return sum(counts) if counts else None
+
+
+def _statements(collector, with_plans):
+    """ One entry per SQL shape, with the plan of its first execution """
+    statements = {}
+    for query in collector.queries:
+        shape = normalize_sql(query["sql"])
+        entry = statements.get(shape)
+        if entry is None:
+            entry = statements[shape] = {
+                "sql": query["sql"],
+                "executions": 0,
+                "ms": 0.0,
+                "rows": None,
+                "plan": explain(query["sql"], query["params"]) if with_plans else None,
+            }
+        entry["executions"] += 1
+        entry["ms"] += query["seconds"] * 1000
+        if query["rows"] is not None:
+            entry["rows"] = (entry["rows"] or 0) + query["rows"]
+    for entry in statements.values():
+        entry["ms"] = round(entry["ms"], 3)
+    return list(statements.values())
+
+
+def profile_example(key, func, repeat=3, with_plans=True):
+    module, name = key.split(".", 1)
+    group, variant = EXAMPLE_NAME.match(name).groups()
+    result = {
+        "module": module,
+        "function": name,
+        "group": f"{module}.{group}",
+        "variant": variant or "model",
+        "doc": inspect.getdoc(func) or "",
+        "error": None,
+    }
+
+    timings = []
+    first = None
+    try:
+        for _ in range(max(1, repeat)):
+            elapsed, collector = _run_once(func)
+            timings.append(elapsed * 1000)
+            first = first or collector
+    except Exception as exc:
+        result["error"] = f"{type(exc).__name__}: {exc}"
+        if first is None:
+            return result
+
+    result.update({
+        "queries": first.count,
+        "rows": _rows(first.queries),
+        "time_ms": round(statistics.median(timings), 3),
+        "min_time_ms": round(min(timings), 3),
+        "db_ms": round(first.duration * 1000, 3),
+        "repeated_shapes": len(first.repeated(1)),
+        "statements": _statements(first, with_plans),
+    })
+    return result
+
+
+def profile_examples(examples, repeat=3, with_plans=True, progress=None):
+    results = {}
+    for key, func in examples:
+        results[key] = profile_example(key, func, repeat, with_plans)
+        if progress:
+            progress(key, results[key])
+    return results
+
+
+def variant_summary(results):
+    """ Examples that have _values / _only variants, fastest variant first """
+    groups = {}
+    for key, result in results.items():
+        if result["error"] is None:
+            groups.setdefault(result["group"], []).append(result)
+
+    summary = []
+    for group, variants in sorted(groups.items()):
+        if len(variants) < 2:
+            continue
+        variants.sort(key=lambda r: r["time_ms"])
+        summary.append({
+            "group": group,
+            "fastest": variants[0]["variant"],
+            "variants": [
+                {"variant": r["variant"], "time_ms": r["time_ms"],
+                 "queries": r["queries"], "rows": r["rows"]}
+                for r in variants
+            ],
+        })
+    return summary
+
+
+def compare(results, baseline, tolerance=0.25):
+    """ Per example differences against a baseline report's "examples".
+        Status is "regression" for more queries, a new error or a time
+        more than tolerance (and MIN_TIME_DELTA_MS) slower."""
+    diff = []
+    for key, current in results.items():
+        before = baseline.get(key)
+        if before is None:
+            diff.append({"key": key, "status": "new", "changes": {}})
+            continue
+
+        changes = {}
+        for field in ("error", "queries", "rows"):
+            if current.get(field) != before.get(field):
+                changes[field] = [before.get(field), current.get(field)]
+
+        old_ms, new_ms = before.get("time_ms"), current.get("time_ms")
+        slower = faster = False
+        if old_ms is not None and new_ms is not None and abs(new_ms - old_ms) >= MIN_TIME_DELTA_MS:
+            slower = new_ms > old_ms * (1 + tolerance)
+            faster = new_ms < old_ms / (1 + tolerance)
+            if slower or faster:
+                changes["time_ms"] = [old_ms, new_ms]
+
+        if not changes:
+            continue
+        more_queries = (current.get("queries") or 0) > (before.get("queries") or 0)
+        new_error = current.get("error") and not before.get("error")
+        if slower or more_queries or new_error:
+            status = "regression"
+        elif faster or "queries" in changes or "error" in changes:
+            status = "improvement"
+        else:
+            status = "changed"
+        diff.append({"key": key, "status": status, "changes": changes})
+
+    for key in baseline.keys() - results.keys():
+        diff.append({"key": key, "status": "removed", "changes": {}})
+    return sorted(diff, key=lambda d: d["key"])
@@ -0,0 +1,238 @@
+""" Promotion pricing
+
+A product is discounted while a PromotionEvent it belongs to is running,
+start_date <= at <= end_date. Overlapping promotions don't stack, the
+largest price_reduction wins.
+
+Two ways to price products:
+
+  - effective_prices(product_ids, at) asks the database, one query for
+    the whole batch. On PostgreSQL active_promotions() filters with
+    tstzrange(start_date, end_date, '[]') @> at, which is answered by the
+    GiST index of migration 0006 instead of comparing both dates of
+    every event.
+  - promotion_index() is an in-process IntervalTree of the running and
+    upcoming promotions with their product ids. Listings price a whole
+    page from it with no query at all. It is rebuilt when the
+    PromotionEvent version (see caching.bump_version) changes, which the
+    signals do on every promotion or promotion product write. Other
+    processes notice as long as the cache is one they all share (the
+    default file cache, redis, memcached), not a per process locmem.
+
+Products are linked in bulk: link_products() validates a list of ids with
+one query and writes them with one bulk_create(), attach_products() and
+detach_products() take a Product queryset and run a single
+INSERT ... SELECT / DELETE ... WHERE IN (SELECT ...), so a sitewide sale
+never round-trips its product ids through Python. None of them send
+signals, they bump the PromotionEvent version themselves.
+"""
+
+import threading
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import connection
+from django.db.models import F, Func, Max, Q, Value
+from django.utils import timezone
+
+from .caching import bump_version, get_version
+from .models import Product, ProductPromotionEvent, PromotionEvent
+
+CENT = Decimal("0.01")
+LINK_BATCH_SIZE = 5000
+
+
+def effective_price(price, reduction):
+    """ price with reduction percent off, rounded to cents """
+    if not reduction:
+        return Decimal(price)
+    return (Decimal(price) * (100 - reduction) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def active_promotions(at=None):
+    """ PromotionEvents running at at (default now) """
+    at = at or timezone.now()
+    if connection.vendor != "postgresql":
+        return PromotionEvent.objects.filter(start_date__lte=at, end_date__gte=at)
+
+    from django.contrib.postgres.fields import DateTimeRangeField
+    # must stay the expression of the promotion_window_gist index
+    window = Func(F("start_date"), F("end_date"), Value("[]"), function="tstzrange",
+                  output_field=DateTimeRangeField())
+    return PromotionEvent.objects.alias(window=window).filter(window__contains=at)
+
+
+def effective_prices(product_ids, at=None):
+    """ {product_id: {"price", "price_reduction", "effective_price"}} for
+        the existing products among product_ids, one query """
+    running = active_promotions(at).values("id")
+    rows = (Product.objects.filter(id__in=product_ids)
+            .annotate(price_reduction=Max("promotionevent__price_reduction",
+                                          filter=Q(promotionevent__in=running)))
+            .values_list("id", "price", "price_reduction"))
+    return {
+        product_id: {
+            "price": price,
+            "price_reduction": reduction or 0,
+            "effective_price": effective_price(price, reduction),
+        }
+        for product_id, price, reduction in rows
+    }
+
+
+class IntervalTree:
+    """ Centered interval tree over closed [start, end] intervals.
+        at(point) returns the items of the intervals containing point in
+        O(log n + matches). Built once, read only afterwards."""
+
+    def __init__(self, intervals):
+        # intervals: (start, end, item)
+        self.root = self._build(list(intervals))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        points = sorted(point for start, end, _ in intervals for point in (start, end))
+        center = points[len(points) // 2]
+        left = [i for i in intervals if i[1] < center]
+        right = [i for i in intervals if i[0] > center]
+        here = [i for i in intervals if i[0] <= center <= i[1]]
+        return (
+            center,
+            sorted(here, key=lambda i: i[0]),                # by start, for points left of center
+            sorted(here, key=lambda i: i[1], reverse=True),  # by end, for points right of center
+            self._build(left),
+            self._build(right),
+        )
+
+    def at(self, point):
+        found = []
+        node = self.root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if point < center:
+                for start, _, item in by_start:
+                    if start > point:
+                        break
+                    found.append(item)
+                node = left
+            else:
+                for _, end, item in by_end:
+                    if end < point:
+                        break
+                    found.append(item)
+                node = right if point > center else None
+        return found
+
+
+class PromotionIndex:
+    """ Running and upcoming promotions (end_date >= loaded_at) by window """
+
+    def __init__(self, version, loaded_at):
+        self.version = version
+        self.loaded_at = loaded_at
+        promotions = list(PromotionEvent.objects.filter(end_date__gte=loaded_at)
+                          .values_list("id", "start_date", "end_date", "price_reduction"))
+        self.products = {promotion_id: set() for promotion_id, *_ in promotions}
+        links = (ProductPromotionEvent.objects.filter(promotion_event__end_date__gte=loaded_at)
+                 .values_list("promotion_event_id", "product_id"))
+        for promotion_id, product_id in links.iterator(chunk_size=10000):
+            if promotion_id in self.products:
+                self.products[promotion_id].add(product_id)
+        self.tree = IntervalTree((start, end, (promotion_id, reduction))
+                                 for promotion_id, start, end, reduction in promotions)
+
+    def reductions(self, product_ids, at=None):
+        """ {product_id: best running price_reduction, 0 if none} """
+        at = at or timezone.now()
+        if at < self.loaded_at:
+            # ended promotions were not loaded
+            return {product_id: row["price_reduction"]
+                    for product_id, row in effective_prices(product_ids, at).items()}
+        running = sorted(self.tree.at(at), key=lambda item: -item[1])
+        return {
+            product_id: next((reduction for promotion_id, reduction in running
+                              if product_id in self.products[promotion_id]), 0)
+            for product_id in product_ids
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def promotion_index():
+    """ The current PromotionIndex, rebuilt (two queries) after a promotion write """
+    global _index
+    version = get_version(PromotionEvent)
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = PromotionIndex(version, timezone.now())
+            index = _index
+    return index
+
+
+def price_rows(rows, at=None):
+    """ Add price_reduction and effective_price to product dicts (id, price) from the index """
+    reductions = promotion_index().reductions([row["id"] for row in rows], at)
+    for row in rows:
+        row["price_reduction"] = reductions.get(row["id"], 0)
+        row["effective_price"] = effective_price(row["price"], row["price_reduction"])
+    return rows
+
+
+def link_products(promotion_id, product_ids):
+    """ Link the existing products among product_ids to a promotion, links
+        that already exist are left alone. Returns (linked, missing_product_ids)."""
+    product_ids = set(product_ids)
+    found = set(Product.objects.filter(id__in=product_ids).values_list("id", flat=True))
+    ProductPromotionEvent.objects.bulk_create(
+        [ProductPromotionEvent(promotion_event_id=promotion_id, product_id=product_id)
+         for product_id in sorted(found)],
+        ignore_conflicts=True,
+        batch_size=LINK_BATCH_SIZE,
+    )
+    bump_version(PromotionEvent)
+    return len(found), sorted(product_ids - found)
+
+
+def _through_columns():
+    opts = ProductPromotionEvent._meta
+    qn = connection.ops.quote_name
+    return (qn(opts.db_table), qn(opts.get_field("product").column),
+            qn(opts.get_field("promotion_event").column))
+
+
+def attach_products(promotion_id, products):
+    """ Link every product of the queryset products to a promotion with one
+        INSERT ... SELECT. Returns how many links were added."""
+    table, product_column, promotion_column = _through_columns()
+    select_sql, params = products.order_by().values("id").query.sql_with_params()
+    with connection.cursor() as cursor:
+        # "WHERE true" keeps SQLite from reading ON CONFLICT as a join constraint
+        cursor.execute(
+            f"INSERT INTO {table} ({product_column}, {promotion_column}) "
+            f"SELECT picked.id, %s FROM ({select_sql}) picked WHERE true "
+            f"ON CONFLICT ({product_column}, {promotion_column}) DO NOTHING",
+            [promotion_id, *params],
+        )
+        added = cursor.rowcount
+    bump_version(PromotionEvent)
+    return added
+
+
+def detach_products(promotion_id, products):
+    """ Unlink the products of the queryset products from a promotion with
+        one DELETE. Returns how many links were removed."""
+    table, product_column, promotion_column = _through_columns()
+    select_sql, params = products.order_by().values("id").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE {promotion_column} = %s "
+            f"AND {product_column} IN ({select_sql})",
+            [promotion_id, *params],
+        )
+        removed = cursor.rowcount
+    bump_version(PromotionEvent)
+    return removed
@@ -0,0 +1,258 @@
+""" Per request query counting, N+1 detection and query budgets
+
+QueryBudgetMiddleware counts the queries and DB time of every request
+through an execute wrapper on every connection (works with DEBUG off,
+and under ASGI, where sync views query from a worker thread) and reports
+requests that repeat the same SQL shape, the usual sign of an N+1.
+
+@query_budget(n) sets a hard budget on one Ninja route:
+
+    @router.get("/products/")
+    @query_budget(1)
+    def get_products(request): ...
+
+A QuerySet the view returns is evaluated inside the budget, and the
+middleware checks the same budget again over the whole request, so
+queries Ninja runs while serializing (a lazy related object in a
+schema) count too.
+
+What happens on a violation depends on settings.QUERY_BUDGET_MODE:
+"log" (default) logs a warning, "warn" raises a QueryBudgetWarning via
+warnings.warn, and "raise" raises QueryBudgetExceeded. The project test
+runner (core/test_runner.py) sets "raise" for the whole suite, so a route
+going over its budget fails the test that requested it.
+"""
+
+import functools
+import inspect
+import logging
+import re
+import time
+import warnings
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connection
+from django.db.models import QuerySet
+from django.http import HttpRequest
+
+logger = logging.getLogger("inventory.queries")
+
+DEFAULT_MAX_REPEATS = 5
+
+_IN_LIST = re.compile(r"IN \((?:%s|\?)(?:, (?:%s|\?))*\)")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudgetWarning(UserWarning):
+    pass
+
+
+def normalize_sql(sql):
+    """ SQL shape: literals replaced, IN lists collapsed, whitespace squashed.
+        Two queries with the same shape differ only in their parameters."""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+def _is_transaction_control(sql):
+    return sql.lstrip()[:9].upper() in ("SAVEPOINT", "RELEASE S", "ROLLBACK ")
+
+
+class QueryCollector:
+    """ execute_wrapper counting queries, DB time, rows and SQL shapes.
+        With record=True every statement is also kept in self.queries."""
+
+    def __init__(self, record=False):
+        self.count = 0
+        self.duration = 0.0
+        self.rows = 0
+        self.shapes = Counter()
+        self.queries = [] if record else None
+
+    def __call__(self, execute, sql, params, many, context):
+        if _is_transaction_control(sql):
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        rows = None
+        try:
+            result = execute(sql, params, many, context)
+            # sqlite reports -1 for SELECTs, psycopg the number of rows
+            rowcount = context["cursor"].rowcount
+            rows = rowcount if rowcount is not None and rowcount >= 0 else None
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            self.duration += elapsed
+            self.count += 1
+            self.rows += rows or 0
+            self.shapes[normalize_sql(sql)] += 1
+            if self.queries is not None:
+                self.queries.append({"sql": sql, "params": params, "many": many,
+                                     "seconds": elapsed, "rows": rows})
+
+    def repeated(self, max_repeats):
+        """ Shapes executed more than max_repeats times, most frequent first """
+        return [(shape, n) for shape, n in self.shapes.most_common() if n > max_repeats]
+
+
+# Collectors active in the current context. A ContextVar (not a per
+# connection execute_wrapper) so a collector started in async code, like
+# the middleware under ASGI, still sees queries of sync views that
+# sync_to_async runs in another thread on another connection.
+_active_collectors = ContextVar("active_query_collectors", default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    for collector in reversed(_active_collectors.get()):
+        execute = functools.partial(collector, execute)
+    return execute(sql, params, many, context)
+
+
+def install_dispatch(connection, **kwargs):
+    """ connection_created receiver: route the connection's queries through
+        the active collectors. Inserted first so connection.execute_wrapper()
+        blocks still pop their own wrapper."""
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+@contextmanager
+def collect_queries(record=False):
+    collector = QueryCollector(record)
+    # the current connection may have connected before the receiver existed
+    install_dispatch(connection)
+    token = _active_collectors.set(_active_collectors.get() + (collector,))
+    try:
+        yield collector
+    finally:
+        _active_collectors.reset(token)
+
+
+def report(message):
+    mode = getattr(settings, "QUERY_BUDGET_MODE", "log")
+    if mode == "raise":
+        raise QueryBudgetExceeded(message)
+    if mode == "warn":
+        warnings.warn(message, QueryBudgetWarning, stacklevel=3)
+    else:
+        logger.warning(message)
+
+
+def _check(name, collector, max_queries, max_repeats):
+    problems = []
+    if max_queries is not None and collector.count > max_queries:
+        problems.append(f"{collector.count} queries, budget is {max_queries}")
+    for shape, n in collector.repeated(max_repeats):
+        problems.append(f"possible N+1, {n}x: {shape[:200]}")
+    if problems:
+        report(f"{name}: " + "; ".join(problems))
+    return bool(problems)
+
+
+def _materialize(result):
+    """ Evaluate QuerySets a view returns lazily (also inside a (status, body)
+        tuple or a dict body), so their queries run inside the budget and
+        not later while Ninja serializes the response."""
+    if isinstance(result, QuerySet):
+        return list(result)
+    if isinstance(result, tuple) and len(result) == 2 and isinstance(result[0], int):
+        return result[0], _materialize(result[1])
+    if isinstance(result, dict):
+        return {key: _materialize(value) for key, value in result.items()}
+    return result
+
+
+def _hand_over(args, name, max_queries, max_repeats, reported):
+    # the middleware checks the route's limits again over the whole request,
+    # which includes whatever Ninja's serializer queries after the view
+    if args and isinstance(args[0], HttpRequest):
+        args[0].query_budget = (name, max_queries, max_repeats, reported)
+
+
+def query_budget(max_queries, max_repeats=None):
+    """ Fail, warn or log when the decorated view runs more than max_queries
+        queries or repeats one SQL shape more than max_repeats times.
+        max_queries=None only checks for repeats."""
+
+    def decorator(view_func):
+        name = f"{view_func.__module__}.{view_func.__name__}"
+
+        def limits():
+            repeats = max_repeats
+            if repeats is None:
+                repeats = getattr(settings, "QUERY_BUDGET_MAX_REPEATS", DEFAULT_MAX_REPEATS)
+            return max_queries, repeats
+
+        if inspect.iscoroutinefunction(view_func):
+            @functools.wraps(view_func)
+            async def async_wrapper(*args, **kwargs):
+                with collect_queries() as collector:
+                    result = await view_func(*args, **kwargs)
+                _hand_over(args, name, *limits(), _check(name, collector, *limits()))
+                return result
+            async_wrapper.query_budget = max_queries
+            return async_wrapper
+
+        @functools.wraps(view_func)
+        def wrapper(*args, **kwargs):
+            with collect_queries() as collector:
+                result = _materialize(view_func(*args, **kwargs))
+            _hand_over(args, name, *limits(), _check(name, collector, *limits()))
+            return result
+        wrapper.query_budget = max_queries
+        return wrapper
+
+    return decorator
+
+
+class QueryBudgetMiddleware:
+    """ Count queries and DB time for each request, expose them as
+        X-DB-Queries / X-DB-Time-Ms headers and report likely N+1s."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with collect_queries() as collector:
+            response = self.get_response(request)
+        return self._finish(request, response, collector)
+
+    async def __acall__(self, request):
+        with collect_queries() as collector:
+            response = await self.get_response(request)
+        return self._finish(request, response, collector)
+
+    def _finish(self, request, response, collector):
+        response["X-DB-Queries"] = str(collector.count)
+        response["X-DB-Time-Ms"] = f"{collector.duration * 1000:.2f}"
+
+        budget = getattr(request, "query_budget", None)
+        if budget is None:
+            max_queries = getattr(settings, "QUERY_BUDGET_DEFAULT", None)
+            max_repeats = getattr(settings, "QUERY_BUDGET_MAX_REPEATS", DEFAULT_MAX_REPEATS)
+            _check(f"{request.method} {request.path}", collector, max_queries, max_repeats)
+        else:
+            name, max_queries, max_repeats, reported = budget
+            # don't report a view that already failed its own check twice
+            if not reported:
+                _check(f"{name} (whole request)", collector, max_queries, max_repeats)
+        return response
@@ -0,0 +1,79 @@
+""" Ranked product search on name, slug and description
+
+On PostgreSQL the search uses
+  - inventory_product.search_vector, a tsvector column kept up to date by a
+    trigger (migration 0003), with a GIN index for full-text matches
+  - pg_trgm GIN indexes on UPPER(name) / UPPER(slug) for typo tolerant and
+    partial matches, when the extension is available
+Other databases (sqlite in tests) fall back to icontains with a simple
+CASE based score, so the endpoint behaves the same everywhere.
+"""
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField, TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Greatest, Upper
+
+from .models import Product
+
+SEARCH_CONFIG = "english"
+
+_has_trigram = None
+
+
+def trigram_available():
+    """ True when pg_trgm is installed in the current database """
+    global _has_trigram
+    if connection.vendor != "postgresql":
+        return False
+    if _has_trigram is None:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _has_trigram = cursor.fetchone() is not None
+    return _has_trigram
+
+
+def search_products(query, queryset=None):
+    """ Products matching query annotated with a relevance score, best first """
+    queryset = Product.objects.all() if queryset is None else queryset
+    if connection.vendor == "postgresql":
+        return _postgres_search(queryset, query)
+    return _fallback_search(queryset, query)
+
+
+def _postgres_search(queryset, query):
+    ts_query = SearchQuery(query, config=SEARCH_CONFIG, search_type="websearch")
+    # search_vector is maintained by a trigger and not declared on the model,
+    # so plain listings never load it
+    vector = RawSQL('"inventory_product"."search_vector"', [], output_field=SearchVectorField())
+
+    queryset = queryset.alias(vector=vector)
+    matches = Q(vector=ts_query)
+    score = SearchRank(vector, ts_query)
+
+    if trigram_available():
+        upper_query = query.upper()
+        # the UPPER(...) expressions match the gin_trgm_ops indexes
+        queryset = queryset.alias(name_upper=Upper("name"), slug_upper=Upper("slug"))
+        matches |= Q(name_upper__trigram_similar=upper_query) | Q(slug_upper__trigram_similar=upper_query)
+        score = Greatest(
+            score,
+            TrigramSimilarity(Upper("name"), upper_query),
+            TrigramSimilarity(Upper("slug"), upper_query),
+            output_field=FloatField(),
+        )
+
+    return queryset.filter(matches).annotate(score=score).order_by("-score", "id")
+
+
+def _fallback_search(queryset, query):
+    matches = Q(name__icontains=query) | Q(slug__icontains=query) | Q(description__icontains=query)
+    score = Case(
+        When(name__iexact=query, then=Value(1.0)),
+        When(Q(name__istartswith=query) | Q(slug__istartswith=query), then=Value(0.75)),
+        When(Q(name__icontains=query) | Q(slug__icontains=query), then=Value(0.5)),
+        default=Value(0.25),
+        output_field=FloatField(),
+    )
+    return queryset.filter(matches).annotate(score=score).order_by("-score", "id")
@@ -0,0 +1,308 @@
+""" Deterministic synthetic dataset for profiling, load tests and benchmarks
+
+seed_dataset(scale, seed) fills every inventory table:
+  - a Category tree up to MAX_LEVEL deep
+  - Products with prices, stock for most of them and promotions
+  - Users and Orders with a skewed OrderProduct distribution (a few users
+    order a lot, a few products are in most orders)
+
+Rows are generated as plain tuples with explicit ids and streamed with
+COPY on PostgreSQL (executemany elsewhere), so millions of rows take
+minutes, not hours. Each table draws from its own Random(seed, table),
+so the same scale and seed always produce the same rows. Timestamps are
+relative to midnight UTC of the seeding day.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .caching import bump_version
+from .models import (
+    Category, CategoryStats, Order, OrderProduct, Product, ProductPromotionEvent, PriceReductionChoices,
+    PromotionEvent, StockManagement, StockStripe,
+)
+from .stats import refresh_category_stats
+
+# rows per 1.0 of scale
+BASE_SIZES = {
+    "categories": 1000,
+    "products": 20000,
+    "users": 2000,
+    "orders": 10000,
+    "promotions": 50,
+}
+MAX_LEVEL = 3
+BATCH_SIZE = 5000
+HISTORY_DAYS = 365
+
+# the code examples look these up by name / slug
+FIXED_ROOTS = ["Electronics", "Books", "Clothing", "Home", "Toys"]
+SEED_USER_PREFIX = "seed-user"
+
+SEEDED_MODELS = [
+    Category, Product, StockManagement, User, Order, OrderProduct, PromotionEvent, ProductPromotionEvent,
+]
+
+
+def dataset_sizes(scale=1.0, **overrides):
+    sizes = {key: max(1, int(size * scale)) for key, size in BASE_SIZES.items()}
+    sizes.update({key: value for key, value in overrides.items() if value is not None})
+    return sizes
+
+
+def _skewed(rng, count):
+    # biased towards low indexes: the first 10% get about half of the picks
+    return int(count * rng.random() ** 3)
+
+
+def _rng(seed, table):
+    return random.Random(f"{seed}:{table}")
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while batch := list(islice(rows, size)):
+        yield batch
+
+
+def write_rows(model, fields, rows):
+    """ Insert rows (tuples in fields order) into model's table and return
+        how many were written. COPY on PostgreSQL, executemany elsewhere."""
+    opts = model._meta
+    model_fields = [opts.get_field(name) for name in fields]
+    qn = connection.ops.quote_name
+    table = qn(opts.db_table)
+    columns = ", ".join(qn(field.column) for field in model_fields)
+
+    written = 0
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            with cursor.copy(f"COPY {table} ({columns}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+                    written += 1
+            return written
+
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * len(fields))})"
+        for batch in _batches(rows, BATCH_SIZE):
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(value, connection) for field, value in zip(model_fields, row)]
+                for row in batch
+            ])
+            written += len(batch)
+    return written
+
+
+@contextmanager
+def _foreign_keys_dropped(models):
+    """ Drop the FK constraints of models' tables and add them back at the end.
+        Django's FKs are DEFERRABLE INITIALLY DEFERRED, so every loaded row
+        would queue a check that runs at COMMIT; re-adding the constraint
+        validates the whole table with one join instead."""
+    if connection.vendor != "postgresql":
+        yield
+        return
+
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE contype = 'f' AND conrelid = ANY(%s::regclass[])
+        """, [[model._meta.db_table for model in models]])
+        constraints = cursor.fetchall()
+        for table, name, _ in constraints:
+            cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT {qn(name)}")
+    yield
+    with connection.cursor() as cursor:
+        for table, name, definition in constraints:
+            cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {qn(name)} {definition}")
+
+
+def _next_id(model):
+    return (model.objects.aggregate(last=Max("pk"))["last"] or 0) + 1
+
+
+def _spread(start, end, i, count):
+    # i-th of count timestamps evenly spread over [start, end), so ids and dates grow together
+    return start + (end - start) * (i / count)
+
+
+def _categories(rng, first_id, count):
+    parents, levels = [], []
+    for i in range(count):
+        if i < len(FIXED_ROOTS):
+            name, parent = FIXED_ROOTS[i], None
+        else:
+            name = f"Category {i:07}"
+            # earlier rows are the candidate parents, 1 in 10 is another root
+            parent = None if rng.random() < 0.1 else rng.randrange(i)
+            while parent is not None and levels[parent] >= MAX_LEVEL:
+                parent = parents[parent]
+        parents.append(parent)
+        levels.append(0 if parent is None else levels[parent] + 1)
+        yield (
+            first_id + i, name, name.lower().replace(" ", "-"), rng.random() < 0.85, levels[i],
+            None if parent is None else first_id + parent,
+        )
+
+
+def _products(rng, first_id, count, first_category_id, categories, start, end):
+    for i in range(count):
+        created = _spread(start, end, i, count)
+        yield (
+            first_id + i, f"Product {i:08}", f"product-{i:08}", f"Synthetic product {i}",
+            rng.random() < 0.2, rng.random() < 0.8, Decimal(rng.randint(100, 200000)) / 100,
+            created, created, first_category_id + _skewed(rng, categories),
+        )
+
+
+def _stock(rng, first_id, first_product_id, products, now):
+    stock_id = first_id
+    for i in range(products):
+        if rng.random() < 0.9:
+            yield stock_id, first_product_id + i, rng.randint(0, 500), 1, now
+            stock_id += 1
+
+
+def _users(first_id, count, start):
+    for i in range(count):
+        username = f"{SEED_USER_PREFIX}{i:07}"
+        yield (first_id + i, "!", False, username, "", "", f"{username}@example.com", False, True, start)
+
+
+def _orders(rng, first_id, count, first_user_id, users, start, end):
+    for i in range(count):
+        created = _spread(start, end, i, count)
+        yield first_id + i, first_user_id + _skewed(rng, users), created, created
+
+
+def _order_lines(rng, first_id, first_order_id, orders, first_product_id, products):
+    line_id = first_id
+    for i in range(orders):
+        # mostly 1-3 lines per order, a long tail up to 8
+        size = min(8, 1 + int(rng.expovariate(0.8)))
+        for product in sorted({_skewed(rng, products) for _ in range(size)}):
+            quantity = 1 if rng.random() < 0.7 else rng.randint(2, 5)
+            yield line_id, first_order_id + i, first_product_id + product, quantity
+            line_id += 1
+
+
+def _promotions(rng, first_id, count, now):
+    for i in range(count):
+        start = now + timedelta(days=rng.randint(-90, 30))
+        yield (
+            first_id + i, f"Promotion {i:05}", start, start + timedelta(days=rng.randint(1, 60)),
+            rng.choice(PriceReductionChoices.values),
+        )
+
+
+def _promotion_products(rng, first_id, first_promotion_id, promotions, first_product_id, products):
+    link_id = first_id
+    for i in range(promotions):
+        size = min(products, rng.randint(5, 200))
+        for product in sorted(rng.sample(range(products), size)):
+            yield link_id, first_product_id + product, first_promotion_id + i
+            link_id += 1
+
+
+def seed_dataset(scale=1.0, seed=0, **sizes):
+    """ Insert a dataset sized by scale (see BASE_SIZES, any size can be
+        overridden, e.g. products=5_000_000) into empty inventory tables.
+        Returns the row count per table and the time taken."""
+    if Category.objects.exists() or Product.objects.exists():
+        raise ValueError("Inventory tables are not empty, seed into an empty database.")
+
+    started = time.perf_counter()
+    sizes = dataset_sizes(scale, **sizes)
+    now = timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = now - timedelta(days=HISTORY_DAYS)
+    ids = {model: _next_id(model) for model in SEEDED_MODELS}
+    counts = {}
+
+    with transaction.atomic(), _foreign_keys_dropped(SEEDED_MODELS):
+        counts["categories"] = write_rows(
+            Category, ["id", "name", "slug", "is_active", "level", "parent_id"],
+            _categories(_rng(seed, "category"), ids[Category], sizes["categories"]),
+        )
+        counts["products"] = write_rows(
+            Product, ["id", "name", "slug", "description", "is_digital", "is_active", "price",
+                      "created_at", "updated_at", "category_id"],
+            _products(_rng(seed, "product"), ids[Product], sizes["products"],
+                      ids[Category], sizes["categories"], start, now),
+        )
+        counts["stock"] = write_rows(
+            StockManagement, ["id", "product", "quantity", "stripe_count", "last_checked_at"],
+            _stock(_rng(seed, "stock"), ids[StockManagement], ids[Product], sizes["products"], now),
+        )
+        counts["users"] = write_rows(
+            User, ["id", "password", "is_superuser", "username", "first_name", "last_name", "email",
+                   "is_staff", "is_active", "date_joined"],
+            _users(ids[User], sizes["users"], start),
+        )
+        counts["orders"] = write_rows(
+            Order, ["id", "user", "created_date", "updated_date"],
+            _orders(_rng(seed, "order"), ids[Order], sizes["orders"], ids[User], sizes["users"], start, now),
+        )
+        counts["order_products"] = write_rows(
+            OrderProduct, ["id", "order", "product", "quantity"],
+            _order_lines(_rng(seed, "orderproduct"), ids[OrderProduct], ids[Order], sizes["orders"],
+                         ids[Product], sizes["products"]),
+        )
+        counts["promotions"] = write_rows(
+            PromotionEvent, ["id", "name", "start_date", "end_date", "price_reduction"],
+            _promotions(_rng(seed, "promotion"), ids[PromotionEvent], sizes["promotions"], now),
+        )
+        counts["product_promotions"] = write_rows(
+            ProductPromotionEvent, ["id", "product", "promotion_event"],
+            _promotion_products(_rng(seed, "productpromotion"), ids[ProductPromotionEvent],
+                                ids[PromotionEvent], sizes["promotions"], ids[Product], sizes["products"]),
+        )
+
+        # explicit ids leave the PostgreSQL sequences behind
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), SEEDED_MODELS):
+                cursor.execute(sql)
+        # raw inserts skip the signals that keep CategoryStats current
+        # and drop cached category listings and promotion prices
+        refresh_category_stats()
+        bump_version(Category)
+        bump_version(PromotionEvent)
+
+    if connection.vendor == "postgresql":
+        # fresh rows have no planner statistics yet
+        with connection.cursor() as cursor:
+            for model in SEEDED_MODELS + [CategoryStats]:
+                cursor.execute(f"ANALYZE {connection.ops.quote_name(model._meta.db_table)}")
+
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def clear_dataset():
+    """ Remove all inventory rows and the seeded users (other users stay) """
+    inventory = [ProductPromotionEvent, PromotionEvent, OrderProduct, Order, StockStripe, StockManagement,
+                 CategoryStats, Product, Category]
+    tables = [connection.ops.quote_name(model._meta.db_table) for model in inventory]
+    # raw statements: no per row delete signals, FK checks are deferred to commit
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # TRUNCATE refuses tables with deferred FK checks still pending
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+            cursor.execute(f"TRUNCATE {', '.join(tables)}")
+        else:
+            for table in tables:
+                cursor.execute(f"DELETE FROM {table}")
+        User.objects.filter(username__startswith=SEED_USER_PREFIX).delete()
+        bump_version(Category)
+        bump_version(PromotionEvent)
@@ -0,0 +1,75 @@
+""" values()-based serialization for list routes
+
+A route that returns a QuerySet makes Ninja build every model instance
+and validate it field by field through the schema, in Python. For flat
+list schemas all of that is overhead: @values_response(Schema) reads
+just the schema's fields with queryset.values(*fields) and turns the
+dicts into JSON in one pydantic-core call, no model instance and no
+per-field Python code:
+
+    @router.get("/products/", response=List[ProductOutSchema])
+    @query_budget(2)
+    @values_response(ProductOutSchema)
+    def get_products(request, ...):
+        return Product.objects.filter(...)
+
+Field names go to values() as they are, so a field can be a model
+field, an annotation of the queryset or a foreign key attname: on
+Category, parent_id (the ForeignKey) and parent_id_id (its column) both
+give the parent's id, with no join and no extra query. Nested schemas
+and resolve_* methods are not supported, the schema must be flat.
+
+Put it under @query_budget, the rows are fetched by the decorator.
+Results that are not a QuerySet (lists, (status, body) tuples,
+responses) are returned unchanged for Ninja to handle.
+"""
+
+import functools
+
+from django.db.models import QuerySet
+from django.http import HttpResponse
+from pydantic import TypeAdapter
+from typing_extensions import TypedDict
+
+
+class ValuesSerializer:
+    """ JSON encoder for values() rows of a flat schema """
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.fields = tuple(schema.model_fields)
+        # TypedDict validation runs entirely in pydantic-core, unlike the
+        # schema's own validator that goes through Ninja's DjangoGetter
+        row = TypedDict(f"{schema.__name__}Row",
+                        {name: field.annotation for name, field in schema.model_fields.items()})
+        self.adapter = TypeAdapter(list[row])
+
+    def rows(self, queryset):
+        return list(queryset.values(*self.fields))
+
+    def dump_json(self, queryset):
+        return self.adapter.dump_json(self.adapter.validate_python(self.rows(queryset)))
+
+
+def values_response(schema):
+    """ Serve a QuerySet result as a JSON list of schema, read with
+        values(). Headers set on Ninja's temporal response (e.g. by
+        conditional_queryset) are kept."""
+    serializer = ValuesSerializer(schema)
+
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(request, **kwargs):
+            result = view_func(request, **kwargs)
+            if not isinstance(result, QuerySet):
+                return result
+            response = HttpResponse(serializer.dump_json(result), content_type="application/json")
+            temporal = kwargs.get("response")
+            if isinstance(temporal, HttpResponse):
+                for header, value in temporal.items():
+                    response.headers.setdefault(header, value)
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,76 @@
+""" Signal handlers for the inventory app """
+
+from decimal import Decimal
+
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .caching import bump_version
+from .models import Category, Product, ProductPromotionEvent, PromotionEvent
+from .query_budget import install_dispatch
+from .stats import apply_product_delta
+
+
+def _stats_values(category_id, price, is_active):
+    return category_id, 1, 1 if is_active else 0, Decimal(str(price))
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_stats(sender, instance, raw=False, **kwargs):
+    """ Keep the stored category/price/is_active so post_save can apply a delta"""
+    instance._stats_before = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    row = (Product.objects.filter(pk=instance.pk)
+                          .values_list("category_id_id", "price", "is_active")
+                          .first())
+    if row:
+        instance._stats_before = _stats_values(*row)
+
+
+@receiver(post_save, sender=Product)
+def update_stats_on_product_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    before = getattr(instance, "_stats_before", None)
+    after = _stats_values(instance.category_id_id, instance.price, instance.is_active)
+    if before == after:
+        return
+
+    if before is not None:
+        category_id, count, active, value = before
+        apply_product_delta(category_id, -count, -active, -value)
+    category_id, count, active, value = after
+    apply_product_delta(category_id, count, active, value)
+
+
+@receiver(post_delete, sender=Product)
+def update_stats_on_product_delete(sender, instance, **kwargs):
+    category_id, count, active, value = _stats_values(
+        instance.category_id_id, instance.price, instance.is_active)
+    apply_product_delta(category_id, -count, -active, -value)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_cached_categories(sender, **kwargs):
+    bump_version(Category)
+
+
+@receiver(post_save, sender=PromotionEvent)
+@receiver(post_delete, sender=PromotionEvent)
+@receiver(post_save, sender=ProductPromotionEvent)
+@receiver(post_delete, sender=ProductPromotionEvent)
+def invalidate_promotion_index(sender, **kwargs):
+    bump_version(PromotionEvent)
+
+
+@receiver(m2m_changed, sender=ProductPromotionEvent)
+def invalidate_promotion_index_on_add(sender, action, **kwargs):
+    # promotion.products.add()/remove() write the through table without save()
+    if action.startswith("post_"):
+        bump_version(PromotionEvent)
+
+
+connection_created.connect(install_dispatch, dispatch_uid="inventory.query_budget")
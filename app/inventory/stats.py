@@ -0,0 +1,86 @@
+""" Materialized per category product statistics
+
+CategoryStats holds product count, active count and total value for each
+category so landing pages read them without a GROUP BY over products.
+
+Single product saves and deletes apply a delta to one stats row (see
+inventory.signals). Bulk paths that bypass signals, or would fire one
+signal per row, call refresh_category_stats() or run inside
+defer_stats_updates() so the affected categories are recomputed once.
+"""
+
+import threading
+from contextlib import contextmanager
+
+from django.db.models import Count, F, Q, Sum
+
+from .models import Category, CategoryStats
+
+_deferred = threading.local()
+
+
+def refresh_category_stats(category_ids=None):
+    """ Recompute stats for category_ids (every category when None) with one
+        GROUP BY query and write them back with one upsert."""
+    categories = Category.objects.all()
+    if category_ids is not None:
+        categories = categories.filter(id__in=category_ids)
+
+    rows = categories.order_by().annotate(
+        product_count=Count("products"),
+        active_count=Count("products", filter=Q(products__is_active=True)),
+        total_value=Sum("products__price"),
+    ).values_list("id", "product_count", "active_count", "total_value")
+
+    stats = [
+        CategoryStats(category_id=category_id, product_count=product_count,
+                      active_count=active_count, total_value=total_value or 0)
+        for category_id, product_count, active_count, total_value in rows
+    ]
+    CategoryStats.objects.bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=["category"],
+        update_fields=["product_count", "active_count", "total_value", "refreshed_at"],
+        batch_size=1000,
+    )
+    return len(stats)
+
+
+def apply_product_delta(category_id, count, active, value):
+    """ Shift one category's stats by a product delta, e.g. (1, 1, price)
+        for a new active product. Falls back to a recompute when the
+        category has no stats row yet."""
+    if _deferring():
+        _deferred.category_ids.add(category_id)
+        return
+
+    updated = CategoryStats.objects.filter(category_id=category_id).update(
+        product_count=F("product_count") + count,
+        active_count=F("active_count") + active,
+        total_value=F("total_value") + value,
+    )
+    if not updated:
+        refresh_category_stats([category_id])
+
+
+def _deferring():
+    return getattr(_deferred, "category_ids", None) is not None
+
+
+@contextmanager
+def defer_stats_updates():
+    """ Collect the categories touched inside the block and recompute them
+        once on exit, instead of one stats UPDATE per product."""
+    if _deferring():
+        yield
+        return
+
+    _deferred.category_ids = set()
+    try:
+        yield
+        category_ids = _deferred.category_ids
+    finally:
+        _deferred.category_ids = None
+    if category_ids:
+        refresh_category_stats(category_ids)
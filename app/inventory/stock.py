@@ -0,0 +1,385 @@
+""" Stock reservation for orders
+
+reserve_stock() takes every line of an order out of StockManagement at
+once, or nothing: when a single line is short it raises InsufficientStock
+and, run inside the order's transaction.atomic(), the order is rolled
+back with it. Products without a StockManagement row are not tracked
+and always succeed.
+
+On PostgreSQL this is one statement. The order's lines go in as a VALUES
+list, the stock rows are locked in product_id order (two orders with
+overlapping products lock them in the same order, so they queue instead
+of deadlocking) and only rows with enough quantity are decremented:
+
+    WITH v(product_id, qty) AS (VALUES (%s, %s), ...),
+    locked AS (SELECT ... ORDER BY s.product_id FOR UPDATE OF s),
+    updated AS (UPDATE ... SET quantity = quantity - qty WHERE quantity >= qty)
+    SELECT product_id, quantity, qty FROM locked WHERE quantity < qty
+
+FOR UPDATE returns the latest committed quantity, so concurrent
+checkouts can't both take the last unit. The rows it returns are the
+short lines. Other databases lock with select_for_update() (ordered the
+same way) and decrement with one UPDATE ... CASE.
+
+No external lock is needed, checkouts of different products never wait
+for each other.
+
+Striped stock
+-------------
+Checkouts of one hot product still queue on its single row.
+set_stripes(product_id, k) moves that product's units into k StockStripe
+rows (StockManagement.stripe_count = k, its quantity = 0). A checkout
+then takes its line from one random stripe that has enough units and
+isn't locked by another checkout (FOR UPDATE SKIP LOCKED), so up to k
+checkouts of the product run side by side. When all of those are busy
+it waits for one of them, and only when no stripe can serve the line
+alone does it lock all the product's stripes in order and take from
+several. Each step rolls back the previous one's locks before it
+waits, and waits happen in product_id order, so checkouts can't
+deadlock on stripes.
+
+StockManagement.objects.with_available() is the cheap total read, one
+query with the stripes summed, and StockManagement.available the
+per-row one. A restock saved through StockManagement.save() (admin
+included) is spread over the stripes right away; one written with
+QuerySet.update() sits in quantity, which checkouts of a striped
+product don't read, until rebalance_stripes() (manage.py
+rebalance_stock, e.g. every few seconds during a sale) moves it into
+the stripes and evens them out again.
+"""
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import StockManagement, StockStripe
+
+# a reservation restarts when a product stops being striped under it
+MAX_ATTEMPTS = 3
+
+
+class InsufficientStock(Exception):
+    """ shortages is a list of {"product_id", "requested", "available"} """
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__(f"Insufficient stock for products {[s['product_id'] for s in shortages]}")
+
+
+class _Restriped(Exception):
+    """ A product classified as striped had no stripes anymore """
+
+
+class _Missed(Exception):
+    """ A striped line found no free stripe with enough units """
+
+
+def reserve_stock(lines):
+    """ Decrement the stock of {product_id: quantity} for all lines or none.
+        Raises InsufficientStock when a tracked product has less than its
+        line asks for, ValueError for a quantity below 1."""
+    if any(quantity < 1 for quantity in lines.values()):
+        raise ValueError("Quantities must be at least 1.")
+    if not lines:
+        return
+
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                if connection.vendor == "postgresql":
+                    shortages = _reserve_postgres(lines)
+                else:
+                    shortages = _reserve_locked(lines)
+                if shortages:
+                    # leaving the atomic block with an exception undoes the decrements
+                    raise InsufficientStock(sorted(shortages, key=lambda s: s["product_id"]))
+            return
+        except _Restriped:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+
+
+def reserve_each(orders):
+    """ Reserve stock for a batch of orders ({product_id: quantity} each),
+        in their order, skipping orders that don't fit anymore. Returns one
+        list of shortages per order, empty when it was reserved.
+
+        The whole batch is tried as one reservation first. Only when that
+        is short are the tracked totals read and the orders that still fit
+        picked greedily and reserved together, a few queries per batch
+        instead of one reservation per order. Raises InsufficientStock if
+        concurrent checkouts keep taking the units in between."""
+    for attempt in range(MAX_ATTEMPTS + 1):
+        if attempt == 0:
+            results = [[] for _ in orders]
+        else:
+            results = _fit_in_order(orders)
+        try:
+            reserve_stock(_sum_lines(lines for lines, short in zip(orders, results) if not short))
+            return results
+        except InsufficientStock:
+            if attempt == MAX_ATTEMPTS:
+                raise
+
+
+def _sum_lines(orders):
+    total = {}
+    for lines in orders:
+        for product_id, quantity in lines.items():
+            total[product_id] = total.get(product_id, 0) + quantity
+    return total
+
+
+def _fit_in_order(orders):
+    product_ids = {product_id for lines in orders for product_id in lines}
+    # untracked products (no StockManagement row) are never short
+    left = dict(StockManagement.objects.with_available().filter(product_id__in=product_ids)
+                .values_list("product_id", "available"))
+    results = []
+    for lines in orders:
+        shortages = [{"product_id": product_id, "requested": quantity, "available": left[product_id]}
+                     for product_id, quantity in sorted(lines.items())
+                     if product_id in left and left[product_id] < quantity]
+        if not shortages:
+            for product_id, quantity in lines.items():
+                if product_id in left:
+                    left[product_id] -= quantity
+        results.append(shortages)
+    return results
+
+
+def _values(lines):
+    values = ", ".join(["(%s::bigint, %s::integer)"] * len(lines))
+    return values, [value for line in lines.items() for value in line]
+
+
+def _reserve_postgres(lines):
+    shortages, striped = _take_rows(lines)
+    if striped and not shortages:
+        striped_lines = {product_id: lines[product_id] for product_id in striped}
+        # a free stripe first, then wait for a busy one, then take from several
+        for take in (_take_free_stripe, _take_random_stripe):
+            try:
+                with transaction.atomic():
+                    if take(striped_lines):
+                        raise _Missed
+                return shortages
+            except _Missed:
+                # rolled back: our stripe locks are gone before we wait for anyone else's
+                pass
+        shortages = _take_stripes_in_order(striped_lines)
+    return shortages
+
+
+def _take_rows(lines):
+    """ Decrement unstriped stock rows. Returns (shortages, product ids whose stock is striped) """
+    table = StockManagement._meta.db_table
+    values, params = _values(lines)
+    sql = f"""
+        WITH v(product_id, qty) AS (VALUES {values}),
+        locked AS (
+            SELECT s.id, s.product_id, s.quantity, v.qty
+            FROM {table} s JOIN v ON v.product_id = s.product_id
+            WHERE s.stripe_count <= 1
+            ORDER BY s.product_id
+            FOR UPDATE OF s
+        ),
+        updated AS (
+            UPDATE {table} s
+            SET quantity = s.quantity - l.qty, last_checked_at = %s
+            FROM locked l
+            WHERE s.id = l.id AND l.quantity >= l.qty
+            RETURNING s.id
+        )
+        SELECT s.product_id, l.quantity, v.qty, l.id IS NULL
+        FROM {table} s JOIN v ON v.product_id = s.product_id
+        LEFT JOIN locked l ON l.id = s.id
+        WHERE l.id IS NULL OR l.quantity < l.qty
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params + [timezone.now()])
+        rows = cursor.fetchall()
+    shortages = [{"product_id": product_id, "requested": qty, "available": quantity}
+                 for product_id, quantity, qty, striped in rows if not striped]
+    return shortages, [product_id for product_id, _, _, striped in rows if striped]
+
+
+def _take_free_stripe(lines):
+    """ Take every line from one random stripe with enough units that no
+        other checkout holds. Never waits. Returns the product ids that
+        found none."""
+    stripes = StockStripe._meta.db_table
+    table = StockManagement._meta.db_table
+    values, params = _values(lines)
+    sql = f"""
+        WITH v(product_id, qty) AS (VALUES {values}),
+        picked AS (
+            SELECT v.product_id, v.qty, t.id AS stripe_id
+            FROM v LEFT JOIN LATERAL (
+                SELECT t.id FROM {stripes} t JOIN {table} s ON s.id = t.stock_id
+                WHERE s.product_id = v.product_id AND t.quantity >= v.qty
+                ORDER BY random()
+                LIMIT 1
+                FOR UPDATE OF t SKIP LOCKED
+            ) t ON true
+        ),
+        updated AS (
+            UPDATE {stripes} t SET quantity = t.quantity - p.qty
+            FROM picked p
+            WHERE t.id = p.stripe_id
+            RETURNING t.id
+        )
+        SELECT product_id FROM picked WHERE stripe_id IS NULL
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _take_random_stripe(lines):
+    """ Pick one random stripe per line that had enough units, wait for it
+        (in product_id order) and take the line if it still has them.
+        Exactly one stripe per product is locked: a FOR UPDATE that moved
+        on to the next stripe would keep the lock of the one it left, and
+        two checkouts could each end up holding what the other waits for.
+        Returns the product ids that were not taken."""
+    stripes = StockStripe._meta.db_table
+    table = StockManagement._meta.db_table
+    values, params = _values(lines)
+    sql = f"""
+        WITH v(product_id, qty) AS (VALUES {values}),
+        picked AS (
+            SELECT v.product_id, v.qty, (
+                SELECT t.id FROM {stripes} t JOIN {table} s ON s.id = t.stock_id
+                WHERE s.product_id = v.product_id AND t.quantity >= v.qty
+                ORDER BY random()
+                LIMIT 1
+            ) AS stripe_id
+            FROM v
+        ),
+        locked AS (
+            SELECT t.id, t.quantity, p.qty
+            FROM {stripes} t JOIN picked p ON p.stripe_id = t.id
+            ORDER BY p.product_id
+            FOR UPDATE OF t
+        ),
+        updated AS (
+            UPDATE {stripes} t SET quantity = t.quantity - l.qty
+            FROM locked l
+            WHERE t.id = l.id AND l.quantity >= l.qty
+            RETURNING t.id
+        )
+        SELECT p.product_id FROM picked p LEFT JOIN locked l ON l.id = p.stripe_id
+        WHERE l.id IS NULL OR l.quantity < l.qty
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _take_stripes_in_order(lines):
+    """ Lock all stripes of the products in (product, stripe) order and take
+        each line from the fullest ones. Returns the shortages."""
+    rows = (StockStripe.objects.select_for_update(of=("self",))
+            .filter(stock__product_id__in=lines.keys())
+            .order_by("stock__product_id", "stripe")
+            .values_list("id", "stock__product_id", "quantity"))
+    by_product = {}
+    for stripe_id, product_id, quantity in rows:
+        by_product.setdefault(product_id, []).append((stripe_id, quantity))
+    if len(by_product) < len(lines):
+        # merged back into one row since it was classified, start over
+        raise _Restriped
+
+    shortages, taken = [], {}
+    for product_id, stripes in by_product.items():
+        needed = lines[product_id]
+        available = sum(quantity for _, quantity in stripes)
+        if available < needed:
+            shortages.append({"product_id": product_id, "requested": needed, "available": available})
+            continue
+        for stripe_id, quantity in sorted(stripes, key=lambda stripe: -stripe[1]):
+            take = min(quantity, needed)
+            if take:
+                taken[stripe_id] = take
+                needed -= take
+
+    if taken and not shortages:
+        StockStripe.objects.filter(id__in=taken.keys()).update(
+            quantity=F("quantity") - Case(*[When(id=stripe_id, then=Value(take))
+                                            for stripe_id, take in taken.items()]))
+    return shortages
+
+
+def _reserve_locked(lines):
+    stock = (StockManagement.objects.select_for_update()
+             .filter(product_id__in=lines.keys())
+             .order_by("product_id")
+             .values_list("product_id", "quantity", "stripe_count"))
+    rows, striped = {}, {}
+    for product_id, quantity, stripe_count in stock:
+        if stripe_count > 1:
+            striped[product_id] = lines[product_id]
+        else:
+            rows[product_id] = quantity
+    shortages = [{"product_id": product_id, "requested": lines[product_id], "available": quantity}
+                 for product_id, quantity in rows.items() if quantity < lines[product_id]]
+    if striped and not shortages:
+        shortages = _take_stripes_in_order(striped)
+    if not shortages and rows:
+        StockManagement.objects.filter(product_id__in=rows.keys()).update(
+            quantity=F("quantity") - Case(*[When(product_id=product_id, then=Value(lines[product_id]))
+                                            for product_id in rows]),
+            last_checked_at=timezone.now(),
+        )
+    return shortages
+
+
+def _spread(stock, total, count):
+    """ Make stripes 0..count-1 of stock share total units evenly """
+    stock.stripes.filter(stripe__gte=count).delete()
+    existing = {stripe.stripe: stripe for stripe in stock.stripes.all()}
+    share, extra = divmod(total, count)
+    stripes = [existing.get(n) or StockStripe(stock=stock, stripe=n) for n in range(count)]
+    for n, stripe in enumerate(stripes):
+        stripe.quantity = share + (1 if n < extra else 0)
+    StockStripe.objects.bulk_update([s for s in stripes if s.pk], ["quantity"])
+    StockStripe.objects.bulk_create([s for s in stripes if not s.pk])
+
+
+def _restripe(product_id, count=None):
+    """ count None keeps the product's current stripe count """
+    with transaction.atomic():
+        stock = StockManagement.objects.select_for_update().get(product_id=product_id)
+        count = max(stock.stripe_count if count is None else count, 1)
+        stripes = list(stock.stripes.select_for_update().order_by("stripe").values_list("quantity", flat=True))
+        total = stock.quantity + sum(stripes)
+
+        if count == 1:
+            stock.stripes.all().delete()
+            stock.quantity = total
+        else:
+            _spread(stock, total, count)
+            stock.quantity = 0
+        stock.stripe_count = count
+        stock.save(update_fields=["quantity", "stripe_count", "last_checked_at"])
+    return total
+
+
+def set_stripes(product_id, count):
+    """ Split the stock of product_id over count stripes, or merge it back
+        into the StockManagement row with count <= 1. Units are kept,
+        returns their total."""
+    return _restripe(product_id, count)
+
+
+def rebalance_stripes(product_ids=None):
+    """ Even out the stripes of every striped product (or of product_ids),
+        one short transaction each. Returns how many were rebalanced."""
+    stocks = StockManagement.objects.filter(stripe_count__gt=1)
+    if product_ids is not None:
+        stocks = stocks.filter(product_id__in=product_ids)
+    product_ids = list(stocks.values_list("product_id", flat=True))
+    for product_id in product_ids:
+        _restripe(product_id)
+    return len(product_ids)
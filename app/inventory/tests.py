@@ -1,3 +1,1477 @@
-from django.test import TestCase
+import importlib.util
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import timedelta
+from decimal import Decimal
+from unittest import skipUnless
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from pydantic import TypeAdapter
+
+from core.asgi import application as asgi_application
+
+from . import hammer
+from .bench import AsgiClient, async_path, build_plan, load_fixtures, percentile, select_endpoints, summarize
+from .catalog_loader import load_categories, load_products
+from .columnar import export_dataset
+from .admin import StockManagementForm
+from .models import (Category, CategoryStats, Order, OrderProduct, Product, PromotionEvent, StockManagement,
+                     StockStripe, available_units)
+from .module4 import CategoryIn, _category_generations
+from .module6 import CategorySchemaOut, ProductOutSchema
+from .profiling import compare, profile_example
+from .promotions import IntervalTree, effective_prices, promotion_index
+from .query_budget import (QueryBudgetExceeded, QueryBudgetMiddleware, collect_queries, normalize_sql,
+                           query_budget)
+from .search import _fallback_search, search_products, trigram_available
+from .seeding import clear_dataset, seed_dataset
+from .stats import defer_stats_updates, refresh_category_stats
+from .stock import rebalance_stripes, set_stripes
+from .tree import sync_levels
+
+
+def seed_catalog(categories=5000, products=20000):
+    """ Bulk insert a catalog large enough for the planner to prefer indexes.
+        Only every 10th row is active so active filters are selective."""
+    cats = Category.objects.bulk_create([
+        Category(name=f"Category {i:04}", slug=f"category-{i:04}",
+                 is_active=i % 10 == 0, level=i % 5)
+        for i in range(categories)
+    ])
+    now = timezone.now()
+    Product.objects.bulk_create([
+        Product(name=f"Product {i:06}", slug=f"product-{i:06}",
+                price=Decimal(i % 1000) + Decimal("0.99"),
+                is_active=i % 10 == 0, is_digital=i % 7 == 0,
+                category_id=cats[i % categories])
+        for i in range(products)
+    ], batch_size=5000)
+    # auto_now_add ignores explicit values, spread created_at afterwards
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE inventory_product SET created_at = %s - (id * interval '1 minute')", [now]
+        )
+        cursor.execute("ANALYZE inventory_category")
+        cursor.execute("ANALYZE inventory_product")
+
+
+@skipUnless(connection.vendor == "postgresql", "EXPLAIN plans are PostgreSQL specific")
+class Module6IndexUsageTests(TestCase):
+    """ Every SELECT a module6 endpoint runs should be answered from an index """
+
+    @classmethod
+    def setUpTestData(cls):
+        seed_catalog()
+        cls.product_ids = list(Product.objects.values_list("id", flat=True)[:3])
+
+    def setUp(self):
+        # the plans are the point here, not a cached response
+        cache.clear()
+
+    def assertEndpointUsesIndexes(self, url, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200, response.content)
+
+        selects = [q["sql"] for q in ctx.captured_queries if q["sql"].startswith("SELECT")]
+        self.assertTrue(selects, f"{url} ran no SELECT")
+        for sql in selects:
+            with connection.cursor() as cursor:
+                cursor.execute("EXPLAIN " + sql)
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+            self.assertIn("Index", plan, f"{url} is not using an index:\n{sql}\n{plan}")
+            self.assertNotIn("Seq Scan", plan, f"{url} scans a whole table:\n{sql}\n{plan}")
+
+    def test_categories_by_name(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/categories/", {"name": "CATEGORY 0042"})
+
+    def test_categories_by_level(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/categories/", {"min_level": 2, "max_level": 2})
+
+    def test_categories_with_parent(self):
+        # the seeded forest is flat, parent_id IS NOT NULL is answered by the FK index
+        self.assertEndpointUsesIndexes("/api/mod/6/categories/", {"has_parent": True})
+
+    def test_categories_q_active_level(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/categories/q/",
+                                       {"active": True, "min_level": 0, "max_level": 0})
+
+    def test_products_active_price_range(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/products/",
+                                       {"active": True, "min_price": 10, "max_price": 12})
+
+    def test_products_digital_price_range(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/products/",
+                                       {"active": False, "digital": True, "min_price": 10, "max_price": 12})
+
+    def test_products_negate_keyword(self):
+        # the negated keyword is a filter on top of the active price index
+        self.assertEndpointUsesIndexes("/api/mod/6/products/negate/",
+                                       {"active": True, "min_price": 10, "max_price": 12,
+                                        "exclude_keyword": True, "name_or_slug": "0042"})
+
+    def test_products_keyword_and_name_pattern(self):
+        # icontains/istartswith compile to UPPER(col) LIKE, the trigram indexes from 0003
+        if not trigram_available():
+            self.skipTest("pg_trgm is not installed")
+        self.assertEndpointUsesIndexes("/api/mod/6/products/negate/", {"name_or_slug": "012345"})
+        for search_type in ["all", "starts", "ends"]:
+            with self.subTest(search_type=search_type):
+                self.assertEndpointUsesIndexes("/api/mod/6/products/name_pattern/",
+                                               {"search_string": "012345", "search_type": search_type})
+
+    def test_products_by_ids(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/products/by-ids/", {"ids": self.product_ids})
+
+    def test_products_by_price_range(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/products/by-price-range/",
+                                       {"min_price": 10, "max_price": 11})
+
+    def test_products_by_slice(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/products/get_by_slice", {"start": 0, "end": 10})
+
+    def test_categories_paginated(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/categories/paginated", {"is_active": True})
+
+    def test_categories_active(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/categories/active")
+
+    def test_categories_cursor(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/categories/cursor", {"is_active": True})
+
+    def test_products_cursor(self):
+        self.assertEndpointUsesIndexes("/api/mod/6/products/cursor", {"active": True})
+
+
+class CategoryTreeTests(TestCase):
+    """ Recursive tree queries and the level kept by Category.save() """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name="Root", slug="root")
+        cls.child = Category.objects.create(name="Child", slug="child", parent_id=cls.root)
+        cls.leaf = Category.objects.create(name="Leaf", slug="leaf", parent_id=cls.child)
+        cls.other = Category.objects.create(name="Other", slug="other")
+        cls.branch = Category.objects.create(name="Branch", slug="branch", parent_id=cls.other)
+        cls.product = Product.objects.create(name="Leaf product", slug="leaf-product", price=1,
+                                             category_id=cls.leaf)
+
+    def ids(self, queryset):
+        return set(queryset.values_list("id", flat=True))
+
+    def levels(self):
+        return dict(Category.objects.values_list("slug", "level"))
+
+    def test_descendants_and_ancestors(self):
+        roots = Category.objects.filter(pk=self.root.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.ids(roots.descendants()), {self.child.id, self.leaf.id})
+        self.assertEqual(self.ids(roots.descendants(include_self=True)),
+                         {self.root.id, self.child.id, self.leaf.id})
+
+        leaves = Category.objects.filter(pk__in=[self.leaf.pk, self.branch.pk])
+        with self.assertNumQueries(1):
+            self.assertEqual(self.ids(leaves.ancestors()), {self.root.id, self.child.id, self.other.id})
+        self.assertEqual(self.ids(leaves.ancestors(include_self=True)),
+                         {self.root.id, self.child.id, self.leaf.id, self.other.id, self.branch.id})
+
+        self.assertEqual(self.ids(Category.objects.filter(pk=self.leaf.pk).descendants()), set())
+        self.assertEqual(self.ids(roots.subtree_products()), {self.product.id})
+        self.assertEqual(self.ids(Category.objects.filter(pk=self.other.pk).subtree_products()), set())
+
+    def test_level_is_derived_on_save(self):
+        self.assertEqual(self.levels(), {"root": 0, "child": 1, "leaf": 2, "other": 0, "branch": 1})
+
+        # a level typed by hand doesn't survive the save
+        stray = Category(name="Stray", slug="stray", parent_id=self.leaf, level=7)
+        stray.save()
+        self.assertEqual(stray.level, 3)
+
+    def test_move_relevels_the_subtree(self):
+        self.child.parent_id = self.branch
+        self.child.save()
+        self.assertEqual(self.levels(), {"root": 0, "child": 2, "leaf": 3, "other": 0, "branch": 1})
+
+        self.child.parent_id = None
+        self.child.save(update_fields=["parent_id"])
+        self.assertEqual(self.levels(), {"root": 0, "child": 0, "leaf": 1, "other": 0, "branch": 1})
+
+    def test_rejects_cycles(self):
+        for parent in (self.root, self.leaf):
+            root = Category.objects.get(pk=self.root.pk)
+            root.parent_id = parent
+            with self.assertRaises(ValidationError):
+                root.save()
+        self.assertIsNone(Category.objects.get(pk=self.root.pk).parent_id_id)
+        self.assertEqual(self.levels()["root"], 0)
+
+    def test_sync_levels_repairs_bulk_writes(self):
+        Category.objects.filter(pk__in=[self.child.pk, self.leaf.pk]).update(level=9)
+        Category.objects.filter(pk=self.branch.pk).update(parent_id=self.leaf)
+        self.assertEqual(sync_levels(), 3)
+        self.assertEqual(self.levels(), {"root": 0, "child": 1, "leaf": 2, "other": 0, "branch": 3})
+        self.assertEqual(sync_levels(), 0)
+
+
+class CategoryStatsTests(TestCase):
+    """ The product signals keep CategoryStats equal to a full recompute """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name="Phones", slug="phones")
+        cls.tablets = Category.objects.create(name="Tablets", slug="tablets")
+        cls.phone = Product.objects.create(name="Phone", slug="phone", price=Decimal("10.50"),
+                                           category_id=cls.phones)
+        Product.objects.create(name="Old phone", slug="old-phone", price=3, is_active=False,
+                               category_id=cls.phones)
+        refresh_category_stats()
+
+    def stats(self):
+        return {row[0]: row[1:] for row in CategoryStats.objects.values_list(
+            "category_id", "product_count", "active_count", "total_value")}
+
+    def assertStatsMatchRecompute(self):
+        kept = self.stats()
+        refresh_category_stats()
+        self.assertEqual(kept, self.stats())
+
+    def test_create_and_price_change(self):
+        self.assertEqual(self.stats()[self.phones.id], (2, 1, Decimal("13.50")))
+        Product.objects.create(name="Tablet", slug="tablet", price=20, category_id=self.tablets)
+        self.assertStatsMatchRecompute()
+
+        self.phone.price = Decimal("12.25")
+        self.phone.save()
+        self.assertEqual(self.stats()[self.phones.id], (2, 1, Decimal("15.25")))
+        self.assertStatsMatchRecompute()
+
+    def test_category_move(self):
+        self.phone.category_id = self.tablets
+        self.phone.save()
+        self.assertEqual(self.stats()[self.tablets.id], (1, 1, Decimal("10.50")))
+        self.assertEqual(self.stats()[self.phones.id], (1, 0, Decimal("3.00")))
+        self.assertStatsMatchRecompute()
+
+    def test_activate_and_deactivate(self):
+        self.phone.is_active = False
+        self.phone.save()
+        self.assertEqual(self.stats()[self.phones.id][1], 0)
+        self.assertStatsMatchRecompute()
+
+        self.phone.is_active = True
+        self.phone.save()
+        self.assertEqual(self.stats()[self.phones.id][1], 1)
+        self.assertStatsMatchRecompute()
+
+        # an unchanged save applies no delta, it only costs the pre_save SELECT
+        with self.assertNumQueries(2):
+            self.phone.save()
+
+    def test_delete(self):
+        self.phone.delete()
+        self.assertEqual(self.stats()[self.phones.id], (1, 0, Decimal("3.00")))
+        self.assertStatsMatchRecompute()
+
+    def test_missing_stats_row_is_recomputed(self):
+        CategoryStats.objects.filter(category=self.tablets).delete()
+        Product.objects.create(name="Tablet", slug="tablet", price=20, category_id=self.tablets)
+        self.assertEqual(self.stats()[self.tablets.id], (1, 1, Decimal("20.00")))
+        self.assertStatsMatchRecompute()
+
+    def test_deferred_updates(self):
+        with CaptureQueriesContext(connection) as ctx:
+            with defer_stats_updates():
+                for i in range(5):
+                    Product.objects.create(name=f"Tablet {i}", slug=f"tablet-{i}", price=2,
+                                           category_id=self.tablets)
+                self.phone.category_id = self.tablets
+                self.phone.save()
+                self.assertEqual(self.stats()[self.tablets.id], (0, 0, Decimal("0.00")))
+
+        stats_writes = [q["sql"] for q in ctx.captured_queries
+                        if "inventory_categorystats" in q["sql"] and not q["sql"].startswith("SELECT")]
+        self.assertEqual(len(stats_writes), 1)
+        self.assertEqual(self.stats()[self.tablets.id], (6, 6, Decimal("20.50")))
+        self.assertStatsMatchRecompute()
+
+
+class ProductSearchTests(TestCase):
+    """ Ranked search: icontains fallback everywhere, full-text and trigram on PostgreSQL """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Peripherals", slug="peripherals")
+        cls.wireless, cls.pad, cls.keyboard, cls.monitor = [
+            Product.objects.create(name=name, slug=slug, description=description, price=10,
+                                   is_active=is_active, category_id=category)
+            for name, slug, description, is_active in [
+                ("Wireless Mouse", "wireless-mouse", "Compact and quiet", True),
+                ("Mouse Pad", "mouse-pad", None, False),
+                ("Gaming Keyboard", "gaming-keyboard", "Works with any mouse", True),
+                ("Monitor", "monitor", "27 inch", True),
+            ]
+        ]
+
+    def search(self, **params):
+        response = self.client.get("/api/mod/6/products/search/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_fallback_scores(self):
+        results = list(_fallback_search(Product.objects.all(), "mouse").values_list("name", "score"))
+        self.assertEqual(results, [("Mouse Pad", 0.75), ("Wireless Mouse", 0.5), ("Gaming Keyboard", 0.25)])
+        self.assertEqual(list(_fallback_search(Product.objects.all(), "MONITOR").values_list("name", "score")),
+                         [("Monitor", 1.0)])
+        self.assertFalse(_fallback_search(Product.objects.all(), "trackball").exists())
+
+    def test_ranked_route(self):
+        results = self.search(q="mouse")
+        self.assertEqual({item["name"] for item in results}, {"Wireless Mouse", "Mouse Pad", "Gaming Keyboard"})
+        self.assertEqual([item["score"] for item in results],
+                         sorted((item["score"] for item in results), reverse=True))
+        self.assertEqual(set(results[0]), {"id", "name", "slug", "is_digital", "is_active", "price", "score"})
+
+        self.assertEqual({item["name"] for item in self.search(q="mouse", active=False)}, {"Mouse Pad"})
+        self.assertEqual(len(self.search(q="mouse", limit=1)), 1)
+        self.assertEqual(self.client.get("/api/mod/6/products/search/", {"q": "m"}).status_code, 422)
+
+    @skipUnless(connection.vendor == "postgresql", "full-text search is PostgreSQL only")
+    def test_full_text_ranking(self):
+        results = list(search_products("mouse").values_list("name", flat=True))
+        # a name match (weight A) outranks a description match (weight C)
+        self.assertEqual(results[-1], "Gaming Keyboard")
+        self.assertEqual(set(results[:2]), {"Wireless Mouse", "Mouse Pad"})
+        # stemming finds "quiet" in the description for "quietly"
+        self.assertEqual(list(search_products("quietly").values_list("name", flat=True)), ["Wireless Mouse"])
+
+        # the trigger keeps search_vector current for QuerySet.update() too
+        Product.objects.filter(pk=self.monitor.pk).update(description="Pairs with a mouse")
+        self.assertIn("Monitor", search_products("mouse").values_list("name", flat=True))
+
+    @skipUnless(connection.vendor == "postgresql", "pg_trgm is PostgreSQL only")
+    def test_trigram_matches_partial_words(self):
+        if not trigram_available():
+            self.skipTest("pg_trgm is not installed")
+        # 'keyboar' is no full-text match, only the trigram indexes find it
+        results = list(search_products("keyboar").values_list("name", "score"))
+        self.assertEqual(results[0][0], "Gaming Keyboard")
+        self.assertGreater(results[0][1], 0.3)
+        self.assertNotIn("Mouse Pad", [name for name, _ in results])
+
+
+@override_settings(QUERY_BUDGET_MODE="raise")
+class QueryBudgetTests(TestCase):
+    """ Routes stay inside their @query_budget, a violation raises in tests """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name="Electronics", slug="electronics")
+        cls.child = Category.objects.create(name="Phones", slug="phones", parent_id=cls.root)
+        cls.products = [
+            Product.objects.create(name=f"Phone {i}", slug=f"phone-{i}", price=10 + i,
+                                   category_id=cls.child)
+            for i in range(60)
+        ]
+        cls.user = User.objects.create(username="buyer")
+
+    def post_order(self, lines):
+        payload = {
+            "user_id": self.user.id,
+            "products": [{"product_id": p.id, "quantity": 1} for p in self.products[:lines]],
+        }
+        return self.client.post("/api/mod4/order/create/", json.dumps(payload),
+                                content_type="application/json")
+
+    def test_create_order_query_count_does_not_grow_with_lines(self):
+        small = self.post_order(2)
+        large = self.post_order(60)
+        self.assertEqual(small.status_code, 200)
+        self.assertEqual(large.json()["linked_products"], 60)
+        self.assertEqual(small["X-DB-Queries"], large["X-DB-Queries"])
+
+    def test_read_routes_within_budget(self):
+        root_id = self.root.id
+        for url, queries in [
+            ("/api/mod5/category/first-active", 1),
+            ("/api/mod5/category/active-sorted-name", 2),
+            ("/api/mod5/category/names", 1),
+            ("/api/mod/6/categories/", 1),
+            ("/api/mod/6/categories/q/?active=true", 1),
+            ("/api/mod/6/products/?active=true", 2),
+            ("/api/mod/6/products/negate/?name_or_slug=phone", 2),
+            ("/api/mod/6/products/get_by_slice", 2),
+            ("/api/mod/6/categories/paginated", 2),
+            ("/api/mod/6/categories/cursor", 1),
+            (f"/api/mod/6/categories/{root_id}/descendants", 1),
+            (f"/api/mod/6/categories/{root_id}/products", 2),
+            ("/api/mod/6/categories/stats/", 1),
+        ]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response["X-DB-Queries"], str(queries))
+
+    def test_lazy_queryset_counts_against_budget(self):
+        @query_budget(0)
+        def lazy(request):
+            return Category.objects.all()
+
+        with self.assertRaisesMessage(QueryBudgetExceeded, "1 queries, budget is 0"):
+            lazy(RequestFactory().get("/"))
+
+    def test_serializer_queries_count_against_budget(self):
+        # a query the view didn't run but the response needs, like a lazy FK in a schema
+        @query_budget(0)
+        def view(request):
+            return HttpResponse("ok")
+
+        def render(request):
+            response = view(request)
+            Category.objects.count()
+            return response
+
+        middleware = QueryBudgetMiddleware(render)
+        with self.assertRaisesMessage(QueryBudgetExceeded, "(whole request)"):
+            middleware(RequestFactory().get("/"))
+
+    def test_repeated_sql_shape_is_reported(self):
+        @query_budget(None, max_repeats=3)
+        def n_plus_one(request):
+            return [Category.objects.get(id=p.category_id_id).name for p in Product.objects.all()]
+
+        with self.assertRaises(QueryBudgetExceeded):
+            n_plus_one(RequestFactory().get("/"))
+
+    def test_budget_exceeded(self):
+        @query_budget(1)
+        def two_queries(request):
+            return Category.objects.count() + Product.objects.count()
+
+        with self.assertRaisesMessage(QueryBudgetExceeded, "2 queries, budget is 1"):
+            two_queries(RequestFactory().get("/"))
+
+    def test_collector_sees_queries_of_other_threads(self):
+        # ASGI: the middleware collects in async code, sync views run in a worker thread
+        def query_in_thread():
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+            finally:
+                connection.close()
+
+        async def view():
+            with collect_queries() as collector:
+                await sync_to_async(query_in_thread, thread_sensitive=False)()
+            return collector.count
+
+        self.assertEqual(async_to_sync(view)(), 1)
+
+    def test_normalize_sql(self):
+        self.assertEqual(
+            normalize_sql('SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = \'x\' LIMIT 21'),
+            normalize_sql('SELECT * FROM t WHERE id IN (%s) AND name = \'y\'   LIMIT 5'),
+        )
+
+
+class ResponseCacheTests(TestCase):
+    """ Versioned category listing cache and conditional product GETs """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name="Phones", slug="phones")
+        cls.books = Category.objects.create(name="Books", slug="books")
+
+    def setUp(self):
+        cache.clear()
+
+    def names(self, url="/api/mod/6/categories/active"):
+        return [c["name"] for c in self.client.get(url).json()]
+
+    def test_hit_runs_no_queries_and_revalidates_with_etag(self):
+        first = self.client.get("/api/mod/6/categories/active")
+        second = self.client.get("/api/mod/6/categories/active")
+        self.assertEqual(first["X-DB-Queries"], "1")
+        self.assertEqual(second["X-DB-Queries"], "0")
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+        revalidated = self.client.get("/api/mod/6/categories/active", HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.content, b"")
+
+        other_page = self.client.get("/api/mod/6/categories/paginated", {"page_size": 1, "page": 2})
+        self.assertEqual(other_page.json()["items"][0]["name"], "Phones")
+        self.assertEqual(self.client.get("/api/mod/6/categories/paginated", {"page_size": 1}).json()["items"][0]["name"], "Books")
+
+    def test_budgets_raise_during_tests(self):
+        # set by the test runner for every test, not just QueryBudgetTests
+        self.assertEqual(settings.QUERY_BUDGET_MODE, "raise")
+
+    def test_runs_on_a_cache_of_its_own(self):
+        # the test runner keeps cache.clear() away from a local runserver's cache
+        location = settings.CACHES["default"]["LOCATION"]
+        self.assertEqual(location, os.environ["INVENTORY_CACHE_DIR"])
+        self.assertNotEqual(location, os.path.join(tempfile.gettempdir(), "django_orm_prj_cache"))
+
+    def test_bump_from_another_process_invalidates(self):
+        # manage.py load_catalog / seed run in their own process
+        self.assertEqual(self.names(), ["Books", "Phones"])
+        Category.objects.filter(id=self.books.id).update(is_active=False)
+        self.assertEqual(self.names(), ["Books", "Phones"])
+
+        subprocess.run(
+            [sys.executable, "-c", "import django; django.setup(); from inventory.caching import bump_version; "
+                                   "from inventory.models import Category; bump_version(Category)"],
+            cwd=settings.BASE_DIR, check=True)
+        self.assertEqual(self.names(), ["Phones"])
+
+    def test_writes_invalidate(self):
+        self.assertEqual(self.names(), ["Books", "Phones"])
+
+        self.books.is_active = False
+        self.books.save()
+        self.assertEqual(self.names(), ["Phones"])
+
+        response = self.client.put("/api/mod4/category/bulk-update/",
+                                   json.dumps([{"id": self.books.id, "level": 0, "is_active": True}]),
+                                   content_type="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.names(), ["Books", "Phones"])
+
+        self.phones.delete()
+        self.assertEqual(self.names("/api/mod5/category/names"), ["BOOKS"])
+
+    def test_product_list_conditional_get(self):
+        product = Product.objects.create(name="Phone", slug="phone", price=10, category_id=self.phones)
+        url = "/api/mod/6/products/"
+        first = self.client.get(url, {"active": True})
+        self.assertEqual(len(first.json()), 1)
+
+        unchanged = self.client.get(url, {"active": True}, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual((unchanged.status_code, unchanged["X-DB-Queries"]), (304, "1"))
+        self.assertFalse(first.has_header("Last-Modified"))
+        other_filter = self.client.get(url, {"active": True, "min_price": 1}, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(other_filter.status_code, 200)
+
+        product.price = 12
+        product.save()
+        changed = self.client.get(url, {"active": True}, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed["ETag"], first["ETag"])
+
+    def test_product_list_revalidates_after_delete(self):
+        kept = Product.objects.create(name="Phone", slug="phone", price=10, category_id=self.phones)
+        gone = Product.objects.create(name="Tablet", slug="tablet", price=20, category_id=self.phones)
+        url = "/api/mod/6/products/"
+        first = self.client.get(url)
+        self.assertEqual(len(first.json()), 2)
+
+        gone.delete()
+        # MAX(updated_at) is still kept's, a date-only revalidation must not get a 304
+        since = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual((since.status_code, [row["id"] for row in since.json()]), (200, [kept.id]))
+        etag = self.client.get(url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(etag.status_code, 200)
+
+
+class StockReservationTests(TestCase):
+    """ create_order takes stock for every line or rejects the whole order """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Phones", slug="phones")
+        cls.tracked, cls.other, cls.untracked = [
+            Product.objects.create(name=f"Phone {i}", slug=f"phone-{i}", price=10, category_id=category)
+            for i in range(3)
+        ]
+        StockManagement.objects.create(product=cls.tracked, quantity=5)
+        StockManagement.objects.create(product=cls.other, quantity=1)
+        cls.user = User.objects.create(username="buyer")
+
+    def order(self, *lines):
+        payload = {"user_id": self.user.id,
+                   "products": [{"product_id": p.id, "quantity": q} for p, q in lines]}
+        return self.client.post("/api/mod4/order/create/", json.dumps(payload),
+                                content_type="application/json").json()
+
+    def stock(self):
+        return dict(StockManagement.objects.values_list("product_id", "quantity"))
+
+    def test_decrements_tracked_lines_only(self):
+        result = self.order((self.tracked, 3), (self.other, 1), (self.untracked, 50))
+        self.assertEqual(result["linked_products"], 3)
+        self.assertEqual(self.stock(), {self.tracked.id: 2, self.other.id: 0})
+
+    def test_short_line_rejects_the_whole_order(self):
+        result = self.order((self.tracked, 3), (self.other, 2))
+        self.assertEqual(result["error"], "Insufficient stock.")
+        self.assertEqual(result["shortages"], [{"product_id": self.other.id, "requested": 2, "available": 1}])
+        self.assertEqual(self.stock(), {self.tracked.id: 5, self.other.id: 1})
+        self.assertFalse(Order.objects.exists())
+
+        self.assertIn("error", self.order((self.tracked, 0)))
+        self.assertFalse(Order.objects.exists())
+
+    def test_bulk_import_skips_short_orders(self):
+        lines = [
+            {"user_id": self.user.id, "products": [{"product_id": self.tracked.id, "quantity": 3},
+                                                   {"product_id": self.untracked.id, "quantity": 50}]},
+            {"user_id": self.user.id, "products": [{"product_id": self.tracked.id, "quantity": 3}]},
+            {"user_id": self.user.id, "products": [{"product_id": self.tracked.id, "quantity": 2},
+                                                   {"product_id": self.other.id, "quantity": 1}]},
+            {"user_id": self.user.id, "products": [{"product_id": self.other.id, "quantity": 0}]},
+        ]
+        body = "\n".join(json.dumps(line) for line in lines)
+        result = self.client.post("/api/mod4/order/bulk-import/", body, content_type="application/x-ndjson").json()
+
+        self.assertEqual((result["orders_created"], result["lines_created"]), (2, 4))
+        self.assertEqual(result["chunks"][0]["errors"], [
+            {"line": 2, "error": "Insufficient stock.",
+             "shortages": [{"product_id": self.tracked.id, "requested": 3, "available": 2}]},
+            {"line": 4, "error": "Quantities must be at least 1."},
+        ])
+        self.assertEqual(self.stock(), {self.tracked.id: 0, self.other.id: 0})
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_striped_stock(self):
+        self.assertEqual(set_stripes(self.tracked.id, 4), 5)
+        stripes = lambda: sorted(StockStripe.objects.values_list("quantity", flat=True))
+        self.assertEqual(stripes(), [1, 1, 1, 2])
+
+        # no single stripe has 3, the line is taken from several
+        self.assertIn("order_id", self.order((self.tracked, 3), (self.other, 1)))
+        self.assertEqual(sum(stripes()), 2)
+        self.assertEqual(self.order((self.tracked, 3))["shortages"][0]["available"], 2)
+        available = dict(StockManagement.objects.with_available().values_list("product_id", "available"))
+        self.assertEqual(available, {self.tracked.id: 2, self.other.id: 0})
+
+        # a restock on the row reaches the stripes with the next rebalance
+        StockManagement.objects.filter(product=self.tracked).update(quantity=F("quantity") + 6)
+        self.assertEqual(rebalance_stripes(), 1)
+        self.assertEqual(stripes(), [2, 2, 2, 2])
+        self.assertEqual(set_stripes(self.tracked.id, 1), 8)
+        self.assertEqual(self.stock()[self.tracked.id], 8)
+        self.assertFalse(StockStripe.objects.exists())
+
+    def test_striped_stock_through_the_model(self):
+        set_stripes(self.tracked.id, 4)
+        stock = StockManagement.objects.get(product=self.tracked)
+        self.assertEqual((stock.quantity, stock.available), (0, 5))
+        annotated = StockManagement.objects.with_available().get(product=self.tracked)
+        with self.assertNumQueries(0):
+            self.assertEqual(annotated.available, 5)
+
+        # a restock typed into quantity (the admin form) is spread at once, no rebalance needed
+        stock.quantity = 7
+        stock.save()
+        self.assertEqual((stock.quantity, stock.available), (0, 12))
+        self.assertEqual(StockStripe.objects.filter(stock=stock).count(), 4)
+        self.assertIn("order_id", self.order((self.tracked, 12)))
+
+        stock.quantity = 6
+        stock.save()
+        stock.stripe_count = 1
+        stock.save()
+        self.assertEqual((stock.quantity, stock.available), (6, 6))
+        self.assertFalse(StockStripe.objects.exists())
+
+    def test_admin_form_edits_units_on_hand(self):
+        set_stripes(self.tracked.id, 4)
+
+        def edit(units, stripe_count=4):
+            stock = StockManagement.objects.with_available().get(product=self.tracked)
+            form = StockManagementForm({"product": self.tracked.id, "quantity": units,
+                                        "stripe_count": stripe_count}, instance=stock)
+            self.assertEqual(form.initial["quantity"], stock.available)
+            self.assertTrue(form.is_valid(), form.errors)
+            form.save()
+            return StockManagement.objects.with_available().get(product=self.tracked)
+
+        stock = edit(12)
+        self.assertEqual((stock.quantity, stock.available), (0, 12))
+        self.assertEqual(edit(3).available, 3)
+        stock = edit(9, stripe_count=1)
+        self.assertEqual((stock.quantity, stock.available), (9, 9))
+        self.assertEqual(edit(4, stripe_count=1).quantity, 4)
+
+        # the stock of striped products through Product, as code_examples reads it
+        set_stripes(self.tracked.id, 4)
+        available = dict(Product.objects.annotate(available=available_units("stock__"))
+                         .filter(available__gte=1).values_list("id", "available"))
+        self.assertEqual(available, {self.tracked.id: 4, self.other.id: 1})
+
+
+class CategoryGenerationTests(TestCase):
+    """ Bulk category payloads are written parents first, in generations """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.base = Category.objects.create(name="Base", slug="base")
+        cls.existing = Category.objects.create(name="Existing", slug="existing", parent_id=cls.base)
+
+    def payload(self):
+        items = [("Leaf", "Mid"), ("Mid", "Top"), ("Top", "Existing"), ("Solo", None),
+                 ("A", "B"), ("B", "A"), ("Orphan", "Nowhere"), ("Grandchild", "Orphan"), ("Solo", None)]
+        # CategoryIn.parent_id defaults to None but doesn't accept an explicit null
+        return [{"name": name, "slug": "", "is_active": True, **({"parent_id": parent} if parent else {})}
+                for name, parent in items]
+
+    def test_generations(self):
+        items = [CategoryIn(**item) for item in self.payload()]
+        with self.assertNumQueries(1):
+            generations, parents, errors = _category_generations(items)
+
+        self.assertEqual([[item.name for item in generation] for generation in generations],
+                         [["Top", "Solo"], ["Mid"], ["Leaf"]])
+        self.assertEqual(parents, {"Existing": (self.existing.id, 1)})
+        self.assertEqual(errors, [
+            {"name": "Solo", "error": "Duplicate category name in payload."},
+            {"name": "A", "error": "Parent category 'B' could not be created."},
+            {"name": "B", "error": "Parent category 'A' could not be created."},
+            {"name": "Orphan", "error": "Parent category 'Nowhere' not found."},
+            {"name": "Grandchild", "error": "Parent category 'Orphan' could not be created."},
+        ])
+
+    def test_bulk_create_route(self):
+        response = self.client.post("/api/mod4/category/bulk_create/", json.dumps(self.payload()),
+                                    content_type="application/json")
+        result = response.json()
+        self.assertEqual(result["created_count"], 4)
+        self.assertEqual(len(result["errors"]), 5)
+
+        created = {cat.name: cat for cat in Category.objects.filter(name__in=["Top", "Mid", "Leaf", "Solo"])}
+        self.assertEqual({name: cat.level for name, cat in created.items()},
+                         {"Top": 2, "Mid": 3, "Leaf": 4, "Solo": 0})
+        self.assertEqual(created["Leaf"].parent_id_id, created["Mid"].id)
+        self.assertEqual(created["Top"].parent_id_id, self.existing.id)
+        self.assertEqual(created["Solo"].slug, "solo")
+        self.assertFalse(Category.objects.filter(name__in=["A", "B", "Orphan", "Grandchild"]).exists())
+
+
+class CategoryBulkUpsertTests(TestCase):
+    """ bulk_upsert_categories counts per batch and reports slug conflicts """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.old = Category.objects.create(name="Old", slug="old")
+
+    def upsert(self, items, batch_size=2):
+        response = self.client.put(f"/api/mod4/category/bulk-upsert/?batch_size={batch_size}",
+                                   json.dumps(items), content_type="application/json")
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_counts_across_batches(self):
+        items = [
+            {"name": "Old", "is_active": False},
+            {"name": "Desks"},
+            {"name": "Desk Chairs", "parent_id": "Desks"},
+            {"name": "Lamps", "parent_id": "Old"},
+        ]
+        result = self.upsert(items + [{"name": "Shelves"}])
+        # generation 0 is split over two batches, the children follow in generation 1
+        self.assertEqual([(b["created"], b["updated"]) for b in result["batches"]], [(1, 1), (1, 0), (2, 0)])
+        self.assertEqual((result["created_count"], result["updated_count"], result["errors"]), (4, 1, []))
+        self.assertFalse(Category.objects.get(pk=self.old.pk).is_active)
+        self.assertEqual(Category.objects.get(name="Lamps").level, 1)
+
+        again = self.upsert(items, batch_size=10)
+        self.assertEqual([(b["created"], b["updated"]) for b in again["batches"]], [(0, 2), (0, 2)])
+        self.assertEqual(Category.objects.count(), 5)
+
+    def test_slug_conflicts_are_reported(self):
+        result = self.upsert([
+            {"name": "Clash", "slug": "old"},
+            {"name": "Lamps"},
+            {"name": "More lamps", "slug": "lamps"},
+            {"name": "Old", "slug": "old"},
+        ])
+        self.assertEqual(result["errors"], [
+            {"name": "Clash", "error": "Slug 'old' is already used by category 'Old'."},
+            {"name": "More lamps", "error": "Slug 'lamps' is already used by category 'Lamps'."},
+        ])
+        self.assertEqual((result["created_count"], result["updated_count"]), (1, 1))
+        self.assertEqual(set(Category.objects.values_list("slug", flat=True)), {"old", "lamps"})
+
+    def tree(self):
+        a = Category.objects.create(name="A", slug="a")
+        b = Category.objects.create(name="B", slug="b", parent_id=a)
+        Category.objects.create(name="C", slug="c", parent_id=b)
+
+    def parents(self):
+        return dict(Category.objects.values_list("name", "parent_id__name"))
+
+    def test_rejects_moves_below_own_subtree(self):
+        self.tree()
+        before = self.parents()
+        result = self.upsert([{"name": "A", "slug": "a", "parent_id": "B"}])
+        self.assertEqual(result["errors"], [
+            {"name": "A", "error": "A category cannot be moved below itself or its descendants."}])
+        self.assertEqual(self.parents(), before)
+
+        # the cycle can also run through a new category of the same payload
+        result = self.upsert([{"name": "A", "parent_id": "X"}, {"name": "X", "parent_id": "C"}])
+        self.assertEqual([error["name"] for error in result["errors"]], ["A"])
+        self.assertEqual(self.parents(), {**before, "X": "C"})
+
+    def test_relevels_only_moved_subtrees(self):
+        self.tree()
+        Category.objects.filter(name="Old").update(level=5)
+        result = self.upsert([{"name": "B"}])
+        self.assertEqual((result["updated_count"], result["errors"]), (1, []))
+        levels = dict(Category.objects.values_list("name", "level"))
+        self.assertEqual(levels, {"A": 0, "B": 0, "C": 1, "Old": 5})
+
+        self.upsert([{"name": "B", "parent_id": "Old"}, {"name": "A", "parent_id": "C"}])
+        levels = dict(Category.objects.values_list("name", "level"))
+        self.assertEqual(levels, {"Old": 5, "B": 6, "C": 7, "A": 8})
+
+
+class BulkOrderImportTests(TestCase):
+    """ The NDJSON order import writes per chunk and reports errors per line """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Cables", slug="cables")
+        cls.usb, cls.hdmi = [
+            Product.objects.create(name=name, slug=name.lower(), price=5, category_id=category)
+            for name in ("USB", "HDMI")
+        ]
+        cls.user = User.objects.create(username="importer")
+
+    def line(self, *lines, user_id=None):
+        return json.dumps({"user_id": user_id or self.user.id,
+                           "products": [{"product_id": p, "quantity": q} for p, q in lines]})
+
+    def test_chunks_and_line_errors(self):
+        body = "\n".join([
+            self.line((self.usb.id, 2), (self.hdmi.id, 1)),
+            "",
+            "{",
+            self.line((self.usb.id, 1), user_id=999999),
+            self.line((self.usb.id, 1), (999999, 4)),
+            json.dumps({"user_id": self.user.id}),
+            self.line((self.hdmi.id, 1), (self.hdmi.id, 5)),
+            "not json",
+        ])
+        response = self.client.post("/api/mod4/order/bulk-import/?chunk_size=2", body,
+                                    content_type="application/x-ndjson")
+        self.assertEqual(response.status_code, 200, response.content)
+        result = response.json()
+
+        self.assertEqual((result["orders_created"], result["lines_created"]), (3, 4))
+        chunks = result["chunks"]
+        self.assertEqual([(c["chunk"], c["orders_created"], c["lines_created"]) for c in chunks],
+                         [(1, 1, 2), (2, 2, 2), (3, 0, 0)])
+        # blank lines are skipped but still counted, errors point at the body line
+        self.assertEqual([e["line"] for e in chunks[0]["errors"]], [3, 4])
+        self.assertEqual(chunks[0]["errors"][1]["error"], "User not found.")
+        self.assertEqual([e["line"] for e in chunks[1]["errors"]], [6])
+        self.assertEqual([e["line"] for e in chunks[2]["errors"]], [8])
+        self.assertEqual(chunks[1]["missing_product_ids"], [999999])
+
+        lines = sorted(OrderProduct.objects.values_list("product_id", "quantity"))
+        self.assertEqual(lines, sorted([(self.usb.id, 2), (self.hdmi.id, 1),
+                                        (self.usb.id, 1), (self.hdmi.id, 1)]))
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 3)
+
+    def test_empty_body(self):
+        result = self.client.post("/api/mod4/order/bulk-import/", "",
+                                  content_type="application/x-ndjson").json()
+        self.assertEqual(result, {"status": "imported", "orders_created": 0, "lines_created": 0, "chunks": []})
+
+
+@skipUnless(connection.vendor == "postgresql", "COPY loading is PostgreSQL only")
+class CatalogLoaderTests(TestCase):
+    """ COPY catalog loads merge on slug and report name conflicts """
+
+    def load(self, loader, header, *rows):
+        return loader([header + "\n", *(row + "\n" for row in rows)])
+
+    def test_categories_merge_and_link_parents(self):
+        result = self.load(load_categories, "name,slug,is_active,level,parent_slug",
+                           "Phones,phones,true,0,electronics", "Electronics,electronics,true,0,")
+        self.assertEqual((result["created"], result["updated"], result["rejected"]), (2, 0, 0))
+        phones = Category.objects.get(slug="phones")
+        self.assertEqual((phones.parent_id.slug, phones.level), ("electronics", 1))
+
+        result = self.load(load_categories, "name,slug,is_active,level,parent_slug",
+                           "Phones,phones,false,0,electronics")
+        self.assertEqual((result["created"], result["updated"]), (0, 1))
+        self.assertFalse(Category.objects.get(slug="phones").is_active)
+
+    def test_name_conflicts_are_reported_not_fatal(self):
+        Category.objects.create(name="Books", slug="books")
+        result = self.load(load_categories, "name,slug,is_active,level,parent_slug",
+                           "Books,new-books,true,0,",      # name held by slug books
+                           "Toys,toys,true,0,",
+                           "Toys,toys-2,true,0,",          # same name twice in the file
+                           "Games,games,true,0,",
+                           "Games v2,games,true,0,",       # same slug twice, the last row wins
+                           "Books,toys-3,true,0,")
+        self.assertEqual((result["created"], result["rejected"]), (2, 3))
+        self.assertEqual([(row["row"], row["slug"]) for row in result["rejected_rows"]],
+                         [(1, "new-books"), (3, "toys-2"), (6, "toys-3")])
+        self.assertEqual(set(Category.objects.values_list("slug", "name")),
+                         {("books", "Books"), ("toys", "Toys"), ("games", "Games v2")})
+
+        # renaming a row onto a name another slug holds is a conflict too
+        result = self.load(load_categories, "name,slug,is_active,level,parent_slug", "Toys,books,true,0,")
+        self.assertEqual((result["updated"], result["rejected"]), (0, 1))
+
+    def test_products_name_conflict_and_bad_values(self):
+        category = Category.objects.create(name="Phones", slug="phones")
+        Product.objects.create(name="Pixel", slug="pixel", price=1, category_id=category)
+        header = "name,slug,description,is_digital,is_active,price,category_slug"
+        result = self.load(load_products, header, "Pixel,pixel-2,,false,true,5.00,phones",
+                           "Nexus,nexus,,false,true,6.00,phones")
+        self.assertEqual((result["created"], result["rejected"]), (1, 1))
+
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            self.load(load_products, header, "Broken,broken,,false,true,abc,phones")
+        self.assertFalse(Product.objects.filter(slug="broken").exists())
+
+    def test_unknown_category_slug_is_reported(self):
+        Category.objects.create(name="Phones", slug="phones")
+        header = "name,slug,description,is_digital,is_active,price,category_slug"
+        result = self.load(load_products, header, "Pixel,pixel,,false,true,5.00,phones",
+                           "Walkman,walkman,,false,true,6.00,tapes", "Loose,loose,,false,true,1.00,")
+        self.assertEqual((result["created"], result["skipped"]), (1, 2))
+        self.assertEqual([(row["row"], row["error"]) for row in result["rejected_rows"]], [
+            (2, "category_slug 'tapes' is not a known category."),
+            (3, "category_slug is required."),
+        ])
+
+    def test_unknown_and_cyclic_parents_are_reported(self):
+        header = "name,slug,is_active,level,parent_slug"
+        self.load(load_categories, header, "Root,root,true,0,", "Child,child,true,0,root")
+
+        result = self.load(load_categories, header,
+                           "Orphan,orphan,true,0,nowhere",
+                           "Below orphan,below-orphan,true,0,orphan",  # its parent is rejected
+                           "A,a,true,0,b",
+                           "B,b,true,0,a",
+                           "Root,root,true,0,child",                   # under its stored child
+                           "Fine,fine,true,0,child")
+        self.assertEqual([(row["row"], row["slug"], row["error"]) for row in result["rejected_rows"]], [
+            (1, "orphan", "parent_slug 'nowhere' is not a known category."),
+            (2, "below-orphan", "parent_slug 'orphan' is rejected too."),
+            (3, "a", "parent_slug would make a cycle."),
+            (4, "b", "parent_slug would make a cycle."),
+            (5, "root", "parent_slug would make a cycle."),
+        ])
+        self.assertEqual((result["created"], result["updated"]), (1, 0))
+        self.assertEqual(dict(Category.objects.values_list("slug", "parent_id__slug")),
+                         {"root": None, "child": "root", "fine": "child"})
+        self.assertEqual(Category.objects.get(slug="fine").level, 2)
+
+    def test_load_route_within_budget(self):
+        body = "name,slug,is_active,level,parent_slug\nA,a,true,0,\nB,b,true,0,a\nC,c,true,0,x\n"
+        result = self.client.post("/api/mod4/catalog/load/?kind=category", body, content_type="text/csv").json()
+        self.assertEqual((result["created"], result["rejected"]), (2, 1))
+
+    def test_staging_never_drops_a_real_table(self):
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE TABLE catalog_category_stage (id int)")
+        self.load(load_categories, "name,slug,is_active,level,parent_slug", "Toys,toys,true,0,")
+        self.load(load_categories, "name,slug,is_active,level,parent_slug", "Toys,toys,true,0,")
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('public.catalog_category_stage') IS NOT NULL")
+            self.assertTrue(cursor.fetchone()[0])
+
+
+@skipUnless(connection.vendor == "postgresql", "needs concurrent writers")
+class StockConcurrencyTests(TransactionTestCase):
+    """ Checkouts from many threads never oversell """
+
+    def test_threads_never_oversell(self):
+        user_id, product_ids = hammer.setup(products=2, stock=30)
+        tally = hammer.run_threads(user_id, product_ids, threads=8, orders=10, max_lines=2)
+        self.assertEqual(tally["failed"], 0)
+        self.assertEqual(tally["accepted"] + tally["rejected"], 80)
+        self.assertTrue(tally["rejected"], "stock should run out")
+        self.assertEqual(hammer.verify(product_ids, stock=30), [])
+        self.assertEqual(Order.objects.count(), tally["accepted"])
+
+    def test_striped_threads_never_oversell(self):
+        user_id, product_ids = hammer.setup(products=1, stock=40, stripes=4)
+        tally = hammer.run_threads(user_id, product_ids, threads=8, orders=10, max_lines=1)
+        self.assertEqual(tally["failed"], 0)
+        self.assertTrue(tally["rejected"], "stock should run out")
+        self.assertEqual(hammer.verify(product_ids, stock=40), [])
+
+
+class PromotionPricingTests(TestCase):
+    """ Effective prices from the database and from the in-process promotion index agree """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Phones", slug="phones")
+        cls.a, cls.b, cls.c = [
+            Product.objects.create(name=f"Phone {i}", slug=f"phone-{i}", price=Decimal("19.99"),
+                                   category_id=category)
+            for i in range(3)
+        ]
+        now = timezone.now()
+        cls.sale = PromotionEvent.objects.create(name="Sale", start_date=now - timedelta(days=1),
+                                                 end_date=now + timedelta(days=1), price_reduction=20)
+        cls.flash = PromotionEvent.objects.create(name="Flash", start_date=now - timedelta(hours=1),
+                                                  end_date=now + timedelta(hours=1), price_reduction=50)
+        cls.later = PromotionEvent.objects.create(name="Later", start_date=now + timedelta(days=5),
+                                                  end_date=now + timedelta(days=6), price_reduction=10)
+        cls.sale.products.add(cls.a, cls.b)
+        cls.flash.products.add(cls.b)
+        cls.later.products.add(cls.c)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_database_and_index_agree(self):
+        ids = [self.a.id, self.b.id, self.c.id]
+        expected = {self.a.id: 20, self.b.id: 50, self.c.id: 0}
+        prices = effective_prices(ids)
+        self.assertEqual({pid: row["price_reduction"] for pid, row in prices.items()}, expected)
+        self.assertEqual(prices[self.a.id]["effective_price"], Decimal("15.99"))
+        self.assertEqual(promotion_index().reductions(ids), expected)
+
+        in_five_days = timezone.now() + timedelta(days=5, hours=1)
+        self.assertEqual(promotion_index().reductions(ids, in_five_days), {self.a.id: 0, self.b.id: 0, self.c.id: 10})
+        self.assertEqual(effective_prices([self.c.id], in_five_days)[self.c.id]["price_reduction"], 10)
+
+    def test_index_follows_promotion_writes(self):
+        first = self.client.get("/api/mod/6/products/priced", {"page_size": 3})
+        warm = self.client.get("/api/mod/6/products/priced", {"page_size": 3})
+        self.assertEqual((first["X-DB-Queries"], warm["X-DB-Queries"]), ("3", "1"))
+
+        self.flash.products.add(self.c)
+        items = {row["id"]: row for row in self.client.get("/api/mod/6/products/priced").json()["items"]}
+        self.assertEqual(items[self.c.id]["price_reduction"], 50)
+        self.assertEqual(items[self.c.id]["effective_price"], 10.0)
+
+        self.flash.delete()
+        response = self.client.get("/api/mod/6/products/effective-prices", {"ids": [self.b.id, self.c.id]})
+        self.assertEqual([row["price_reduction"] for row in response.json()], [20, 0])
+        self.assertEqual(promotion_index().reductions([self.b.id, self.c.id]), {self.b.id: 20, self.c.id: 0})
+
+    def test_inverted_windows_are_rejected(self):
+        def create(start, end):
+            payload = {"name": "Backwards", "start_date": start, "end_date": end,
+                       "price_reduction": 10, "products": [{"product_id": self.a.id}]}
+            return self.client.post("/api/mod4/promotion/create/", json.dumps(payload),
+                                    content_type="application/json")
+
+        response = create("2030-05-02", "2030-05-01")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"detail": "The promotion cannot end before it starts."})
+        self.assertEqual(create("2030-02-30", "2030-03-01").status_code, 400)
+        self.assertEqual(create("tomorrow", "2030-03-01").status_code, 400)
+        self.assertFalse(PromotionEvent.objects.filter(name="Backwards").exists())
+        self.assertEqual(create("2030-05-01", "2030-05-01").json()["status"], "created")
+
+        # the admin form validates the constraint too
+        promotion = PromotionEvent(name="Backwards in admin", start_date=self.sale.end_date,
+                                   end_date=self.sale.start_date, price_reduction=10)
+        with self.assertRaisesMessage(ValidationError, "The promotion cannot end before it starts."):
+            promotion.full_clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            promotion.save()
+
+    def test_interval_tree_matches_brute_force(self):
+        rng = random.Random(7)
+        intervals = []
+        for n in range(300):
+            start = rng.randint(0, 1000)
+            intervals.append((start, start + rng.randint(0, 80), n))
+        tree = IntervalTree(intervals)
+        for point in range(-5, 1100, 7):
+            self.assertEqual(sorted(tree.at(point)),
+                             [n for start, end, n in intervals if start <= point <= end])
+
+
+class PromotionProductLinkTests(TestCase):
+    """ Bulk linking of products to a promotion """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.phones = Category.objects.create(name="Phones", slug="phones")
+        cls.android = Category.objects.create(name="Android", slug="android", parent_id=cls.phones, level=1)
+        cls.cables = Category.objects.create(name="Cables", slug="cables")
+        cls.pixel = Product.objects.create(name="Pixel", slug="pixel", price=Decimal("500.00"), category_id=cls.android)
+        cls.case = Product.objects.create(name="Case", slug="case", price=Decimal("10.00"), category_id=cls.phones)
+        cls.usb = Product.objects.create(name="USB", slug="usb", price=Decimal("5.00"), category_id=cls.cables)
+        now = timezone.now()
+        cls.sale = PromotionEvent.objects.create(name="Sale", start_date=now - timedelta(days=1),
+                                                 end_date=now + timedelta(days=1), price_reduction=20)
+
+    def setUp(self):
+        cache.clear()
+
+    def linked(self):
+        return set(self.sale.products.values_list("id", flat=True))
+
+    def test_link_by_ids(self):
+        url = f"/api/mod4/promotion/{self.sale.id}/products/"
+        response = self.client.post(url, {"product_ids": [self.pixel.id, 999999]}, content_type="application/json")
+        self.assertEqual(response.json()["missing_product_ids"], [999999])
+        # linking again is a no-op, not an IntegrityError
+        response = self.client.post(url, {"product_ids": [self.pixel.id, self.usb.id]}, content_type="application/json")
+        self.assertEqual(response.json()["linked_products"], 2)
+        self.assertEqual(self.linked(), {self.pixel.id, self.usb.id})
+
+        response = self.client.delete(url, {"product_ids": [self.usb.id]}, content_type="application/json")
+        self.assertEqual(response.json()["unlinked_products"], 1)
+        self.assertEqual(self.linked(), {self.pixel.id})
+
+    def test_link_category_subtree_and_filter(self):
+        self.assertEqual(promotion_index().reductions([self.pixel.id]), {self.pixel.id: 0})
+        url = f"/api/mod4/promotion/{self.sale.id}/products/category/{self.phones.id}/"
+        self.assertEqual(self.client.post(url).json()["added_products"], 2)
+        self.assertEqual(self.client.post(url).json()["added_products"], 0)
+        self.assertEqual(self.linked(), {self.pixel.id, self.case.id})
+        self.assertEqual(promotion_index().reductions([self.pixel.id]), {self.pixel.id: 20})
+
+        url = f"/api/mod4/promotion/{self.sale.id}/products/filter/"
+        response = self.client.post(url, {"max_price": 20}, content_type="application/json")
+        self.assertEqual(response.json()["added_products"], 1)
+        response = self.client.delete(url, {"category_id": self.android.id}, content_type="application/json")
+        self.assertEqual(response.json()["unlinked_products"], 1)
+        self.assertEqual(self.linked(), {self.case.id, self.usb.id})
+        self.assertEqual(promotion_index().reductions([self.pixel.id]), {self.pixel.id: 0})
+
+        response = self.client.post("/api/mod4/promotion/999999/products/filter/", {}, content_type="application/json")
+        self.assertEqual(response.json(), {"error": "Promotion not found."})
+
+
+class OrderHistoryTests(TestCase):
+    """ /orders/ loads a page of orders with lines and totals in a fixed number of queries """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Phones", slug="phones")
+        cls.products = [
+            Product.objects.create(name=f"Phone {i}", slug=f"phone-{i}", price=Decimal("10.50") + i,
+                                   category_id=category)
+            for i in range(5)
+        ]
+        cls.user = User.objects.create(username="buyer")
+        cls.other = User.objects.create(username="other")
+        Order.objects.create(user=cls.other)
+
+    def place_orders(self, count, lines):
+        for _ in range(count):
+            order = Order.objects.create(user=self.user)
+            OrderProduct.objects.bulk_create([
+                OrderProduct(order=order, product=product, quantity=n + 1)
+                for n, product in enumerate(self.products[:lines])
+            ])
+
+    def history(self, **params):
+        return self.client.get("/api/mod/6/orders/", {"user_id": self.user.id, **params})
+
+    def test_totals_and_lines(self):
+        self.place_orders(1, 2)
+        [order] = self.history().json()["items"]
+        self.assertEqual(order["item_count"], 3)
+        self.assertEqual(order["total"], 10.50 * 1 + 11.50 * 2)
+        self.assertEqual([line["line_total"] for line in order["lines"]], [10.50, 23.0])
+        self.assertEqual(order["lines"][0]["category_name"], "Phones")
+
+    def test_query_count_does_not_grow_with_history(self):
+        self.place_orders(2, 1)
+        small = self.history()
+        self.place_orders(30, 5)
+        large = self.history(page_size=20)
+        self.assertEqual(len(large.json()["items"]), 20)
+        self.assertEqual(small["X-DB-Queries"], large["X-DB-Queries"])
+        self.assertEqual(large["X-DB-Queries"], "2")
+
+    def test_cursor_walks_the_whole_history(self):
+        self.place_orders(7, 1)
+        seen, cursor = [], None
+        while True:
+            page = self.history(page_size=3, **({"cursor": cursor} if cursor else {})).json()
+            seen += [order["id"] for order in page["items"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        expected = list(Order.objects.filter(user=self.user).order_by("-created_date", "-id")
+                        .values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.history(cursor="nope").status_code, 400)
+
+
+class ValuesSerializationTests(TestCase):
+    """ @values_response routes answer like the schema over model instances """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.root = Category.objects.create(name="Electronics", slug="electronics")
+        cls.phones = Category.objects.create(name="Phones", slug="phones", parent_id=cls.root)
+        for i in range(3):
+            Product.objects.create(name=f"Phone {i}", slug=f"phone-{i}", price=Decimal("9.99") + i,
+                                   category_id=cls.phones)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_matches_schema_serialization(self):
+        for url, schema, qs in [
+            ("/api/mod/6/categories/", CategorySchemaOut, Category.objects.all()),
+            ("/api/mod/6/products/", ProductOutSchema, Product.objects.all()),
+        ]:
+            adapter = TypeAdapter(list[schema])
+            expected = json.loads(adapter.dump_json(adapter.validate_python(list(qs))))
+            response = self.client.get(url)
+            self.assertEqual(response["Content-Type"], "application/json")
+            self.assertEqual(sorted(response.json(), key=lambda row: row["id"]),
+                             sorted(expected, key=lambda row: row["id"]))
+
+        # parent ids come from the column, no query per parent
+        self.assertEqual(self.client.get("/api/mod/6/categories/")["X-DB-Queries"], "1")
+        self.assertIn("ETag", self.client.get("/api/mod/6/products/"))
+
+    def test_module5_all_categories_gives_parent_ids(self):
+        for url in ["/api/mod5/category/all", "/api/mod5/async/category/all"]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response["X-DB-Queries"], "1")
+                rows = {row["slug"]: row for row in response.json()}
+                self.assertEqual(rows["phones"]["parent_id"], self.root.id)
+                self.assertIsNone(rows["electronics"]["parent_id"])
+
+
+class ExportTests(TestCase):
+    """ Streaming product exports """
+
+    def content(self, response):
+        if response.is_async:
+            async def collect():
+                return b"".join([chunk async for chunk in response.streaming_content])
+            return async_to_sync(collect)()
+        return b"".join(response.streaming_content)
+
+    def test_json_and_ndjson(self):
+        category = Category.objects.create(name="Phones", slug="phones")
+        for i in range(250):
+            Product.objects.create(name=f"P{i}", slug=f"p-{i}", price=Decimal("1.50") + i,
+                                   category_id=category, is_active=i % 2 == 0)
+
+        expected = sorted(self.client.get("/api/mod/6/products/", {"active": True}).json(),
+                          key=lambda p: p["id"])
+        url = "/api/mod/6/products/export"
+        params = {"active": True, "chunk_size": 100}
+        as_array = json.loads(self.content(self.client.get(url, params)))
+        response = self.client.get(url, {**params, "format": "ndjson"})
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        as_lines = [json.loads(line) for line in self.content(response).splitlines()]
+
+        self.assertEqual(as_array, as_lines)
+        self.assertEqual(len(as_array), 125)
+        self.assertEqual(as_array[0]["category_id"], category.id)
+        for row, product in zip(as_array, expected):
+            self.assertEqual({k: row[k] for k in product}, product)
+
+    def test_streams_sync_rows_under_wsgi(self):
+        # The test client goes through the WSGI handler, which would read an
+        # async iterator into memory before sending anything
+        Category.objects.create(name="Phones", slug="phones")
+        for path in ["/api/mod/6/products/export", "/api/mod/6/categories/export"]:
+            with self.subTest(path=path):
+                response = self.client.get(path, {"format": "ndjson"})
+                self.assertTrue(response.streaming)
+                self.assertFalse(response.is_async)
+
+
+@override_settings(ALLOWED_HOSTS=["localhost"])
+class AsgiExportTests(TransactionTestCase):
+    """ The export routes stream under ASGI instead of being buffered """
+
+    def test_exports_stream_under_asgi(self):
+        category = Category.objects.create(name="Phones", slug="phones")
+        for i in range(150):
+            Product.objects.create(name=f"P{i}", slug=f"p-{i}", price=10, category_id=category)
+
+        client = AsgiClient(asgi_application)
+        for path, count in [("/api/mod/6/products/export", 150), ("/api/mod/6/categories/export", 1)]:
+            with self.subTest(path=path), warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                status, headers, body = async_to_sync(client.request)(
+                    "GET", path, {"format": "ndjson", "chunk_size": 100}, None)
+                self.assertEqual(status, 200)
+                self.assertEqual(len(body.splitlines()), count)
+                # Django warns when it has to buffer a sync iterator for ASGI
+                self.assertFalse([w for w in caught if "synchronous iterators" in str(w.message)])
+
+
+@skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is optional")
+class ColumnarExportTests(TestCase):
+    """ Parquet / Arrow exports and watermarks """
+
+    def test_order_lines_and_incremental_products(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        category = Category.objects.create(name="Phones", slug="phones")
+        phone = Product.objects.create(name="Phone", slug="phone", price=Decimal("9.99"), category_id=category,
+                                       description="")
+        case = Product.objects.create(name="Case", slug="case", price=Decimal("2.50"), category_id=category)
+        order = Order.objects.create(user=User.objects.create(username="buyer"))
+        OrderProduct.objects.create(order=order, product=phone, quantity=3)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            lines = export_dataset("order_lines", os.path.join(tmp, "lines.parquet"))
+            rows = pq.read_table(os.path.join(tmp, "lines.parquet")).to_pylist()
+            self.assertEqual(lines["rows"], 1)
+            self.assertEqual((rows[0]["quantity"], rows[0]["line_total"]), (3, Decimal("29.97")))
+            self.assertEqual(rows[0]["created_date"], order.created_date)
+
+            full = export_dataset("products", os.path.join(tmp, "products.arrow"), "arrow")
+            table = pa.ipc.open_file(os.path.join(tmp, "products.arrow")).read_all()
+            by_name = {row["name"]: row for row in table.to_pylist()}
+            self.assertEqual((by_name["Phone"]["description"], by_name["Case"]["description"]), ("", None))
+            self.assertEqual(full["watermark"], case.updated_at)
+
+            Product.objects.filter(pk=phone.pk).update(updated_at=case.updated_at + timedelta(seconds=1))
+            newer = export_dataset("products", os.path.join(tmp, "newer.parquet"), since=full["watermark"])
+            self.assertEqual(newer["rows"], 1)
+            self.assertEqual(pq.read_table(os.path.join(tmp, "newer.parquet")).column("name").to_pylist(), ["Phone"])
+
+
+class ProfilingTests(TestCase):
+    """ profile_examples building blocks """
+
+    def test_profile_example(self):
+        Category.objects.create(name="Electronics", slug="electronics")
+
+        def ex1_values():
+            print(list(Category.objects.values("name")))
+            print(Product.objects.count())
+
+        result = profile_example("examples.ex1_values", ex1_values, repeat=2)
+        self.assertIsNone(result["error"])
+        self.assertEqual((result["group"], result["variant"]), ("examples.ex1", "values"))
+        self.assertEqual(result["queries"], 2)
+        self.assertEqual(len(result["statements"]), 2)
+        self.assertTrue(all(s["plan"] for s in result["statements"]))
+
+    def test_profile_example_error(self):
+        def ex2():
+            Category.objects.get(name="missing")
+
+        result = profile_example("examples.ex2", ex2)
+        self.assertTrue(result["error"].startswith("DoesNotExist"))
+
+    def test_compare(self):
+        baseline = {
+            "a.ex1": {"queries": 1, "time_ms": 10.0, "error": None},
+            "a.ex2": {"queries": 5, "time_ms": 10.0, "error": None},
+            "a.ex3": {"queries": 1, "time_ms": 10.0, "error": None},
+            "a.ex4": {"queries": 1, "time_ms": 10.0, "error": None},
+        }
+        results = {
+            "a.ex1": {"queries": 2, "time_ms": 10.0, "error": None},
+            "a.ex2": {"queries": 1, "time_ms": 10.0, "error": None},
+            "a.ex3": {"queries": 1, "time_ms": 10.5, "error": None},
+            "a.ex5": {"queries": 1, "time_ms": 1.0, "error": None},
+        }
+        statuses = {d["key"]: d["status"] for d in compare(results, baseline)}
+        self.assertEqual(statuses, {
+            "a.ex1": "regression", "a.ex2": "improvement", "a.ex4": "removed", "a.ex5": "new",
+        })
+
+
+class SeedingTests(TestCase):
+    """ seed_dataset is deterministic and consistent """
+
+    def snapshot(self):
+        return (
+            list(Category.objects.order_by("id").values_list("name", "parent_id__name", "level", "is_active")),
+            list(Product.objects.order_by("id").values_list("slug", "price", "category_id__name")),
+            list(OrderProduct.objects.order_by("id").values_list("order__user__username", "product__slug", "quantity")),
+        )
+
+    def test_same_seed_same_rows(self):
+        counts = seed_dataset(scale=0.02, seed=7)
+        self.assertEqual((counts["categories"], counts["products"], counts["orders"]), (20, 400, 200))
+        self.assertEqual(counts["order_products"], OrderProduct.objects.count())
+        first = self.snapshot()
+
+        clear_dataset()
+        seed_dataset(scale=0.02, seed=7)
+        self.assertEqual(self.snapshot(), first)
+
+        clear_dataset()
+        seed_dataset(scale=0.02, seed=8)
+        self.assertNotEqual(self.snapshot(), first)
+
+    def test_dataset_is_consistent(self):
+        seed_dataset(scale=0.02, categories=50, orders=30)
+        self.assertFalse(
+            Category.objects.filter(parent_id__isnull=False).exclude(level=F("parent_id__level") + 1).exists()
+        )
+        self.assertFalse(Order.objects.filter(orderproduct__isnull=True).exists())
+        # sequences continue after the explicit ids
+        Category.objects.create(name="After seeding", slug="after-seeding")
+
+    def test_refuses_non_empty_tables(self):
+        Category.objects.create(name="Existing", slug="existing")
+        with self.assertRaises(ValueError):
+            seed_dataset(scale=0.01)
+
+
+class BenchTests(TestCase):
+    """ bench_api request plans and summaries """
+
+    bench_fixtures = {
+        "category_ids": [1, 2, 3, 4, 5], "category_names": ["a", "b", "c", "d", "e"],
+        "product_ids": [10, 11, 12, 13, 14, 15], "product_names": ["p1", "p2"],
+        "product_slugs": ["p-1", "p-2"], "user_ids": [7, 8, 9, 10, 11], "run": "x",
+    }
+
+    def test_plan_is_deterministic(self):
+        endpoints = select_endpoints("mixed")
+        first = build_plan(endpoints, self.bench_fixtures, 200, seed=3)
+        again = build_plan(endpoints, self.bench_fixtures, 200, seed=3)
+        self.assertEqual([c[1:] for c in first], [c[1:] for c in again])
+        self.assertNotEqual([c[1:] for c in first], [c[1:] for c in build_plan(endpoints, self.bench_fixtures, 200, seed=4)])
+        self.assertTrue(all(not c[0].write for c in build_plan(select_endpoints("read"), self.bench_fixtures, 50)))
+
+    def test_summarize(self):
+        samples = [
+            {"endpoint": "a", "ms": float(ms), "error": ms == 100, "queries": 2, "db_ms": 0.5}
+            for ms in range(1, 101)
+        ]
+        result = summarize(samples, seconds=2.0)
+        stats = result["endpoints"]["a"]
+        self.assertEqual((stats["p50_ms"], stats["p95_ms"], stats["p99_ms"]), (50.0, 95.0, 99.0))
+        self.assertEqual((stats["errors"], stats["throughput_rps"], stats["queries_per_request"]), (1, 50.0, 2))
+        self.assertEqual(percentile([3.0], 99), 3.0)
+
+    def test_async_twins_return_the_same_responses(self):
+        seed_dataset(scale=0.01, seed=5)
+        plan = build_plan(select_endpoints("read"), load_fixtures(), 120, seed=1)
+        for endpoint, _, path, query, _ in plan:
+            expected = self.client.get(path, query)
+            actual = self.client.get(async_path(path), query)
+            self.assertEqual(actual.status_code, expected.status_code, endpoint.name)
+            self.assertEqual(actual.json(), expected.json(), endpoint.name)
+        self.assertEqual({e.name for e in select_endpoints("async")},
+                         {f"{e.name}.async" for e in select_endpoints("read")})
 
-# Create your tests here.
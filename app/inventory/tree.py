@@ -0,0 +1,84 @@
+""" Recursive CTE helpers for the Category self-FK tree
+
+Each helper turns a seed "SELECT id ..." into SQL that returns the ids
+of the whole subtree or ancestor chain in a single statement, instead of
+following parent_id one query per level. The id queries use UNION (not
+UNION ALL) so a corrupted cycle can't make them recurse forever;
+Category.save() refuses moves that would create one.
+"""
+
+from django.db import connection
+
+CATEGORY_TABLE = "inventory_category"
+
+
+def descendant_ids_sql(seed_sql, include_self=False):
+    anchor = (
+        f"SELECT id FROM {CATEGORY_TABLE} WHERE id IN ({seed_sql})"
+        if include_self else
+        f"SELECT id FROM {CATEGORY_TABLE} WHERE parent_id_id IN ({seed_sql})"
+    )
+    return f"""
+        WITH RECURSIVE tree(id) AS (
+            {anchor}
+            UNION
+            SELECT c.id FROM {CATEGORY_TABLE} c JOIN tree t ON c.parent_id_id = t.id
+        )
+        SELECT id FROM tree
+    """
+
+
+def ancestor_ids_sql(seed_sql, include_self=False):
+    anchor = (
+        f"SELECT id, parent_id_id FROM {CATEGORY_TABLE} WHERE id IN ({seed_sql})"
+        if include_self else
+        f"SELECT id, parent_id_id FROM {CATEGORY_TABLE} "
+        f"WHERE id IN (SELECT parent_id_id FROM {CATEGORY_TABLE} WHERE id IN ({seed_sql}))"
+    )
+    return f"""
+        WITH RECURSIVE tree(id, parent_id) AS (
+            {anchor}
+            UNION
+            SELECT c.id, c.parent_id_id FROM {CATEGORY_TABLE} c JOIN tree t ON c.id = t.parent_id
+        )
+        SELECT id FROM tree
+    """
+
+
+def sync_levels(*root_ids):
+    """ Set level = depth below the root for the subtrees of root_ids (the
+        whole forest when none are given) in one UPDATE, each root keeping its
+        own level. Returns the number of rows changed."""
+    if not root_ids:
+        anchor = f"SELECT id, 0 FROM {CATEGORY_TABLE} WHERE parent_id_id IS NULL"
+        params = []
+    else:
+        # a root inside another root's subtree is re-levelled from that one,
+        # anchoring both would give it two depths
+        seed = ", ".join(["%s"] * len(root_ids))
+        anchor = (
+            f"SELECT id, CAST(level AS integer) FROM {CATEGORY_TABLE} "
+            f"WHERE id IN ({seed}) AND id NOT IN ({descendant_ids_sql(seed)})"
+        )
+        params = [*root_ids, *root_ids]
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH RECURSIVE tree(id, depth) AS (
+                {anchor}
+                UNION
+                SELECT c.id, t.depth + 1 FROM {CATEGORY_TABLE} c JOIN tree t ON c.parent_id_id = t.id
+            )
+            UPDATE {CATEGORY_TABLE}
+            SET level = (SELECT depth FROM tree WHERE tree.id = {CATEGORY_TABLE}.id)
+            WHERE id IN (
+                SELECT tree.id FROM tree
+                JOIN {CATEGORY_TABLE} c ON c.id = tree.id
+                WHERE c.level <> tree.depth
+            )
+        """, params)
+        if cursor.rowcount < 0 and connection.vendor == "sqlite":
+            # sqlite3 reports -1 for statements that start with WITH
+            cursor.execute("SELECT changes()")
+            return cursor.fetchone()[0]
+        return cursor.rowcount